@@ -0,0 +1,94 @@
+"""
+Кэш готовых ответов LLM на повторяющиеся вопросы покупателей.
+
+"Ещё актуально?", "Где забрать?", "Торг уместен?" приходят постоянно, а
+каждый вызов Perplexity — это секунды. Ответ кэшируется по ключу
+(project id, хэш system prompt, нормализованный текст вопроса):
+- хэш промпта меняется вместе с проектом, поэтому после правки настроек
+  старые ответы автоматически перестают находиться;
+- записи живут ttl_seconds и вытесняются по LRU при переполнении;
+- purge(project_id) чистит ответы проекта (из админки и при сохранении проекта).
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize_message(text: str) -> str:
+    """Нижний регистр, ё→е, без пунктуации и лишних пробелов."""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _prompt_hash(system_prompt: str) -> str:
+    return hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AnswerCache:
+    """Потокобезопасный TTL/LRU-кэш ответов со счётчиками попаданий."""
+
+    def __init__(self, maxsize: int = 2048, ttl_seconds: float = 3600.0, max_message_length: int = 200) -> None:
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.max_message_length = max_message_length
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # ключ -> (время добавления, ответ)
+        self._items: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+
+    def _key(self, project_id: str, system_prompt: str, user_message: str) -> Optional[Tuple[str, str, str]]:
+        normalized = normalize_message(user_message)
+        # Длинные сообщения почти не повторяются — не тратим на них место
+        if not normalized or len(normalized) > self.max_message_length:
+            return None
+        return (project_id, _prompt_hash(system_prompt), normalized)
+
+    def get(self, project_id: str, system_prompt: str, user_message: str) -> Optional[str]:
+        key = self._key(project_id, system_prompt, user_message)
+        if key is None:
+            return None
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.monotonic() - item[0] < self.ttl_seconds:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, project_id: str, system_prompt: str, user_message: str, answer: str) -> None:
+        key = self._key(project_id, system_prompt, user_message)
+        if key is None or not answer:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic(), answer)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def purge(self, project_id: Optional[str] = None) -> int:
+        """Удаляет ответы проекта (или все, если project_id не задан). Возвращает число записей."""
+        with self._lock:
+            if project_id is None:
+                removed = len(self._items)
+                self._items.clear()
+                return removed
+            keys = [key for key in self._items if key[0] == project_id]
+            for key in keys:
+                del self._items[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
@@ -1,6 +1,12 @@
 import httpx
 from typing import Optional, Dict, Any
 
+from app.clients.http_transport import HttpTransport, http_transport
+
+
+# Метка строки описания в format_item_for_prompt — по ней бюджет промпта
+# находит и укорачивает описание (app.prompts.assemble_prompt)
+DESCRIPTION_LABEL = "Описание: "
 
 
 class AvitoItemClient:
@@ -11,8 +17,9 @@ class AvitoItemClient:
     
     BASE_URL = "https://api.avito.ru/core/v1"
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, transport: Optional[HttpTransport] = None):
         self.access_token = access_token
+        self.transport = transport or http_transport
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -32,18 +39,17 @@ class AvitoItemClient:
         url = f"{self.BASE_URL}/accounts/{user_id}/items/{item_id}"
         
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, headers=self.headers)
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 404:
-                    print(f"[AvitoItemClient] Item not found: user_id={user_id}, item_id={item_id}")
-                    return None
-                else:
-                    print(f"[AvitoItemClient] Error {response.status_code}: {response.text}")
-                    return None
-                    
+            response = await self.transport.request("GET", url, headers=self.headers)
+
+            if response.status_code == 200:
+                return response.json()
+            elif response.status_code == 404:
+                print(f"[AvitoItemClient] Item not found: user_id={user_id}, item_id={item_id}")
+                return None
+            else:
+                print(f"[AvitoItemClient] Error {response.status_code}: {response.text}")
+                return None
+
         except httpx.TimeoutException:
             print(f"[AvitoItemClient] Timeout getting item {item_id}")
             return None
@@ -73,7 +79,7 @@ class AvitoItemClient:
         # Описание
         if "description" in item_data:
             desc = item_data["description"][:500]  # Ограничиваем длину
-            parts.append(f"Описание: {desc}")
+            parts.append(f"{DESCRIPTION_LABEL}{desc}")
         
         # Цена
         if "price" in item_data:
@@ -1,38 +1,230 @@
 import json
+import logging
 import os
 import threading
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Dict, List, Optional, TextIO, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def truncate_partial_line(path: str, chunk_size: int = 64 * 1024) -> bool:
+    """
+    Обрезает append-only файл JSON-строк до последнего перевода строки.
+
+    После падения посреди write в конце остаётся недописанная строка; если
+    её не срезать, следующая дописанная запись приклеится к ней и тоже
+    станет нечитаемой. Возвращает True, если файл пришлось обрезать.
+    """
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return False
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return False
+        # Ищем последний перевод строки с конца, кусками
+        pos = end
+        keep = 0
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            pos = start
+        f.truncate(keep)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
 
 class ChatState:
-    """Состояние чатов: последний обработанный message_id по chat_id."""
-    
-    def __init__(self, path: str = "data/chat_state.json"):
+    """
+    Состояние чатов: последний обработанный message_id по chat_id.
+
+    Хранение — снапшот + append-only журнал (write-ahead log):
+    - {path}      — компактный JSON-снапшот {chat_id: message_id};
+    - {path}.log  — JSON-строки ["chat_id", "message_id"], дописываются в конец.
+
+    Запись в set_* стоит O(1): значение попадает в память и в буфер,
+    буфер пачкой дописывается в журнал с fsync фоновым потоком — раз в
+    flush_interval секунд или сразу, как набрался batch_size записей. Поэтому при падении
+    процесса теряется не больше flush_interval секунд (batch_size записей).
+    Когда журнал вырастает до размера состояния (но не меньше
+    compact_threshold строк), он сворачивается в новый снапшот —
+    амортизированно это тоже O(1) на запись.
+    """
+
+    def __init__(
+        self,
+        path: str = "data/chat_state.json",
+        flush_interval: float = 1.0,
+        batch_size: int = 256,
+        compact_threshold: int = 10_000,
+    ):
         self.path = path
+        self.log_path = f"{path}.log"
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_threshold = compact_threshold
+
         self._lock = threading.Lock()
         self._state: Dict[str, str] = {}  # chat_id -> last_message_id
+        self._pending: List[Tuple[str, str]] = []
+        self._log_entries = 0
+        self._log_file: Optional[TextIO] = None
+
+        # Сериализует запись на диск; _lock на время записи не держится
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+        self._state = self._load()
 
     def _load(self) -> Dict[str, str]:
-        if not os.path.exists(self.path):
-            return {}
-        try:
-            with open(self.path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-
-    def _save(self):
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        state: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except Exception:
+                logger.exception("Failed to read chat state snapshot %s, starting empty", self.path)
+                state = {}
+
+        # Доигрываем журнал поверх снапшота. Недописанную последнюю строку
+        # (падение посреди write) срезаем: журнал дальше дописывается в конец.
+        if os.path.exists(self.log_path):
+            if truncate_partial_line(self.log_path):
+                logger.warning("Truncated partial last line of chat state log %s", self.log_path)
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        chat_id, message_id = json.loads(line)
+                    except (ValueError, TypeError):
+                        logger.warning("Skipping corrupt chat state log line: %r", line[:100])
+                        continue
+                    state[chat_id] = message_id
+                    self._log_entries += 1
+        return state
+
+    def _save(self, state: Dict[str, str]) -> None:
+        """Атомарно пишет снапшот состояния (с fsync)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
         tmp_path = f"{self.path}.tmp"
         with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(self._state, f, ensure_ascii=False, indent=2)
+            json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(tmp_path, self.path)
 
+    def _open_log(self) -> TextIO:
+        if self._log_file is None:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        return self._log_file
+
+    def _write_pending(self, pending: List[Tuple[str, str]]) -> None:
+        """Дописывает пачку в журнал с fsync; вызывается под _save_lock, без _lock."""
+        log = self._open_log()
+        log.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in pending))
+        log.flush()
+        os.fsync(log.fileno())
+        self._log_entries += len(pending)
+
+    def _write_snapshot(self, state: Dict[str, str]) -> None:
+        """
+        Сворачивает журнал в снапшот; вызывается под _save_lock, без _lock.
+
+        state снят под _lock вместе с последней пачкой, поэтому всё, что уже
+        лежит в журнале, в нём учтено, а более новые записи ещё в буфере.
+        Сначала новый снапшот, потом обнуляем журнал. Если упадём между
+        этими шагами, журнал доиграется поверх снапшота — это идемпотентно.
+        """
+        self._save(state)
+        if self._log_file is not None:
+            self._log_file.close()
+        self._log_file = open(self.log_path, "w", encoding="utf-8")
+        self._log_entries = 0
+
+    def _flush(self, compact: bool = False) -> None:
+        # Под _lock только забираем буфер (и копию состояния для снапшота);
+        # запись и fsync идут вне него, get/set на event loop их не ждут.
+        with self._save_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                if self._log_entries + len(pending) >= max(self.compact_threshold, len(self._state)):
+                    compact = True
+                state = dict(self._state) if compact else None
+            if pending:
+                try:
+                    self._write_pending(pending)
+                except Exception:
+                    # Не теряем буфер: следующий flush попробует ещё раз
+                    with self._lock:
+                        self._pending = pending + self._pending
+                    raise
+            if state is not None:
+                self._write_snapshot(state)
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="chat-state-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            # Просыпаемся раз в flush_interval или раньше — когда набрался батч
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._flush()
+            except Exception:
+                logger.exception("Failed to flush chat state log")
+
+    def flush(self) -> None:
+        """Дописывает накопленные изменения в журнал и делает fsync."""
+        self._flush()
+
+    def compact(self) -> None:
+        """Принудительно сворачивает журнал в снапшот."""
+        self._flush(compact=True)
+
+    def close(self) -> None:
+        """Сбрасывает буфер на диск и останавливает фоновый поток."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        self._flush()
+        with self._save_lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def snapshot(self) -> Dict[str, str]:
+        """Копия всего состояния {chat_id: message_id} (экспорт, миграции)."""
+        with self._lock:
+            return dict(self._state)
+
     def get_last_message_id(self, chat_id: str) -> Optional[str]:
         with self._lock:
             return self._state.get(chat_id)
 
     def set_last_message_id(self, chat_id: str, message_id: str):
         with self._lock:
+            if self._state.get(chat_id) == message_id:
+                return
             self._state[chat_id] = message_id
-            self._save()
+            self._pending.append((chat_id, message_id))
+            if len(self._pending) >= self.batch_size:
+                # Пишет фоновый поток: вызывающий (поллер на event loop) не ждёт fsync
+                self._wakeup.set()
+            self._ensure_flusher()
@@ -1,66 +1,126 @@
+import asyncio
 import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
 
-import requests
+import httpx
 
+from app.clients.avito_client import AvitoClientError
+from app.clients.http_transport import HttpTransport, http_transport
+from app.clients.resilience import CircuitOpenError, Resilience, resilience_registry
 from app.settings import avito_settings
+from app.token_store import AvitoTokens, AvitoTokenStore
 
 
 logger = logging.getLogger(__name__)
 
-
+T = TypeVar("T")
 
 
 class AvitoAuthError(Exception):
     """
     Доменное исключение для ошибок авторизации Avito OAuth2.
+
+    status_code — HTTP-статус ответа (None, если до ответа не дошло).
     """
-    pass
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class AvitoAuthClient:
     """
-    Клиент для обмена authorization_code на access_token/refresh_token.
+    Клиент Avito OAuth2: обмен authorization_code и обновление токенов.
+
+    Если передан token_store, клиент также:
+    - отдаёт актуальные токены (get_valid_tokens), обновляя их заранее,
+      за avito_token_refresh_margin секунд до expires_at;
+    - гарантирует, что одновременные вызовы делят один refresh (single-flight);
+    - в фоне (start_refresher) обновляет токены, даже если запросов нет.
+
+    Все методы работы с токенами принимают account_id аккаунта Avito;
+    None — токены "default" (см. AvitoTokenStore).
 
     Важно: точный URL и формат тела нужно выровнять по актуальной
     документации Avito Auth API.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        transport: Optional[HttpTransport] = None,
+        token_store: Optional[AvitoTokenStore] = None,
+        resilience: Optional[Resilience] = None,
+    ) -> None:
         self.base_url = avito_settings.avito_auth_base_url.rstrip("/")
+        self.transport = transport or http_transport
+        self.token_store = token_store
+        self.resilience = resilience or resilience_registry.get("avito_auth")
+        self.refresh_margin = timedelta(seconds=avito_settings.avito_token_refresh_margin)
+
+        # Отдельный lock на аккаунт: refresh одного продавца не ждёт другого
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
+        self._refresher_task: Optional["asyncio.Task[None]"] = None
 
-    def exchange_code_for_tokens(self, code: str) -> dict:
+    async def exchange_code_for_tokens(self, code: str) -> dict:
         """
         Меняет authorization_code на access_token и refresh_token.
         """
-        url = "https://api.avito.ru/token"
-
-        payload = {
-            "grant_type": "authorization_code",
-            "client_id": avito_settings.avito_client_id,
-            "client_secret": avito_settings.avito_client_secret,
-            "code": code,
-            "redirect_uri": avito_settings.avito_redirect_uri,
-        }
+        return await self._request_tokens(
+            {
+                "grant_type": "authorization_code",
+                "client_id": avito_settings.avito_client_id,
+                "client_secret": avito_settings.avito_client_secret,
+                "code": code,
+                "redirect_uri": avito_settings.avito_redirect_uri,
+            }
+        )
+
+    async def refresh_access_token(self, refresh_token: str) -> dict:
+        """
+        Обновляет пару токенов по refresh_token (grant_type=refresh_token).
+        """
+        return await self._request_tokens(
+            {
+                "grant_type": "refresh_token",
+                "client_id": avito_settings.avito_client_id,
+                "client_secret": avito_settings.avito_client_secret,
+                "refresh_token": refresh_token,
+            }
+        )
+
+    async def _request_tokens(self, payload: dict) -> dict:
+        url = f"{self.base_url}/token"
 
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
         }
 
+        async def request_tokens() -> httpx.Response:
+            try:
+                resp = await self.transport.request("POST", url, data=payload, headers=headers)
+            except Exception as exc:
+                logger.exception("Error while calling Avito OAuth token endpoint")
+                raise AvitoAuthError("Failed to call Avito OAuth token endpoint") from exc
+
+            if resp.status_code // 100 != 2:
+                logger.error(
+                    "Avito OAuth token endpoint returned non-2xx status: %s, body=%s",
+                    resp.status_code,
+                    resp.text,
+                )
+                raise AvitoAuthError(
+                    f"Avito OAuth token endpoint returned status {resp.status_code}",
+                    status_code=resp.status_code,
+                )
+            return resp
+
+        # Код авторизации и refresh_token одноразовые: повторяем только запрос,
+        # который гарантированно не дошёл до Avito
         try:
-            resp = requests.post(url, data=payload, headers=headers, timeout=10)
-        except Exception as exc:
-            logger.exception("Error while calling Avito OAuth token endpoint")
-            raise AvitoAuthError("Failed to call Avito OAuth token endpoint") from exc
-
-        if resp.status_code // 100 != 2:
-            logger.error(
-                "Avito OAuth token endpoint returned non-2xx status: %s, body=%s",
-                resp.status_code,
-                resp.text,
-            )
-            raise AvitoAuthError(
-                f"Avito OAuth token endpoint returned status {resp.status_code}"
-            )
+            resp = await self.resilience.call(request_tokens, idempotent=False)
+        except CircuitOpenError as exc:
+            raise AvitoAuthError(f"Avito OAuth is unavailable: {exc}") from exc
 
         try:
             data = resp.json()
@@ -74,5 +134,143 @@ class AvitoAuthClient:
 
         return data
 
+    # --- Управление токенами -------------------------------------------------
+
+    def _store(self) -> AvitoTokenStore:
+        if self.token_store is None:
+            raise AvitoAuthError("AvitoAuthClient has no token store configured")
+        return self.token_store
+
+    def _needs_refresh(self, tokens: AvitoTokens) -> bool:
+        return tokens.expires_at - datetime.now(timezone.utc) <= self.refresh_margin
+
+    async def refresh(
+        self,
+        stale: Optional[AvitoTokens] = None,
+        account_id: Optional[str] = None,
+    ) -> AvitoTokens:
+        """
+        Обновляет токены аккаунта в сторе и возвращает новые.
+
+        Single-flight: refresh выполняется под asyncio.Lock аккаунта. Если, пока
+        мы ждали lock, токены уже обновил другой вызов (access_token в сторе
+        отличается от stale), повторно в Avito не ходим. Lock берётся по ключу
+        записи в сторе: None и id аккаунта, чьи токены лежат в "default", —
+        одни и те же токены и один и тот же lock.
+        """
+        store = self._store()
+        key = store.resolve_key(account_id)
+        if key is None:
+            raise AvitoAuthError("No Avito tokens to refresh")
+        lock = self._refresh_locks.get(key)
+        if lock is None:
+            lock = self._refresh_locks[key] = asyncio.Lock()
+
+        async with lock:
+            current = store.get_tokens(account_id)
+            if current is None:
+                raise AvitoAuthError("No Avito tokens to refresh")
+            if stale is not None and current.access_token != stale.access_token:
+                return current
+
+            data = await self.refresh_access_token(current.refresh_token)
+            tokens = AvitoTokens.from_oauth_response(data)
+            tokens.account_id = current.account_id
+            store.save_tokens(tokens)
+            logger.info(
+                "Avito access token refreshed for account %s, expires_at=%s",
+                tokens.account_id,
+                tokens.expires_at.isoformat(),
+            )
+            return tokens
+
+    async def get_valid_tokens(self, account_id: Optional[str] = None) -> Optional[AvitoTokens]:
+        """
+        Возвращает токены из стора, при необходимости обновив их заранее.
+
+        Если refresh не удался, а старый access_token ещё не истёк —
+        отдаём его: запрос может успеть пройти.
+        """
+        tokens = self._store().get_tokens(account_id)
+        if tokens is None or not self._needs_refresh(tokens):
+            return tokens
+
+        try:
+            return await self.refresh(stale=tokens, account_id=account_id)
+        except AvitoAuthError:
+            if tokens.expires_at > datetime.now(timezone.utc):
+                logger.warning("Avito token refresh failed, using current token until it expires")
+                return tokens
+            raise
+
+    async def call_with_refresh(
+        self,
+        call: Callable[[AvitoTokens], Awaitable[T]],
+        account_id: Optional[str] = None,
+    ) -> T:
+        """
+        Выполняет call(tokens) с актуальными токенами.
+
+        На 401 от Avito делает не больше одного refresh и один повтор.
+        Ошибки авторизации заворачиваются в AvitoClientError,
+        чтобы вызывающему коду хватало одной ветки обработки.
+        """
+        try:
+            tokens = await self.get_valid_tokens(account_id)
+        except AvitoAuthError as exc:
+            raise AvitoClientError(f"Failed to refresh Avito token: {exc}") from exc
+        if tokens is None:
+            raise AvitoClientError("No Avito access token configured")
+
+        try:
+            return await call(tokens)
+        except AvitoClientError as exc:
+            if exc.status_code != 401:
+                raise
+            logger.warning("Avito returned 401, refreshing token and retrying once")
+
+        try:
+            tokens = await self.refresh(stale=tokens, account_id=account_id)
+        except AvitoAuthError as exc:
+            raise AvitoClientError(f"Failed to refresh Avito token: {exc}", status_code=401) from exc
+        return await call(tokens)
+
+    async def start_refresher(self) -> None:
+        """Запускает фоновое обновление токенов в текущем event loop."""
+        if self.token_store is None or self._refresher_task is not None:
+            return
+        self._refresher_task = asyncio.create_task(self._refresher_loop(), name="avito-token-refresher")
+
+    async def stop_refresher(self) -> None:
+        task, self._refresher_task = self._refresher_task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _refresher_loop(self) -> None:
+        check_interval = avito_settings.avito_token_refresh_check_interval
+        retry_delay = avito_settings.avito_token_refresh_retry_delay
 
+        while True:
+            # Спим до ближайшего истечения, но не дольше check_interval:
+            # токены могли заменить через OAuth или подключить новый аккаунт
+            delay = check_interval
+            failed = False
+            now = datetime.now(timezone.utc)
+            for tokens in self._store().list_tokens():
+                refresh_in = (tokens.expires_at - self.refresh_margin - now).total_seconds()
+                if refresh_in > 0:
+                    delay = min(delay, refresh_in)
+                    continue
+                try:
+                    await self.refresh(stale=tokens, account_id=tokens.account_id)
+                except AvitoAuthError:
+                    logger.exception(
+                        "Background Avito token refresh failed for account %s, retrying in %ss",
+                        tokens.account_id,
+                        retry_delay,
+                    )
+                    failed = True
 
+            await asyncio.sleep(min(delay, retry_delay) if failed else delay)
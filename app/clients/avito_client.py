@@ -2,14 +2,25 @@ import logging
 import os
 from typing import Optional, List, Dict, Any
 
-import requests
+import httpx
 from pydantic import BaseModel
 
+from app.clients.avito_rate_limiter import AvitoRateLimiter, avito_rate_limiter, parse_retry_after
+from app.clients.http_transport import HttpTransport, http_transport
+from app.clients.resilience import CircuitOpenError, Resilience, resilience_registry
+
 logger = logging.getLogger(__name__)
 
 class AvitoClientError(Exception):
-    """Доменное исключение для ошибок Avito API."""
-    pass
+    """
+    Доменное исключение для ошибок Avito API.
+
+    status_code — HTTP-статус ответа Avito (None, если до ответа не дошло).
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
 
 class Chat(BaseModel):
     id: str
@@ -25,51 +36,67 @@ class Message(BaseModel):
     author_id: str
 
 class AvitoMessengerClient:
-    """Клиент для работы с Avito Messenger API."""
-
-    def __init__(self, base_url: Optional[str] = None) -> None:
+    """
+    Клиент для работы с Avito Messenger API.
+
+    Все запросы идут через общий HttpTransport (keep-alive пул соединений)
+    и общий лимитер Avito API: при превышении лимита запрос ждёт своей
+    очереди, а на 429 повторяется после Retry-After. Сетевые ошибки и 5xx
+    повторяются с backoff по политике "avito_api" (POST — только если
+    запрос не ушёл), а при серии сбоев цепь размыкается и вызовы сразу
+    падают с AvitoClientError.
+    account_id (user_id в терминах Avito) передаётся в вызов явно
+    или задаётся один раз в конструкторе.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        transport: Optional[HttpTransport] = None,
+        account_id: Optional[str] = None,
+        rate_limiter: Optional[AvitoRateLimiter] = None,
+        resilience: Optional[Resilience] = None,
+    ) -> None:
         self.base_url = base_url or os.environ.get(
             "AVITO_API_BASE_URL",
             "https://api.avito.ru",
         )
-
-    def get_account_info(self, access_token: str) -> dict:
+        self.transport = transport or http_transport
+        self.account_id = account_id
+        self.rate_limiter = rate_limiter or avito_rate_limiter
+        self.resilience = resilience or resilience_registry.get("avito_api")
+
+    def _resolve_account_id(self, account_id: Optional[str]) -> str:
+        resolved = account_id or self.account_id
+        if not resolved:
+            raise AvitoClientError("Avito account_id is required for this request")
+        return resolved
+
+    async def get_account_info(self, access_token: str) -> dict:
         """Возвращает информацию об аккаунте (id, email и т.д.)."""
         url = f"{self.base_url}/core/v1/accounts/self"
         headers = {"Authorization": f"Bearer {access_token}"}
 
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code // 100 != 2:
-            logger.error(
-                "Avito API error: GET %s -> %s: %s",
-                url,
-                resp.status_code,
-                resp.text,
-            )
-            raise AvitoClientError(
-                f"Avito API returned {resp.status_code}: {resp.text}"
-            )
-
-        try:
-            return resp.json()
-        except Exception as exc:
-            logger.error("Failed to parse Avito API JSON response: %s", resp.text)
-            raise AvitoClientError("Invalid JSON from Avito API") from exc
+        return await self._make_request("GET", url, headers=headers, endpoint_class="read")
 
-    def get_chats(
+    async def get_chats(
         self,
         access_token: str,
         account_id: str,
         limit: int = 10,
         unread_only: bool | None = None,
+        offset: int = 0,
     ) -> list[dict]:
         """
         Получить список чатов.
         Если unread_only=True — только непрочитанные (поддерживается Avito API).
+        offset — для постраничного обхода (страница = limit чатов).
         """
         url = f"{self.base_url}/messenger/v2/accounts/{account_id}/chats"
 
         params: dict[str, str] = {"limit": str(limit)}
+        if offset:
+            params["offset"] = str(offset)
         if unread_only is not None:
             # Avito ждёт boolean query-параметр unread_only
             params["unread_only"] = "true" if unread_only else "false"
@@ -78,20 +105,22 @@ class AvitoMessengerClient:
             "Authorization": f"Bearer {access_token}",
         }
 
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await self._make_request(
+            "GET", url, headers=headers, params=params, endpoint_class="list", account_id=account_id
+        )
         return data.get("chats", [])
 
-    def get_chat_messages(
+    async def get_chat_messages(
         self,
         chat_id: str,
         access_token: str,
         limit: int = 10,
-        since_message_id: Optional[str] = None
+        since_message_id: Optional[str] = None,
+        account_id: Optional[str] = None,
     ) -> List[dict]:
         """Получить сообщения чата (с фильтром по времени/ID)."""
-        url = f"{self.base_url}/messenger/v3/accounts/{self.user_id}/chats/{chat_id}/messages/"
+        account_id = self._resolve_account_id(account_id)
+        url = f"{self.base_url}/messenger/v3/accounts/{account_id}/chats/{chat_id}/messages/"
 
         headers = {
             "Authorization": f"Bearer {access_token}",
@@ -100,19 +129,23 @@ class AvitoMessengerClient:
         if since_message_id:
             params["since"] = since_message_id
 
-        resp = self._make_request("GET", url, headers=headers, params=params)
+        resp = await self._make_request(
+            "GET", url, headers=headers, params=params, endpoint_class="read", account_id=account_id
+        )
         if isinstance(resp, dict) and "messages" in resp:
             return resp["messages"]
         return resp
 
-    def send_text_message(
+    async def send_text_message(
         self,
         chat_id: str,
         text: str,
         access_token: str,
+        account_id: Optional[str] = None,
     ) -> None:
         """Отправляет текстовое сообщение в чат."""
-        url = f"{self.base_url}/messenger/v3/accounts/{self.user_id}/chats/{chat_id}/messages/"
+        account_id = self._resolve_account_id(account_id)
+        url = f"{self.base_url}/messenger/v3/accounts/{account_id}/chats/{chat_id}/messages/"
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json",
@@ -122,33 +155,64 @@ class AvitoMessengerClient:
             "message": text,
         }
 
-        self._make_request("POST", url, headers=headers, json=payload)
+        await self._make_request(
+            "POST", url, headers=headers, json=payload, endpoint_class="send", account_id=account_id
+        )
 
-    def _make_request(
-        self, 
-        method: str, 
-        url: str, 
-        headers: Dict[str, str], 
+    async def _make_request(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
         params: Optional[Dict] = None,
-        json: Optional[Dict] = None
+        json: Optional[Dict] = None,
+        endpoint_class: str = "read",
+        account_id: Optional[str] = None,
     ) -> Any:
-        """Вспомогательный метод для запросов к Avito API."""
+        """
+        Вспомогательный метод для запросов к Avito API.
+
+        Запрос проходит через лимитер (account_id, endpoint_class); ответ 429
+        замедляет лимитер и повторяется до avito_rate_max_retries раз.
+        Сетевые ошибки и 5xx повторяет self.resilience; POST считается
+        неидемпотентным (повтор отправки сообщения продублировал бы его).
+        """
+        limiter = self.rate_limiter
+
+        async def attempt_request() -> httpx.Response:
+            throttled = 0
+            while True:
+                await limiter.acquire(account_id, endpoint_class)
+                try:
+                    resp = await self.transport.request(
+                        method, url, headers=headers, params=params, json=json
+                    )
+                except Exception as exc:
+                    logger.exception("Error calling Avito API: %s %s", method, url)
+                    raise AvitoClientError(f"Failed to call Avito API: {method} {url}") from exc
+
+                if resp.status_code == 429 and throttled < limiter.settings.avito_rate_max_retries:
+                    throttled += 1
+                    limiter.on_throttled(account_id, endpoint_class, parse_retry_after(resp.headers.get("Retry-After")))
+                    continue
+                break
+
+            if resp.status_code // 100 != 2:
+                logger.error(
+                    "Avito API error: %s %s -> %s: %s",
+                    method, url, resp.status_code, resp.text
+                )
+                raise AvitoClientError(
+                    f"Avito API returned {resp.status_code}: {resp.text}",
+                    status_code=resp.status_code,
+                )
+            limiter.on_success(account_id, endpoint_class)
+            return resp
+
         try:
-            resp = requests.request(
-                method, url, headers=headers, params=params, json=json, timeout=10
-            )
-        except Exception as exc:
-            logger.exception("Error calling Avito API: %s %s", method, url)
-            raise AvitoClientError(f"Failed to call Avito API: {method} {url}") from exc
-
-        if resp.status_code // 100 != 2:
-            logger.error(
-                "Avito API error: %s %s -> %s: %s",
-                method, url, resp.status_code, resp.text
-            )
-            raise AvitoClientError(
-                f"Avito API returned {resp.status_code}: {resp.text}"
-            )
+            resp = await self.resilience.call(attempt_request, idempotent=method != "POST")
+        except CircuitOpenError as exc:
+            raise AvitoClientError(f"Avito API is unavailable: {exc}") from exc
 
         try:
             return resp.json()
@@ -3,66 +3,91 @@ Avito Messenger API Client
 Полный цикл: чаты → сообщения → отправка
 """
 
-import requests
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Optional
 import logging
 
+import httpx
+
+from app.clients.avito_rate_limiter import AvitoRateLimiter, avito_rate_limiter, parse_retry_after
+from app.clients.http_transport import HttpTransport, http_transport
+from app.clients.resilience import Resilience, resilience_registry
+
 logger = logging.getLogger(__name__)
 
 class AvitoMessengerClient:
-    def __init__(self, user_id: str = "107238239"):
+    def __init__(
+        self,
+        user_id: str = "107238239",
+        transport: Optional[HttpTransport] = None,
+        rate_limiter: Optional[AvitoRateLimiter] = None,
+        resilience: Optional[Resilience] = None,
+    ):
         self.user_id = user_id
         self.base_url = "https://api.avito.ru"
+        self.transport = transport or http_transport
+        self.rate_limiter = rate_limiter or avito_rate_limiter
+        self.resilience = resilience or resilience_registry.get("avito_api")
     
-    def get_chats(self, access_token: str, limit: int = 10, unread_only: bool = False) -> List[Dict]:
+    async def get_chats(self, access_token: str, limit: int = 10, unread_only: bool = False) -> List[Dict]:
         """Получить список чатов"""
         url = f"{self.base_url}/messenger/v2/accounts/{self.user_id}/chats"
         params = {
             "limit": limit,
             "unread_only": unread_only
         }
-        resp = self._request("GET", url, access_token, params=params)
+        resp = await self._request("GET", url, access_token, endpoint_class="list", params=params)
         return resp.get("chats", [])
     
-    def get_messages(self, access_token: str, chat_id: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+    async def get_messages(self, access_token: str, chat_id: str, limit: int = 10, offset: int = 0) -> List[Dict]:
         """Получить сообщения чата (V3 - не помечает прочитанным)"""
         url = f"{self.base_url}/messenger/v3/accounts/{self.user_id}/chats/{chat_id}/messages"
         params = {"limit": limit, "offset": offset}
-        resp = self._request("GET", url, access_token, params=params)
+        resp = await self._request("GET", url, access_token, endpoint_class="read", params=params)
         return resp  # Возвращает массив сообщений
     
-    def send_text(self, access_token: str, chat_id: str, text: str) -> Dict:
+    async def send_text(self, access_token: str, chat_id: str, text: str) -> Dict:
         """Отправить текстовое сообщение"""
         url = f"{self.base_url}/messenger/v1/accounts/{self.user_id}/chats/{chat_id}/messages"
         payload = {
             "message": {"text": text},
             "type": "text"
         }
-        return self._request("POST", url, access_token, json=payload)
+        return await self._request("POST", url, access_token, endpoint_class="send", json=payload)
     
-    def mark_read(self, access_token: str, chat_id: str) -> Dict:
+    async def mark_read(self, access_token: str, chat_id: str) -> Dict:
         """Отметить чат прочитанным"""
         url = f"{self.base_url}/messenger/v1/accounts/{self.user_id}/chats/{chat_id}/read"
-        return self._request("POST", url, access_token)
+        return await self._request("POST", url, access_token, endpoint_class="send")
     
-    def subscribe_webhook(self, access_token: str, webhook_url: str) -> Dict:
+    async def subscribe_webhook(self, access_token: str, webhook_url: str) -> Dict:
         """Подписка на webhook"""
         url = f"{self.base_url}/messenger/v3/webhook"
         payload = {"url": webhook_url}
-        return self._request("POST", url, access_token, json=payload)
+        return await self._request("POST", url, access_token, json=payload)
     
-    def _request(self, method: str, url: str, access_token: str, **kwargs) -> Dict:
-        """Универсальный запрос с обработкой ошибок"""
+    async def _request(self, method: str, url: str, access_token: str, endpoint_class: str = "read", **kwargs) -> Dict:
+        """Универсальный запрос с обработкой ошибок (через общий лимитер и политику повторов Avito API)"""
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
-        
-        try:
-            resp = requests.request(method, url, headers=headers, timeout=15, **kwargs)
+        limiter = self.rate_limiter
+
+        async def attempt_request() -> httpx.Response:
+            for attempt in range(limiter.settings.avito_rate_max_retries + 1):
+                await limiter.acquire(self.user_id, endpoint_class)
+                resp = await self.transport.request(method, url, headers=headers, **kwargs)
+                if resp.status_code != 429 or attempt == limiter.settings.avito_rate_max_retries:
+                    break
+                limiter.on_throttled(self.user_id, endpoint_class, parse_retry_after(resp.headers.get("Retry-After")))
             resp.raise_for_status()
+            limiter.on_success(self.user_id, endpoint_class)
+            return resp
+
+        try:
+            resp = await self.resilience.call(attempt_request, idempotent=method != "POST")
             return resp.json()
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             logger.error(f"HTTP {e.response.status_code}: {e.response.text}")
             raise
         except Exception as e:
@@ -0,0 +1,180 @@
+"""
+Адаптивный лимитер запросов к Avito API.
+
+Для каждой пары (аккаунт, класс эндпоинтов: read/list/send) — свой
+token bucket в форме GCRA: вызов acquire() резервирует ближайший свободный
+слот и ждёт его, поэтому при превышении лимита запросы встают в очередь
+(FIFO), а не падают. Всплеск до burst запросов проходит сразу.
+
+На 429 скорость корзины уменьшается в decrease_factor раз (не ниже
+min_rate), а ближайший слот сдвигается на Retry-After. Каждый успешный
+ответ возвращает скорость к номиналу шагом recovery_step (AIMD).
+
+Лимитер общий для всех клиентов Avito в процессе (поллер, вебхуки,
+debug-эндпоинты) — см. avito_rate_limiter.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from app.metrics import metrics
+from app.settings import AvitoSettings, avito_settings as default_avito_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата. None — если не разобрать."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, retry_at.timestamp() - now)
+
+
+class TokenBucket:
+    """Одна корзина: номинальная скорость, текущая (адаптивная) скорость и очередь слотов."""
+
+    __slots__ = (
+        "max_rate",
+        "rate",
+        "burst",
+        "min_rate",
+        "decrease_factor",
+        "recovery_step",
+        "_tat",
+        "_generation",
+        "_hold_until",
+    )
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        min_rate: float = 0.1,
+        decrease_factor: float = 0.5,
+        recovery_step: float = 0.05,
+    ) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate)
+        self.decrease_factor = decrease_factor
+        self.recovery_step = recovery_step
+        # Theoretical arrival time (GCRA): момент, к которому "заняты" все выданные слоты
+        self._tat = 0.0
+        # Меняется на каждом 429 — ожидающие пересчитывают свои слоты
+        self._generation = 0
+        # До этого момента повторные 429 (от уже отправленных запросов) не снижают скорость
+        self._hold_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Резервирует слот и возвращает, сколько секунд до него ждать."""
+        interval = 1.0 / self.rate
+        tolerance = (self.burst - 1) * interval
+        tat = max(self._tat, now)
+        send_at = max(now, tat - tolerance)
+        self._tat = tat + interval
+        return send_at - now
+
+    async def acquire(self) -> float:
+        """Ждёт свой слот; возвращает суммарное время ожидания в секундах."""
+        waited = 0.0
+        while True:
+            generation = self._generation
+            delay = self.reserve(time.monotonic())
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+            if self._generation == generation:
+                return waited
+            # Пока ждали, пришёл 429 — слот пересчитывается по новой скорости и паузе
+
+    def on_success(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_step)
+
+    def on_throttled(self, retry_after: Optional[float], now: float) -> None:
+        if now >= self._hold_until:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        interval = 1.0 / self.rate
+        pause = retry_after if retry_after is not None else interval
+        self._hold_until = max(self._hold_until, now + pause + interval)
+        # Следующий слот — не раньше чем через pause и без всплеска после паузы;
+        # очередь ожидающих перестраивается заново
+        self._tat = now + pause + (self.burst - 1) * interval
+        self._generation += 1
+
+
+class AvitoRateLimiter:
+    """Реестр корзин по (account_id, класс эндпоинтов)."""
+
+    def __init__(self, settings: Optional[AvitoSettings] = None) -> None:
+        self.settings = settings or default_avito_settings
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def bucket(self, account_id: Optional[str], endpoint_class: str) -> TokenBucket:
+        key = (account_id or "", endpoint_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            s = self.settings
+            bucket = self._buckets[key] = TokenBucket(
+                rate=s.avito_rate_limits.get(endpoint_class, min(s.avito_rate_limits.values())),
+                burst=s.avito_rate_burst,
+                min_rate=s.avito_rate_min_rate,
+                decrease_factor=s.avito_rate_decrease_factor,
+                recovery_step=s.avito_rate_recovery_step,
+            )
+        return bucket
+
+    async def acquire(self, account_id: Optional[str], endpoint_class: str) -> None:
+        waited = await self.bucket(account_id, endpoint_class).acquire()
+        if waited > 0:
+            metrics.observe(f"avito.rate_limit_wait.{endpoint_class}", waited)
+
+    def on_success(self, account_id: Optional[str], endpoint_class: str) -> None:
+        self.bucket(account_id, endpoint_class).on_success()
+
+    def on_throttled(self, account_id: Optional[str], endpoint_class: str, retry_after: Optional[float]) -> None:
+        """
+        Учитывает 429: снижает скорость и сдвигает ближайший слот на Retry-After
+        (не больше avito_rate_max_retry_after). Повтор просто снова вызывает acquire().
+        """
+        bucket = self.bucket(account_id, endpoint_class)
+        if retry_after is not None:
+            retry_after = min(retry_after, self.settings.avito_rate_max_retry_after)
+        bucket.on_throttled(retry_after, time.monotonic())
+        metrics.inc(f"avito.rate_limited.{endpoint_class}")
+        logger.warning(
+            "Avito rate limit hit: account=%s class=%s retry_after=%s new_rate=%.2f/s",
+            account_id,
+            endpoint_class,
+            retry_after,
+            bucket.rate,
+        )
+
+    def reset(self) -> None:
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {f"{account or '-'}:{cls}": round(bucket.rate, 3) for (account, cls), bucket in self._buckets.items()}
+
+
+# Общий лимитер процесса: один на все клиенты Avito
+avito_rate_limiter = AvitoRateLimiter()
@@ -0,0 +1,124 @@
+"""
+Общий асинхронный HTTP-транспорт для всех внешних клиентов.
+
+Один httpx.AsyncClient с keep-alive пулом (и, опционально, HTTP/2) создаётся
+при старте приложения и переиспользуется клиентами Avito, STT и Item API,
+чтобы не платить TLS-handshake на каждое сообщение.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.settings import HttpSettings, http_settings as default_http_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpTransport:
+    """
+    Обёртка над httpx.AsyncClient с управляемым жизненным циклом.
+
+    - start()/aclose() вызываются из startup/shutdown FastAPI;
+    - если start() не вызывали (тесты, скрипты), клиент создаётся лениво;
+    - число одновременных запросов к одному хосту ограничено семафором
+      (http_per_host_limit / http_host_limits из настроек).
+    """
+
+    def __init__(
+        self,
+        settings: Optional[HttpSettings] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.settings = settings or default_http_settings
+        # transport подменяется в тестах на httpx.MockTransport
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.http2_enabled = False
+
+    def _build_client(self) -> httpx.AsyncClient:
+        s = self.settings
+        http2 = s.http_http2
+        if http2 and not _http2_available():
+            logger.warning("HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
+        self.http2_enabled = http2
+
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=s.http_max_connections,
+                max_keepalive_connections=s.http_max_keepalive_connections,
+                keepalive_expiry=s.http_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=s.http_connect_timeout,
+                read=s.http_read_timeout,
+                write=s.http_write_timeout,
+                pool=s.http_pool_timeout,
+            ),
+            transport=self._transport,
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+            self._host_semaphores = {}
+        return self._client
+
+    async def start(self) -> None:
+        """Создаёт пул соединений. Повторный вызов ничего не делает."""
+        _ = self.client
+        logger.info(
+            "HTTP transport started: max_connections=%s per_host=%s http2=%s",
+            self.settings.http_max_connections,
+            self.settings.http_per_host_limit,
+            self.http2_enabled,
+        )
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._host_semaphores = {}
+
+    def _semaphore_for(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ""
+        sem = self._host_semaphores.get(host)
+        if sem is None:
+            limit = self.settings.http_host_limits.get(host, self.settings.http_per_host_limit)
+            sem = self._host_semaphores[host] = asyncio.Semaphore(limit)
+        return sem
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Выполняет запрос через общий пул с учётом лимита на хост."""
+        client = self.client
+        async with self._semaphore_for(url):
+            return await client.request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """Потоковый запрос: тело ответа читается по частям внутри контекста."""
+        client = self.client
+        async with self._semaphore_for(url):
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+
+
+# Общий транспорт приложения: создаётся на startup, закрывается на shutdown
+http_transport = HttpTransport()
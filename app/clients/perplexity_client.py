@@ -1,12 +1,32 @@
+import asyncio
 import os
 import logging
-from typing import List, Dict
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
-from perplexity import Perplexity
+import httpx
+from perplexity import AsyncPerplexity, Perplexity
+
+from app.clients.http_transport import HttpTransport, http_transport
+from app.clients.resilience import CircuitOpenError, Resilience, resilience_registry
+from app.conversation import Turn
+from app.metrics import metrics
+from app.token_estimator import token_estimator
 
 
 logger = logging.getLogger(__name__)
 
+# Границы корзин по размеру запроса (оценка входных токенов) для метрик
+# llm.latency.tokens_le_N: видно, как время ответа растёт с длиной промпта
+PROMPT_SIZE_BUCKETS = (500, 1000, 2000, 4000, 8000)
+
+
+def _size_bucket(tokens: int) -> str:
+    for bound in PROMPT_SIZE_BUCKETS:
+        if tokens <= bound:
+            return f"tokens_le_{bound}"
+    return f"tokens_gt_{PROMPT_SIZE_BUCKETS[-1]}"
+
 
 class PerplexityClientError(Exception):
     """
@@ -23,17 +43,85 @@ class PerplexityClient:
 
     - Берёт API-ключ из окружения PERPLEXITY_API_KEY (или из параметра api_key).
     - Использует модель по умолчанию "sonar".
+    - history — предыдущие реплики чата (app.conversation), уходят в запрос
+      сообщениями user/assistant между системным промптом и текущим сообщением;
+    - generate_reply — синхронный вызов (скрипты, тесты);
+      agenerate_reply — асинхронный, не блокирует event loop: не больше
+      max_concurrency запросов одновременно, таймаут на вызов и объединение
+      одинаковых запросов "в полёте" (single-flight).
+    - Асинхронные вызовы идут через политику "perplexity": сетевые ошибки,
+      таймауты и 5xx повторяются с backoff (повторы SDK отключены), серия
+      сбоев размыкает цепь — дальше вызовы сразу падают с PerplexityClientError.
     """
 
-    def __init__(self, api_key: str | None = None, model: str = "sonar") -> None:
+    def __init__(
+        self,
+        api_key: str | None = None,
+        model: str = "sonar",
+        max_concurrency: int = 8,
+        timeout: float = 30.0,
+        transport: Optional[HttpTransport] = None,
+        resilience: Optional[Resilience] = None,
+    ) -> None:
         self.api_key = api_key or os.environ.get("PERPLEXITY_API_KEY")
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY is not set")
 
         self._client = Perplexity(api_key=self.api_key)
         self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.transport = transport or http_transport
+        self.resilience = resilience or resilience_registry.get("perplexity")
+
+        self._async_client: Optional[AsyncPerplexity] = None
+        self._async_http_client = None
+        # Семафор и запросы "в полёте" привязаны к event loop, в котором созданы
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+
+    @staticmethod
+    def _build_messages(
+        user_message: str,
+        system_prompt: str | None,
+        history: Optional[Sequence[Turn]] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        Perplexity требует, чтобы после system роли user и assistant строго
+        чередовались и первым шёл user. Подряд идущие реплики одной роли
+        склеиваются, ответы до первой реплики клиента отбрасываются, а
+        хвост из реплик клиента приклеивается к текущему сообщению.
+        """
+        messages: List[Dict[str, str]] = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        dialog: List[Dict[str, str]] = []
+        for turn in history or ():
+            if dialog and dialog[-1]["role"] == turn.role:
+                dialog[-1]["content"] += "\n" + turn.text
+            elif dialog or turn.role == "user":
+                dialog.append({"role": turn.role, "content": turn.text})
+        if dialog and dialog[-1]["role"] == "user":
+            user_message = dialog.pop()["content"] + "\n" + user_message
+        messages.extend(dialog)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    @staticmethod
+    def _extract_content(completion) -> str:
+        try:
+            return completion.choices[0].message.content
+        except Exception as exc:
+            logger.exception("Unexpected response format from Perplexity")
+            raise PerplexityClientError("Invalid response format from Perplexity") from exc
 
-    def generate_reply(self, user_message: str, system_prompt: str | None = None) -> str:
+    def generate_reply(
+        self,
+        user_message: str,
+        system_prompt: str | None = None,
+        history: Optional[Sequence[Turn]] = None,
+    ) -> str:
         """
         Отправляет запрос в Perplexity Chat Completions и возвращает текст ответа.
 
@@ -42,12 +130,7 @@ class PerplexityClient:
         - Оборачиваем в PerplexityClientError, чтобы верхний слой мог решить,
           что делать (fallback, HTTP-ошибка и т.п.).
         """
-        messages: List[Dict[str, str]] = []
-
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(user_message, system_prompt, history)
 
         try:
             completion = self._client.chat.completions.create(
@@ -58,8 +141,163 @@ class PerplexityClient:
             logger.exception("Error while calling Perplexity Chat Completions API")
             raise PerplexityClientError("Failed to get reply from Perplexity") from exc
 
+        return self._extract_content(completion)
+
+    def _get_async_client(self) -> AsyncPerplexity:
+        # SDK ходит через общий пул соединений приложения; если транспорт
+        # пересоздал httpx-клиент (shutdown/startup), пересоздаём и SDK-клиент
+        http_client = self.transport.client
+        if self._async_client is None or self._async_http_client is not http_client:
+            # Повторами управляет self.resilience, а не SDK. Таймаут задаём явно:
+            # иначе SDK возьмёт read-таймаут общего пула (http_read_timeout),
+            # рассчитанный на Avito, и длинные ответы LLM оборвутся раньше self.timeout
+            self._async_client = AsyncPerplexity(
+                api_key=self.api_key,
+                http_client=http_client,
+                max_retries=0,
+                timeout=httpx.Timeout(self.timeout, connect=http_client.timeout.connect),
+            )
+            self._async_http_client = http_client
+        return self._async_client
+
+    def _loop_state(self) -> Tuple[asyncio.Semaphore, Dict[tuple, asyncio.Task]]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+        return self._semaphore, self._inflight
+
+    @staticmethod
+    def _observe_usage(messages: List[Dict[str, str]], completion, elapsed: float) -> None:
+        """
+        Время ответа — в корзину по размеру запроса; фактический
+        usage.prompt_tokens (если API его вернул) калибрует оценку токенов.
+        """
+        estimated = token_estimator.count_messages(message["content"] for message in messages)
+        metrics.observe(f"llm.latency.{_size_bucket(estimated)}", elapsed)
+        prompt_tokens = getattr(getattr(completion, "usage", None), "prompt_tokens", None)
+        if isinstance(prompt_tokens, int):
+            metrics.inc("llm.prompt_tokens", prompt_tokens)
+            token_estimator.calibrate(estimated, prompt_tokens)
+
+    async def _complete_async(self, messages: List[Dict[str, str]]) -> str:
+        """Один запрос к Perplexity через асинхронный SDK."""
+        started = time.perf_counter()
         try:
-            return completion.choices[0].message.content
+            completion = await self._get_async_client().chat.completions.create(
+                messages=messages,
+                model=self.model,
+            )
         except Exception as exc:
-            logger.exception("Unexpected response format from Perplexity")
-            raise PerplexityClientError("Invalid response format from Perplexity") from exc
+            logger.exception("Error while calling Perplexity Chat Completions API")
+            raise PerplexityClientError("Failed to get reply from Perplexity") from exc
+        self._observe_usage(messages, completion, time.perf_counter() - started)
+        return self._extract_content(completion)
+
+    async def _limited_call(self, messages: List[Dict[str, str]], semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(self._complete_async(messages), timeout=self.timeout)
+            except asyncio.TimeoutError as exc:
+                logger.error("Perplexity request timed out after %.1fs", self.timeout)
+                raise PerplexityClientError("Perplexity request timed out") from exc
+
+    async def _resilient_call(self, messages: List[Dict[str, str]], semaphore: asyncio.Semaphore) -> str:
+        # Пауза между попытками — вне семафора, слот не занимается впустую
+        try:
+            return await self.resilience.call(lambda: self._limited_call(messages, semaphore))
+        except CircuitOpenError as exc:
+            raise PerplexityClientError(f"Perplexity is unavailable: {exc}") from exc
+
+    async def agenerate_reply(
+        self,
+        user_message: str,
+        system_prompt: str | None = None,
+        history: Optional[Sequence[Turn]] = None,
+    ) -> str:
+        """
+        Асинхронный аналог generate_reply.
+
+        Одинаковые запросы (system_prompt, history, user_message), пришедшие пока первый
+        запрос ещё выполняется, ждут его результата, а не идут в API повторно.
+        Отмена одного из ожидающих не отменяет общий запрос.
+        """
+        semaphore, inflight = self._loop_state()
+        key = (system_prompt or "", tuple((turn.role, turn.text) for turn in history or ()), user_message)
+        task = inflight.get(key)
+        if task is None:
+            messages = self._build_messages(user_message, system_prompt, history)
+            task = asyncio.create_task(self._resilient_call(messages, semaphore))
+            inflight[key] = task
+
+            def _done(finished: asyncio.Task) -> None:
+                inflight.pop(key, None)
+                # Забираем исключение, даже если все ожидающие уже отменены
+                if not finished.cancelled():
+                    finished.exception()
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    async def astream_reply(
+        self,
+        user_message: str,
+        system_prompt: str | None = None,
+        history: Optional[Sequence[Turn]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Потоковый ответ: отдаёт дельты текста по мере генерации.
+
+        Занимает слот лимита на всё время потока; таймаут действует на
+        установку соединения и на ожидание каждого следующего фрагмента.
+        Уже начатый поток не повторяется, но его исход учитывается в circuit breaker.
+        """
+        semaphore, _ = self._loop_state()
+        messages = self._build_messages(user_message, system_prompt, history)
+        async with semaphore:
+            # Пробу half-open берём уже со слотом: отмена в ожидании семафора
+            # не оставит её занятой
+            try:
+                self.resilience.breaker.before_call()
+            except CircuitOpenError as exc:
+                raise PerplexityClientError(f"Perplexity is unavailable: {exc}") from exc
+            stream = None
+            error: Optional[BaseException] = None
+            try:
+                stream = await asyncio.wait_for(
+                    self._get_async_client().chat.completions.create(
+                        messages=messages,
+                        model=self.model,
+                        stream=True,
+                    ),
+                    timeout=self.timeout,
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            except asyncio.CancelledError as exc:
+                error = exc
+                raise
+            except asyncio.TimeoutError as exc:
+                error = exc
+                logger.error("Perplexity stream timed out after %.1fs", self.timeout)
+                raise PerplexityClientError("Perplexity request timed out") from exc
+            except PerplexityClientError as exc:
+                error = exc
+                raise
+            except Exception as exc:
+                error = exc
+                logger.exception("Error while streaming from Perplexity Chat Completions API")
+                raise PerplexityClientError("Failed to get reply from Perplexity") from exc
+            finally:
+                # Поток, закрытый потребителем (GeneratorExit), — не сбой зависимости
+                self.resilience.record(error)
+                if stream is not None:
+                    await stream.close()
@@ -0,0 +1,332 @@
+"""
+Общий слой устойчивости для внешних зависимостей (Avito, OAuth, SpeechKit, Perplexity).
+
+Для каждой зависимости — свой Resilience:
+- повторы с экспоненциальной задержкой и full jitter (не больше max_attempts);
+- бюджет повторов: за окно budget_window повторов не больше
+  max(budget_min_retries, budget_ratio * число запросов), чтобы при
+  деградации зависимости повторы не умножали нагрузку на неё;
+- повторы с учётом идемпотентности: неидемпотентный запрос (POST отправки
+  сообщения, обмен OAuth-кода) повторяется только если он гарантированно
+  не дошёл до сервера (ошибка установки соединения);
+- circuit breaker: после failure_threshold сбоев подряд зависимость считается
+  недоступной и вызовы сразу падают с CircuitOpenError; через
+  recovery_timeout пропускается один пробный запрос (half-open) — успех
+  закрывает цепь, сбой снова открывает.
+
+Сбоем считаются только проблемы самой зависимости: сетевые ошибки, таймауты,
+5xx и 408. Ошибки 4xx — это ответ "по существу", они не ретраятся и не
+открывают цепь. Состояние всех зависимостей — resilience_registry.snapshot().
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from app.metrics import metrics
+from app.settings import AppSettings, app_settings as default_app_settings
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Запрос точно не отправлен — повторять безопасно даже неидемпотентный
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(Exception):
+    """Зависимость помечена недоступной, вызов отклонён без обращения к ней."""
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"Circuit for {name} is open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    status_code = getattr(exc, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, bool]:
+    """
+    Разбирает исключение (с учётом цепочки __cause__).
+
+    Возвращает (is_failure, sent): is_failure — сбой зависимости (считается
+    в circuit breaker и может быть повторён), sent — запрос мог дойти до сервера.
+    """
+    current: Optional[BaseException] = exc
+    seen = set()
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, _NOT_SENT_ERRORS):
+            return True, False
+        if isinstance(current, (httpx.TransportError, asyncio.TimeoutError)):
+            return True, True
+        status_code = _status_code(current)
+        if status_code is not None:
+            return status_code >= 500 or status_code == 408, True
+        current = current.__cause__ or current.__context__
+    return False, True
+
+
+class CircuitBreaker:
+    """Цепь closed → open → half-open → closed/open."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        """Пропускает вызов или бросает CircuitOpenError."""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            retry_in = self.opened_at + self.recovery_timeout - now
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # half-open: пропускаем ровно один пробный запрос
+        if self._probe_in_flight:
+            raise CircuitOpenError(self.name, 0.0)
+        self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Circuit for %s closed", self.name)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    "Circuit for %s opened after %s consecutive failures",
+                    self.name,
+                    self.consecutive_failures,
+                )
+                metrics.inc(f"resilience.{self.name}.circuit_opened")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """
+        Вызов отменён, не дождавшись исхода (CancelledError): о зависимости
+        ничего не узнали. Слот пробного запроса освобождается — иначе цепь
+        навсегда осталась бы в half-open с "занятой" пробой.
+        """
+        self._probe_in_flight = False
+
+    def record_ignored(self) -> None:
+        """Вызов завершился ошибкой, не связанной с доступностью (4xx и т.п.)."""
+        if self.state == self.HALF_OPEN:
+            # Зависимость ответила — значит, жива
+            self.record_success()
+
+    def reset(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        retry_in = 0.0
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": round(retry_in, 3),
+        }
+
+
+class RetryBudget:
+    """Доля повторов от числа запросов за скользящее окно."""
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        allowed = max(self.min_retries, int(self.ratio * len(self._requests)))
+        if len(self._retries) >= allowed:
+            return False
+        self._retries.append(now)
+        return True
+
+    def snapshot(self) -> dict:
+        self._trim(time.monotonic())
+        return {"requests": len(self._requests), "retries": len(self._retries)}
+
+
+class Resilience:
+    """Повторы + бюджет + circuit breaker для одной зависимости."""
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+    ) -> None:
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(name)
+        self.budget = budget or RetryBudget()
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: случайная задержка в [0, min(max_delay, base * 2^attempt)]."""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, fn: Callable[[], Awaitable[T]], idempotent: bool = True) -> T:
+        """
+        Выполняет fn() с повторами по политике зависимости.
+
+        fn должен при каждом вызове делать новый запрос. Неидемпотентные
+        вызовы повторяются только при ошибке установки соединения.
+        """
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await fn()
+            except BaseException as exc:
+                if not isinstance(exc, Exception):
+                    # Отмена (таймаут поллера, shutdown) — не исход вызова
+                    self.breaker.release_probe()
+                    raise
+                is_failure, sent = classify_error(exc)
+                if not is_failure:
+                    self.breaker.record_ignored()
+                    raise
+                self.breaker.record_failure()
+                metrics.inc(f"resilience.{self.name}.failures")
+
+                attempt += 1
+                retryable = idempotent or not sent
+                if (
+                    not retryable
+                    or attempt >= self.max_attempts
+                    or self.breaker.state == CircuitBreaker.OPEN
+                    or not self.budget.try_spend()
+                ):
+                    raise
+                delay = self.backoff(attempt)
+                metrics.inc(f"resilience.{self.name}.retries")
+                logger.warning(
+                    "%s call failed (%s), retry %s/%s in %.2fs",
+                    self.name,
+                    exc,
+                    attempt,
+                    self.max_attempts - 1,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def record(self, exc: Optional[BaseException] = None) -> None:
+        """
+        Учитывает исход вызова, который нельзя повторить целиком (поток):
+        вызывающий сам делает breaker.before_call() и затем record().
+        """
+        if exc is None:
+            self.breaker.record_success()
+            return
+        if not isinstance(exc, Exception):
+            self.breaker.release_probe()
+            return
+        is_failure, _ = classify_error(exc)
+        if is_failure:
+            self.breaker.record_failure()
+            metrics.inc(f"resilience.{self.name}.failures")
+        else:
+            self.breaker.record_ignored()
+
+    def snapshot(self) -> dict:
+        return {**self.breaker.snapshot(), "budget": self.budget.snapshot()}
+
+
+class ResilienceRegistry:
+    """Политики по именам зависимостей; создаются лениво из настроек."""
+
+    def __init__(self, settings: Optional[AppSettings] = None) -> None:
+        self.settings = settings or default_app_settings
+        self._items: Dict[str, Resilience] = {}
+
+    def get(self, name: str) -> Resilience:
+        item = self._items.get(name)
+        if item is None:
+            s = self.settings
+            item = self._items[name] = Resilience(
+                name,
+                max_attempts=s.resilience_max_attempts,
+                base_delay=s.resilience_base_delay,
+                max_delay=s.resilience_max_delay,
+                breaker=CircuitBreaker(
+                    name,
+                    failure_threshold=s.resilience_failure_threshold,
+                    recovery_timeout=s.resilience_recovery_timeout,
+                ),
+                budget=RetryBudget(
+                    ratio=s.resilience_retry_budget_ratio,
+                    min_retries=s.resilience_retry_budget_min,
+                    window=s.resilience_retry_budget_window,
+                ),
+            )
+        return item
+
+    def reset(self, name: Optional[str] = None) -> None:
+        targets = self._items.values() if name is None else [self.get(name)]
+        for item in targets:
+            item.breaker.reset()
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: item.snapshot() for name, item in self._items.items()}
+
+
+# Общий реестр процесса: имена avito_api, avito_auth, stt, perplexity
+resilience_registry = ResilienceRegistry()
@@ -1,17 +1,39 @@
+import base64
+import hashlib
+import json
 import logging
 import os
-from typing import Tuple
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
 
-import requests
+import httpx
+
+from app.clients.http_transport import HttpTransport, http_transport
+from app.clients.resilience import CircuitOpenError, Resilience, resilience_registry
+from app.metrics import metrics
+from app.settings import app_settings
+from app.transcription_cache import TranscriptionCache
 
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 class STTClientError(Exception):
     """
     Доменное исключение для ошибок сервиса распознавания речи (STT).
+
+    status_code — HTTP-статус ответа (None, если до ответа не дошло).
     """
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class STTOperationError(STTClientError):
+    """Асинхронная операция распознавания завершилась неудачно — повторный опрос не поможет."""
     pass
 
 
@@ -23,10 +45,55 @@ class STTClient:
     - API-ключ сервисного аккаунта (YANDEX_SPEECHKIT_API_KEY);
     - идентификатор каталога (YANDEX_SPEECHKIT_FOLDER_ID);
     - синхронное распознавание коротких аудио (до 30 секунд).
+
+    Аудио не держится в памяти целиком: ответ Avito читается кусками по
+    chunk_size байт (попутно считается SHA-256) во временный буфер, который
+    больше spool_memory_bytes уходит на диск, и оттуда кусками же
+    отправляется в SpeechKit. Файлы больше max_audio_bytes отклоняются по
+    Content-Length до чтения тела, а без Content-Length — как только
+    счётчик байт превысит лимит.
+
+    С cache (TranscriptionCache) уже распознанное голосовое не скачивается
+    повторно по тому же URL и не отправляется в SpeechKit при том же
+    содержимом.
+
+    Скачивание и распознавание повторяются на сетевых ошибках и 5xx по
+    политике "stt" (оба запроса идемпотентны), с общим circuit breaker.
+
+    Для аудио длиннее лимита синхронного API есть асинхронный путь
+    (SpeechKit API v3): start_long_recognition создаёт операцию
+    распознавания, poll_long_recognition проверяет её и забирает текст.
+    Опросом по расписанию занимается RecognitionJobScheduler (app/stt_jobs.py).
     """
 
     STT_ENDPOINT = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
 
+    def __init__(
+        self,
+        transport: Optional[HttpTransport] = None,
+        resilience: Optional[Resilience] = None,
+        cache: Optional[TranscriptionCache] = None,
+        max_audio_bytes: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        spool_memory_bytes: Optional[int] = None,
+        async_base_url: Optional[str] = None,
+        operation_base_url: Optional[str] = None,
+    ) -> None:
+        self.transport = transport or http_transport
+        self.resilience = resilience or resilience_registry.get("stt")
+        self.cache = cache
+        self.max_audio_bytes = max_audio_bytes or app_settings.stt_max_audio_bytes
+        self.chunk_size = chunk_size or app_settings.stt_chunk_size
+        self.spool_memory_bytes = spool_memory_bytes or app_settings.stt_spool_memory_bytes
+        self.async_base_url = (async_base_url or app_settings.stt_async_api_base_url).rstrip("/")
+        self.operation_base_url = (operation_base_url or app_settings.stt_operation_api_base_url).rstrip("/")
+
+    async def _call(self, fn: Callable[[], Awaitable[T]], what: str) -> T:
+        try:
+            return await self.resilience.call(fn)
+        except CircuitOpenError as exc:
+            raise STTClientError(f"SpeechKit STT is unavailable ({what}): {exc}") from exc
+
     def _get_credentials(self) -> Tuple[str, str]:
         """
         Читает креды из переменных окружения.
@@ -44,42 +111,116 @@ class STTClient:
 
         return api_key, folder_id
 
-    def _download_audio(self, audio_url: str) -> bytes:
+    @staticmethod
+    def _check_content_length(download: httpx.Response, max_bytes: int) -> None:
+        """STTClientError, если Content-Length больше лимита."""
+        try:
+            size = int(download.headers.get("Content-Length", ""))
+        except ValueError:
+            return
+        if size > max_bytes:
+            raise STTClientError(
+                f"Audio file is too large: {size} bytes (limit {max_bytes})"
+            )
+
+    async def _download_audio(
+        self, audio_url: str, max_bytes: Optional[int] = None
+    ) -> Tuple[SpooledTemporaryFile, str, int]:
         """
-        Скачивает аудиофайл по указанному URL.
+        Скачивает аудиофайл по указанному URL во временный буфер.
 
-        Предполагается, что audio_url указывает на голосовое сообщение из Avito.
-        Если Avito требует авторизации, сюда нужно будет добавить заголовки/токен.
+        Возвращает (буфер, sha256 содержимого, размер). Предполагается, что
+        audio_url указывает на голосовое сообщение из Avito. Если Avito требует
+        авторизации, сюда нужно будет добавить заголовки/токен.
         """
+        max_bytes = max_bytes or self.max_audio_bytes
+        spool = SpooledTemporaryFile(max_size=self.spool_memory_bytes)
+        digest = hashlib.sha256()
+        received = 0
         try:
-            resp = requests.get(audio_url, timeout=10)
+            async with self.transport.stream("GET", audio_url) as download:
+                if download.status_code != 200:
+                    logger.error(
+                        "Failed to download audio from %s, status=%s",
+                        audio_url,
+                        download.status_code,
+                    )
+                    raise STTClientError(
+                        f"Failed to download audio file, status={download.status_code}",
+                        status_code=download.status_code,
+                    )
+
+                # Слишком большой файл отклоняем до того, как читать тело
+                self._check_content_length(download, max_bytes)
+                async for chunk in download.aiter_bytes(self.chunk_size):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise STTClientError(
+                            f"Audio file is too large: more than {max_bytes} bytes"
+                        )
+                    digest.update(chunk)
+                    spool.write(chunk)
+        except STTClientError:
+            spool.close()
+            raise
         except Exception as exc:
+            spool.close()
             logger.exception("Failed to download audio from %s", audio_url)
             raise STTClientError("Failed to download audio file") from exc
 
+        metrics.observe("stt.audio_bytes", received)
+        return spool, digest.hexdigest(), received
+
+    async def _audio_chunks(self, spool: SpooledTemporaryFile) -> AsyncIterator[bytes]:
+        """Содержимое буфера кусками по chunk_size — тело запроса в SpeechKit."""
+        spool.seek(0)
+        while True:
+            chunk = spool.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    async def _recognize(self, spool: SpooledTemporaryFile, size: int, params: dict, headers: dict) -> httpx.Response:
+        try:
+            resp = await self.transport.request(
+                "POST",
+                self.STT_ENDPOINT,
+                params=params,
+                content=self._audio_chunks(spool),
+                headers={**headers, "Content-Length": str(size)},
+            )
+        except Exception as exc:
+            logger.exception("Error while calling Yandex SpeechKit STT API")
+            raise STTClientError("Failed to call SpeechKit STT API") from exc
+
         if resp.status_code != 200:
             logger.error(
-                "Failed to download audio from %s, status=%s",
-                audio_url,
+                "SpeechKit STT returned non-200 status: %s, body=%s",
                 resp.status_code,
+                resp.text,
             )
             raise STTClientError(
-                f"Failed to download audio file, status={resp.status_code}"
+                f"SpeechKit STT returned status {resp.status_code}",
+                status_code=resp.status_code,
             )
+        return resp
 
-        return resp.content
-
-    def transcribe(self, audio_url: str) -> str:
+    async def transcribe(self, audio_url: str) -> str:
         """
         Выполняет распознавание речи через Yandex SpeechKit STT API.
 
         Шаги:
-        - скачиваем аудиофайл по audio_url;
+        - ищем текст в кэше по audio_url;
+        - скачиваем аудиофайл (с проверкой размера) и ищем текст по его SHA-256;
         - отправляем байты в SpeechKit STT API v1;
         - разбираем JSON-ответ, возвращаем текст или бросаем STTClientError.
         """
         api_key, folder_id = self._get_credentials()
-        audio_data = self._download_audio(audio_url)
+
+        if self.cache is not None:
+            cached = self.cache.get_by_url(audio_url)
+            if cached is not None:
+                return cached
 
         params = {
             "lang": "ru-RU",
@@ -92,27 +233,14 @@ class STTClient:
             "Authorization": f"Api-Key {api_key}",
         }
 
-        try:
-            resp = requests.post(
-                self.STT_ENDPOINT,
-                params=params,
-                data=audio_data,
-                headers=headers,
-                timeout=15,
-            )
-        except Exception as exc:
-            logger.exception("Error while calling Yandex SpeechKit STT API")
-            raise STTClientError("Failed to call SpeechKit STT API") from exc
-
-        if resp.status_code != 200:
-            logger.error(
-                "SpeechKit STT returned non-200 status: %s, body=%s",
-                resp.status_code,
-                resp.text,
-            )
-            raise STTClientError(
-                f"SpeechKit STT returned status {resp.status_code}"
-            )
+        spool, digest, size = await self._call(lambda: self._download_audio(audio_url), "download")
+        with spool:
+            if self.cache is not None:
+                cached = self.cache.get_by_hash(digest, url=audio_url)
+                if cached is not None:
+                    return cached
+            # Распознавание не меняет состояния на стороне SpeechKit — повторять безопасно
+            resp = await self._call(lambda: self._recognize(spool, size, params, headers), "recognize")
 
         try:
             payload = resp.json()
@@ -137,4 +265,146 @@ class STTClient:
             logger.error("SpeechKit STT returned empty result")
             raise STTClientError("SpeechKit STT returned empty result")
 
+        if self.cache is not None:
+            self.cache.put(audio_url, digest, result_text)
         return result_text
+
+    # --- Асинхронное распознавание длинных аудио (SpeechKit API v3) ----------
+
+    def _async_headers(self) -> dict:
+        api_key, folder_id = self._get_credentials()
+        return {"Authorization": f"Api-Key {api_key}", "x-folder-id": folder_id}
+
+    async def _get_json(self, url: str, what: str, **kwargs) -> httpx.Response:
+        try:
+            resp = await self.transport.request("GET", url, **kwargs)
+        except Exception as exc:
+            logger.exception("Error while calling SpeechKit %s", what)
+            raise STTClientError(f"Failed to call SpeechKit {what}") from exc
+        if resp.status_code != 200:
+            logger.error("SpeechKit %s returned status %s, body=%s", what, resp.status_code, resp.text)
+            raise STTClientError(
+                f"SpeechKit {what} returned status {resp.status_code}",
+                status_code=resp.status_code,
+            )
+        return resp
+
+    async def start_long_recognition(self, audio_url: str) -> Tuple[str, str]:
+        """
+        Скачивает аудио и создаёт операцию асинхронного распознавания.
+
+        Возвращает (operation_id, sha256 аудио). Аудио передаётся в теле
+        запроса (base64), поэтому целиком читается в память — но не больше
+        stt_async_max_audio_bytes.
+        """
+        headers = self._async_headers()
+        spool, digest, _ = await self._call(
+            lambda: self._download_audio(audio_url, max_bytes=app_settings.stt_async_max_audio_bytes),
+            "download",
+        )
+        with spool:
+            spool.seek(0)
+            content = base64.b64encode(spool.read()).decode("ascii")
+
+        body = {
+            "content": content,
+            "recognitionModel": {
+                "model": "general",
+                "audioFormat": {"containerAudio": {"containerAudioType": "OGG_OPUS"}},
+                # Без нормализации в ответе нет finalRefinement — только сырые final
+                "textNormalization": {"textNormalization": "TEXT_NORMALIZATION_ENABLED"},
+                "languageRestriction": {"restrictionType": "WHITELIST", "languageCode": ["ru-RU"]},
+            },
+        }
+
+        async def submit() -> httpx.Response:
+            try:
+                resp = await self.transport.request(
+                    "POST", f"{self.async_base_url}/stt/v3/recognizeFileAsync", json=body, headers=headers
+                )
+            except Exception as exc:
+                logger.exception("Error while submitting SpeechKit async recognition")
+                raise STTClientError("Failed to submit SpeechKit async recognition") from exc
+            if resp.status_code != 200:
+                logger.error(
+                    "SpeechKit async recognition returned status %s, body=%s",
+                    resp.status_code,
+                    resp.text,
+                )
+                raise STTClientError(
+                    f"SpeechKit async recognition returned status {resp.status_code}",
+                    status_code=resp.status_code,
+                )
+            return resp
+
+        # Повторная отправка создала бы вторую операцию — повторяем, только если запрос не ушёл
+        try:
+            resp = await self.resilience.call(submit, idempotent=False)
+        except CircuitOpenError as exc:
+            raise STTClientError(f"SpeechKit STT is unavailable (submit): {exc}") from exc
+
+        operation_id = resp.json().get("id")
+        if not operation_id:
+            raise STTClientError("SpeechKit async recognition returned no operation id")
+        return operation_id, digest
+
+    async def poll_long_recognition(self, operation_id: str) -> Optional[str]:
+        """
+        Проверяет операцию распознавания.
+
+        None — операция ещё выполняется; текст — готово; STTOperationError —
+        операция завершилась ошибкой или вернула пустой результат.
+        """
+        headers = self._async_headers()
+        resp = await self._call(
+            lambda: self._get_json(f"{self.operation_base_url}/operations/{operation_id}", "operation", headers=headers),
+            "operation",
+        )
+        operation = resp.json()
+        if not operation.get("done"):
+            return None
+        if operation.get("error"):
+            error = operation["error"]
+            logger.error("SpeechKit operation %s failed: %s", operation_id, error)
+            raise STTOperationError(f"SpeechKit recognition failed: {error.get('message') or error}")
+
+        resp = await self._call(
+            lambda: self._get_json(
+                f"{self.async_base_url}/stt/v3/getRecognition",
+                "recognition result",
+                params={"operationId": operation_id},
+                headers=headers,
+            ),
+            "result",
+        )
+        text = self._parse_recognition(resp.text)
+        if not text:
+            logger.error("SpeechKit operation %s returned empty result", operation_id)
+            raise STTOperationError("SpeechKit STT returned empty result")
+        return text
+
+    @staticmethod
+    def _parse_recognition(body: str) -> str:
+        """
+        Текст из ответа getRecognition (JSON-объект на строку).
+
+        Берём нормализованные финальные фразы (finalRefinement), а если их
+        нет — просто финальные (final).
+        """
+        refined: List[str] = []
+        final: List[str] = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line).get("result", {})
+            except ValueError:
+                logger.warning("Skipping malformed SpeechKit result line: %s", line[:200])
+                continue
+            refinement = result.get("finalRefinement", {}).get("normalizedText", {}).get("alternatives")
+            if refinement:
+                refined.append(refinement[0].get("text", ""))
+            alternatives = result.get("final", {}).get("alternatives")
+            if alternatives:
+                final.append(alternatives[0].get("text", ""))
+        return " ".join(part for part in (refined or final) if part).strip()
@@ -0,0 +1,239 @@
+"""
+История переписки по чатам: последние реплики клиента и ассистента.
+
+LLM видит не только последнее сообщение клиента, но и несколько предыдущих
+реплик — без повторных запросов истории чата в Avito.
+
+Два уровня хранения:
+- в памяти — кольцевой буфер (TurnRing) на чат, не больше max_turns реплик;
+  буферы лежат в LRU на max_chats чатов, давно молчавшие вытесняются;
+- на диске — персистентный уровень, из которого буфер поднимается при
+  промахе (после рестарта или вытеснения). В JSON-бэкенде это
+  append-only файл JSON-строк на чат в directory, который
+  время от времени обрезается до последних max_turns реплик; в SQLite —
+  таблица conversation_turns (см. app.storage.stores).
+
+append() и recent() при промахе ходят на диск (или в SQLite), поэтому из
+асинхронного кода их вызывают через asyncio.to_thread.
+
+Реплика (Turn) — объект со __slots__: на тысячах чатов по двадцать реплик
+это заметно компактнее dict'ов.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from app.chat_state import truncate_partial_line
+from app.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+USER = "user"
+ASSISTANT = "assistant"
+
+
+class Turn:
+    """Одна реплика: роль ("user" — клиент, "assistant" — наш ответ), текст и время."""
+
+    __slots__ = ("role", "text", "at")
+
+    def __init__(self, role: str, text: str, at: Optional[float] = None) -> None:
+        self.role = role
+        self.text = text
+        self.at = time.time() if at is None else at
+
+    def to_list(self) -> list:
+        return [self.role, self.text, self.at]
+
+    @classmethod
+    def from_list(cls, data: Sequence) -> "Turn":
+        role, text, at = data
+        return cls(role, text, at)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Turn):
+            return NotImplemented
+        return (self.role, self.text, self.at) == (other.role, other.text, other.at)
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, {self.text!r})"
+
+
+class TurnRing:
+    """Кольцевой буфер фиксированной ёмкости: новая реплика затирает самую старую."""
+
+    __slots__ = ("_items", "_next", "_count")
+
+    def __init__(self, capacity: int, turns: Sequence[Turn] = ()) -> None:
+        self._items: List[Optional[Turn]] = [None] * capacity
+        self._next = 0
+        self._count = 0
+        for turn in turns[-capacity:]:
+            self.append(turn)
+
+    def append(self, turn: Turn) -> None:
+        self._items[self._next] = turn
+        self._next = (self._next + 1) % len(self._items)
+        self._count = min(self._count + 1, len(self._items))
+
+    def last(self, n: int) -> List[Turn]:
+        """Последние n реплик, от старых к новым."""
+        n = max(0, min(n, self._count))
+        capacity = len(self._items)
+        return [self._items[(self._next - n + i) % capacity] for i in range(n)]
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class ConversationStore:
+    """Потокобезопасная история чатов: LRU буферов в памяти поверх файлов на диске."""
+
+    def __init__(
+        self,
+        directory: Optional[str] = "data/conversations",
+        max_turns: int = 20,
+        max_chats: int = 10_000,
+    ) -> None:
+        # directory=None — история только в памяти (тесты, скрипты)
+        self.directory = directory
+        self.max_turns = max_turns
+        self.max_chats = max_chats
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        # _lock — только LRU в памяти; диск — под lock'ом чата (из набора
+        # полос по хэшу chat_id), так что медленная запись или загрузка одного
+        # чата не задерживает остальные
+        self._lock = threading.Lock()
+        self._chat_locks = [threading.Lock() for _ in range(64)]
+        self._rings: "OrderedDict[str, TurnRing]" = OrderedDict()
+        # Сколько реплик лежит в персистентном уровне чата — чтобы вовремя обрезать
+        self._persisted: Dict[str, int] = {}
+
+    # --- Персистентный уровень (переопределяется в других бэкендах) ----------
+
+    def _path(self, chat_id: str) -> str:
+        # chat_id приходит снаружи — в имя файла идёт только его хэш
+        digest = hashlib.blake2b(chat_id.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.jsonl")
+
+    def _load_turns(self, chat_id: str) -> List[Turn]:
+        """Все сохранённые реплики чата (от старых к новым)."""
+        if not self.directory:
+            return []
+        path = self._path(chat_id)
+        if not os.path.exists(path):
+            return []
+        # Недописанная строка после падения посреди write: срезаем, иначе
+        # следующая реплика из _persist_turn приклеится к ней
+        if truncate_partial_line(path):
+            logger.warning("Truncated partial last line of conversation %s", path)
+        turns: List[Turn] = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    turns.append(Turn.from_list(json.loads(line)))
+                except (ValueError, TypeError):
+                    logger.warning("Skipping corrupt conversation line in %s", path)
+        return turns
+
+    def _persist_turn(self, chat_id: str, turn: Turn) -> None:
+        if not self.directory:
+            return
+        path = self._path(chat_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(turn.to_list(), ensure_ascii=False) + "\n")
+
+    def _compact(self, chat_id: str, turns: List[Turn]) -> None:
+        """Оставляет в персистентном уровне только turns."""
+        if not self.directory:
+            return
+        path = self._path(chat_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(turn.to_list(), ensure_ascii=False) + "\n" for turn in turns))
+        os.replace(tmp_path, path)
+
+    # --- Кэш в памяти ----------------------------------------------------------
+
+    def _chat_lock(self, chat_id: str) -> threading.Lock:
+        return self._chat_locks[zlib.crc32(chat_id.encode("utf-8")) % len(self._chat_locks)]
+
+    def _ring(self, chat_id: str) -> TurnRing:
+        """Буфер чата; при промахе поднимается с диска. Вызывать под _chat_lock(chat_id)."""
+        with self._lock:
+            ring = self._rings.get(chat_id)
+            if ring is not None:
+                self._rings.move_to_end(chat_id)
+                self.hits += 1
+                return ring
+            self.loads += 1
+
+        turns = self._load_turns(chat_id)
+        ring = TurnRing(self.max_turns, turns)
+        with self._lock:
+            self._persisted[chat_id] = len(turns)
+            self._rings[chat_id] = ring
+            while len(self._rings) > self.max_chats:
+                evicted, _ = self._rings.popitem(last=False)
+                self._persisted.pop(evicted, None)
+                self.evictions += 1
+        return ring
+
+    def append(self, chat_id: str, role: str, text: str) -> None:
+        """Добавляет реплику в историю чата (пустые тексты не сохраняются)."""
+        if not text:
+            return
+        turn = Turn(role, text)
+        with self._chat_lock(chat_id):
+            ring = self._ring(chat_id)
+            with self._lock:
+                ring.append(turn)
+                persisted = self._persisted.get(chat_id, 0) + 1
+                # Персистентный уровень растёт, пока не станет вчетверо больше буфера
+                keep = ring.last(self.max_turns) if persisted > 4 * self.max_turns else None
+            try:
+                self._persist_turn(chat_id, turn)
+                if keep is not None:
+                    self._compact(chat_id, keep)
+                    persisted = len(keep)
+                with self._lock:
+                    if chat_id in self._rings:
+                        self._persisted[chat_id] = persisted
+            except Exception:
+                # История — подсказка для LLM, а не источник правды: не роняем ответ
+                metrics.inc("conversation.persist_failed")
+                logger.exception("Failed to persist conversation turn for chat %s", chat_id)
+
+    def recent(self, chat_id: str, n: int) -> List[Turn]:
+        """Последние n реплик чата, от старых к новым."""
+        if n <= 0:
+            return []
+        with self._lock:
+            ring = self._rings.get(chat_id)
+            if ring is not None:
+                self._rings.move_to_end(chat_id)
+                self.hits += 1
+                return ring.last(n)
+        with self._chat_lock(chat_id):
+            ring = self._ring(chat_id)
+            with self._lock:
+                return ring.last(n)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._rings),
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,214 @@
+"""
+Склейка пачек сообщений в чате перед ответом (debounce).
+
+Покупатели часто пишут несколькими короткими сообщениями подряд
+("Здравствуйте", "скажите", "есть доставка?"). Без склейки каждое
+сообщение — отдельный вызов LLM и отдельный ответ в чат. Здесь сообщения
+чата копятся в буфере (ChatBurst) и уходят в on_flush одной пачкой, когда
+в чате quiet секунд тишина или с первого сообщения прошло max_wait секунд.
+
+Сроки тысяч чатов держит хэшированное колесо таймеров (TimerWheel):
+новое сообщение переносит срок чата за O(1), а фоновая задача раз в tick
+секунд смотрит только в один слот колеса, а не во все чаты.
+
+Пачки одного чата отдаются в on_flush по очереди: следующая ждёт, пока
+закончится обработка предыдущей, — ответы не обгоняют друг друга.
+Буферы живут только в памяти процесса; при остановке (stop) всё
+накопленное отдаётся сразу.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from app.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Хэшированное колесо таймеров с разрешением tick секунд.
+
+    Срок ключа кладётся в слот (номер тика % slots); сроки дальше одного
+    оборота колеса ждут в том же слоте следующих оборотов. Постановка,
+    перенос и снятие — O(1), advance() просматривает только слоты
+    прошедших тиков.
+    """
+
+    def __init__(self, tick: float = 0.05, slots: int = 512) -> None:
+        self.tick = tick
+        self._slots: List[Dict[Hashable, float]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        # Номер последнего обработанного тика
+        self._last_tick: Optional[int] = None
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Ставит (или переносит) срок ключа на deadline (по time.monotonic)."""
+        self.cancel(key)
+        tick_no = math.ceil(deadline / self.tick)
+        if self._last_tick is not None:
+            # Срок в уже обработанном тике — сработает на следующем
+            tick_no = max(tick_no, self._last_tick + 1)
+        slot = tick_no % len(self._slots)
+        self._slots[slot][key] = deadline
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Снимает и возвращает ключи, срок которых наступил к now."""
+        current = math.floor(now / self.tick)
+        if self._last_tick is None:
+            self._last_tick = current - 1
+        # После долгой паузы каждый слот достаточно посмотреть один раз
+        ticks = min(current - self._last_tick, len(self._slots))
+        due: List[Hashable] = []
+        for tick_no in range(current - ticks + 1, current + 1):
+            bucket = self._slots[tick_no % len(self._slots)]
+            expired = [key for key, deadline in bucket.items() if deadline <= now]
+            for key in expired:
+                del bucket[key]
+                del self._where[key]
+            due.extend(expired)
+        self._last_tick = max(self._last_tick, current)
+        return due
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+
+class ChatBurst:
+    """Сообщения одного чата, накопленные за окно, и последний payload."""
+
+    __slots__ = ("chat_id", "texts", "payload", "first_at", "last_at")
+
+    def __init__(self, chat_id: str, now: float) -> None:
+        self.chat_id = chat_id
+        self.texts: List[str] = []
+        # Что нужно для ответа (в приложении — маршрут аккаунта)
+        self.payload: Any = None
+        self.first_at = now
+        self.last_at = now
+
+    @property
+    def text(self) -> str:
+        """Пачка как одно сообщение клиента."""
+        return "\n".join(self.texts)
+
+
+class ChatDebouncer:
+    """Склейка сообщений по чатам; не больше concurrency пачек обрабатываются одновременно."""
+
+    def __init__(
+        self,
+        on_flush: Callable[[ChatBurst], Awaitable[None]],
+        quiet: float = 1.5,
+        max_wait: float = 6.0,
+        tick: float = 0.05,
+        slots: int = 512,
+        concurrency: int = 8,
+    ) -> None:
+        self.on_flush = on_flush
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self.concurrency = concurrency
+        self._wheel = TimerWheel(tick=tick, slots=slots)
+        self._bursts: Dict[str, ChatBurst] = {}
+        # Последняя отданная пачка чата — следующая ждёт её завершения
+        self._flushing: Dict[str, "asyncio.Task[None]"] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._counters: Dict[str, int] = {"messages": 0, "bursts": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run(), name="chat-debouncer")
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Отдаёт все накопленные пачки сразу и ждёт их обработки (не дольше timeout)."""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        for chat_id in list(self._bursts):
+            self._wheel.cancel(chat_id)
+            self._release(chat_id)
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for flush in pending:
+                flush.cancel()
+            if pending:
+                logger.warning("Chat debouncer stopped with %s unfinished bursts", len(pending))
+
+    def add(self, chat_id: str, text: str, payload: Any = None) -> ChatBurst:
+        """Добавляет сообщение в пачку чата и переносит её срок."""
+        now = time.monotonic()
+        burst = self._bursts.get(chat_id)
+        if burst is None:
+            burst = self._bursts[chat_id] = ChatBurst(chat_id, now)
+        burst.texts.append(text)
+        burst.payload = payload
+        burst.last_at = now
+        self._counters["messages"] += 1
+        self._wheel.schedule(chat_id, min(now + self.quiet, burst.first_at + self.max_wait))
+        self._wakeup.set()
+        return burst
+
+    async def _run(self) -> None:
+        while True:
+            if not self._bursts:
+                # Пачек нет — спим до первого сообщения, а не тикаем впустую
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(self._wheel.tick)
+            for chat_id in self._wheel.advance(time.monotonic()):
+                self._release(chat_id)
+
+    def _release(self, chat_id: str) -> None:
+        burst = self._bursts.pop(chat_id)
+        self._counters["bursts"] += 1
+        metrics.inc("debounce.bursts")
+        metrics.inc("debounce.coalesced_messages", len(burst.texts) - 1)
+        metrics.observe("debounce.wait", time.monotonic() - burst.first_at)
+        flush = asyncio.create_task(self._flush(burst, self._flushing.get(chat_id)))
+        self._flushing[chat_id] = flush
+        self._tasks.add(flush)
+        flush.add_done_callback(lambda done: self._done(chat_id, done))
+
+    async def _flush(self, burst: ChatBurst, previous: Optional["asyncio.Task[None]"]) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        async with self._semaphore:
+            try:
+                await self.on_flush(burst)
+            except Exception:
+                logger.exception("Handling message burst for chat %s failed", burst.chat_id)
+
+    def _done(self, chat_id: str, flush: "asyncio.Task[None]") -> None:
+        self._tasks.discard(flush)
+        if self._flushing.get(chat_id) is flush:
+            del self._flushing[chat_id]
+
+    def stats(self) -> dict:
+        return {
+            "pending_chats": len(self._bursts),
+            "flushing": len(self._tasks),
+            **self._counters,
+        }
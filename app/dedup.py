@@ -0,0 +1,256 @@
+"""
+Дедупликация вебхуков Avito по id события и id сообщения.
+
+Avito повторно доставляет вебхуки (ретраи, повторы после 5xx), а каждая
+обработка — это STT + LLM + ответ клиенту. Поэтому уже виденные id
+подтверждаем сразу, не запуская конвейер.
+
+Две структуры:
+- точное множество недавних id с TTL (OrderedDict по времени вставки,
+  ограничено max_recent) — основной источник ответа "уже было";
+- вращающийся Bloom-фильтр из двух поколений — компактная память о более
+  старых id (до двух TTL), которой хватает места и после рестарта.
+  Поколение сменяется по возрасту (ttl) или заполнению (capacity).
+  Ложноположительное срабатывание означает потерянное сообщение, поэтому
+  доля ошибок по умолчанию крошечная (1e-6).
+
+Состояние периодически (и при close) атомарно сохраняется на диск фоновым
+потоком, поэтому дедупликация переживает перезапуск процесса. Под lock
+берётся только копия состояния; сжатие битовых массивов и запись с fsync
+идут без него и не задерживают seen()/add().
+
+Состояние — своё у каждого процесса. При uvicorn --workers N повтор
+вебхука, попавший в другой воркер, не распознаётся как дубль, а файл на
+диске — снимок того воркера, который сохранялся последним (временный файл
+у каждого процесса свой, так что файл не бьётся, но чужие id в нём теряются).
+Если повторная обработка критична, запускайте один воркер на порт.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bloom-фильтр фиксированного размера с двойным хэшированием blake2b."""
+
+    __slots__ = ("num_bits", "num_hashes", "bits", "count", "created_at")
+
+    def __init__(
+        self,
+        num_bits: int,
+        num_hashes: int,
+        bits: Optional[bytearray] = None,
+        count: int = 0,
+        created_at: Optional[float] = None,
+    ) -> None:
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count
+        self.created_at = created_at if created_at is not None else time.time()
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def copy(self) -> "BloomFilter":
+        return BloomFilter(self.num_bits, self.num_hashes, bytearray(self.bits), self.count, self.created_at)
+
+    def to_dict(self) -> dict:
+        return {
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+            "count": self.count,
+            "created_at": self.created_at,
+            "bits": base64.b64encode(zlib.compress(bytes(self.bits))).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BloomFilter":
+        bits = bytearray(zlib.decompress(base64.b64decode(data["bits"])))
+        return cls(data["num_bits"], data["num_hashes"], bits, data["count"], data["created_at"])
+
+
+class WebhookDeduplicator:
+    """
+    Множество уже обработанных id вебхуков с TTL и сохранением на диск.
+
+    Использование: seen(keys) до постановки в очередь, add(keys) — после
+    успешной постановки (иначе повтор после 503 был бы ошибочно отброшен).
+    """
+
+    def __init__(
+        self,
+        path: str = "data/webhook_dedup.json",
+        ttl_seconds: float = 24 * 3600,
+        max_recent: int = 50_000,
+        bloom_capacity: int = 200_000,
+        bloom_error_rate: float = 1e-6,
+        flush_interval: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_recent = max_recent
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # Сериализует запись файла; _lock на это время не держится
+        self._save_lock = threading.Lock()
+        self._recent: "OrderedDict[str, float]" = OrderedDict()  # key -> время добавления
+        self._blooms: List[BloomFilter] = []
+        self._dirty = False
+
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+        self._load()
+        if not self._blooms:
+            self._blooms = [self._new_bloom()]
+
+    def _new_bloom(self) -> BloomFilter:
+        return BloomFilter.for_capacity(self.bloom_capacity, self.bloom_error_rate)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            cutoff = time.time() - self.ttl_seconds
+            for key, added_at in data.get("recent", []):
+                if added_at >= cutoff:
+                    self._recent[key] = added_at
+            self._blooms = [BloomFilter.from_dict(item) for item in data.get("blooms", [])][-2:]
+        except Exception:
+            logger.exception("Failed to read webhook dedup state %s, starting empty", self.path)
+            self._recent.clear()
+            self._blooms = []
+
+    def _write(self, recent: list, blooms: List[BloomFilter]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {
+            "recent": recent,
+            "blooms": [bloom.to_dict() for bloom in blooms],
+        }
+        # Временный файл — свой у процесса: воркеры сохраняются в один path
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _expire_locked(self, now: float) -> None:
+        cutoff = now - self.ttl_seconds
+        while self._recent:
+            key, added_at = next(iter(self._recent.items()))
+            if added_at >= cutoff and len(self._recent) <= self.max_recent:
+                break
+            self._recent.popitem(last=False)
+
+        current = self._blooms[-1]
+        if current.count >= self.bloom_capacity or now - current.created_at >= self.ttl_seconds:
+            self._blooms = [current, self._new_bloom()]
+
+    def seen(self, keys: Iterable[str]) -> bool:
+        """True, если хоть один из ключей уже встречался."""
+        now = time.time()
+        cutoff = now - self.ttl_seconds
+        with self._lock:
+            for key in keys:
+                added_at = self._recent.get(key)
+                if added_at is not None and added_at >= cutoff:
+                    return True
+                if any(key in bloom for bloom in self._blooms):
+                    return True
+        return False
+
+    def add(self, keys: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._recent[key] = now
+                self._recent.move_to_end(key)
+                self._blooms[-1].add(key)
+            self._expire_locked(now)
+            self._dirty = True
+            self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="webhook-dedup-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to save webhook dedup state")
+
+    def flush(self) -> None:
+        """Сохраняет состояние на диск, если оно менялось."""
+        with self._save_lock:
+            # Копию снимаем уже под _save_lock — последним пишется самое свежее состояние
+            with self._lock:
+                if not self._dirty:
+                    return
+                recent = list(self._recent.items())
+                blooms = [bloom.copy() for bloom in self._blooms]
+                self._dirty = False
+            try:
+                self._write(recent, blooms)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def close(self) -> None:
+        """Сохраняет состояние и останавливает фоновый поток."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "recent": len(self._recent),
+            "bloom_generations": len(self._blooms),
+            "bloom_count": sum(bloom.count for bloom in self._blooms),
+        }
+
+    def __len__(self) -> int:
+        return len(self._recent)
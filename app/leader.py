@@ -0,0 +1,164 @@
+"""
+Выбор ведущего воркера на хосте: фоновые задачи — ровно в одном процессе.
+
+С uvicorn --workers N каждый процесс стартует свой APScheduler и обновление
+токенов: N поллеров забирают одни и те же чаты и отвечают N раз. Ведущим
+становится процесс, взявший эксклюзивный fcntl.flock на lock-файл:
+- блокировку держит открытый файловый дескриптор, поэтому при падении
+  или убийстве ведущего ОС снимает её сразу, без ожидания TTL;
+- остальные воркеры раз в heartbeat_interval пробуют взять блокировку
+  (LOCK_NB, без ожидания) — ведущий сменяется за один интервал;
+- ведущий на каждом heartbeat пишет в файл pid и время (видно в метриках
+  всех воркеров) и проверяет, что файл не удалили и не подменили —
+  иначе блокировку на новом файле мог бы взять второй процесс.
+
+Вебхуки принимают и обрабатывают все воркеры; ведущий только запускает
+фоновые задачи (on_acquired) и останавливает их, потеряв лидерство
+(on_lost). Без fcntl (Windows) процесс всегда считается ведущим —
+там запускайте один воркер.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """Лидерство через flock на lock-файл с heartbeat-циклом в event loop."""
+
+    def __init__(
+        self,
+        path: str = "data/leader.lock",
+        heartbeat_interval: float = 2.0,
+        on_acquired: Optional[Callable[[], Awaitable[None]]] = None,
+        on_lost: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.acquisitions = 0
+        self._fd: Optional[int] = None
+        self._leader_since: Optional[float] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader_since is not None
+
+    async def start(self) -> None:
+        """Сразу пробует стать ведущим и запускает heartbeat-цикл."""
+        if self._task is not None:
+            return
+        await self._tick()
+        self._task = asyncio.create_task(self._run(), name="leader-lease")
+
+    async def stop(self) -> None:
+        """Останавливает цикл и отдаёт лидерство (фоновые задачи — через on_lost)."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self.is_leader:
+            await self._lose("shutdown", level=logging.INFO)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._tick()
+            except Exception:
+                logger.exception("Leader lease heartbeat failed")
+
+    async def _tick(self) -> None:
+        if self.is_leader:
+            if self._still_holds_lock():
+                self._write_heartbeat()
+            else:
+                await self._lose("lock file was removed or replaced")
+        elif self._try_acquire():
+            self._leader_since = time.time()
+            self.acquisitions += 1
+            self._write_heartbeat()
+            logger.info("Became leader (pid=%s, lock=%s)", os.getpid(), self.path)
+            if self.on_acquired is not None:
+                await self.on_acquired()
+
+    def _try_acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def _still_holds_lock(self) -> bool:
+        if fcntl is None or self._fd is None:
+            return True
+        try:
+            return os.fstat(self._fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _write_heartbeat(self) -> None:
+        if self._fd is None:
+            return
+        data = json.dumps({
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "since": self._leader_since,
+            "heartbeat_at": time.time(),
+        }).encode()
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, data, 0)
+
+    async def _lose(self, reason: str, level: int = logging.WARNING) -> None:
+        logger.log(level, "Leadership released (pid=%s): %s", os.getpid(), reason)
+        self._leader_since = None
+        try:
+            # Сначала останавливаем фоновые задачи (идущую итерацию поллера) и
+            # только потом отдаём flock: иначе новый ведущий начнёт отвечать
+            # в те же чаты, пока старая итерация ещё досылает ответы
+            if self.on_lost is not None:
+                await self.on_lost()
+        finally:
+            if self._fd is not None:
+                # Закрытие дескриптора снимает flock
+                os.close(self._fd)
+                self._fd = None
+
+    def holder(self) -> Optional[dict]:
+        """Кто сейчас ведущий — по последнему heartbeat в lock-файле."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.loads(f.read() or "null")
+        except (OSError, ValueError):
+            return None
+
+    def stats(self) -> dict:
+        holder = self.holder() or {}
+        heartbeat_at = holder.get("heartbeat_at")
+        return {
+            "is_leader": self.is_leader,
+            "pid": os.getpid(),
+            "leader_pid": holder.get("pid"),
+            "heartbeat_age": round(time.time() - heartbeat_at, 3) if heartbeat_at else None,
+            "acquisitions": self.acquisitions,
+        }
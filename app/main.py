@@ -1,27 +1,35 @@
+import asyncio
 import os
-import requests
 from fastapi import FastAPI, status, HTTPException, Form, Depends, Request
-from app.schemas_avito import AvitoWebhook
+from app.schemas_avito import AvitoMessageContent, AvitoWebhook
 from app.clients.perplexity_client import PerplexityClient, PerplexityClientError
 from app.clients.stt_client import STTClient, STTClientError
 from app.token_store import AvitoTokenStore, AvitoTokens
 from fastapi.responses import RedirectResponse, HTMLResponse
 from app.clients.avito_client import AvitoMessengerClient, AvitoClientError
-from app.settings import avito_settings
+from app.settings import avito_settings, app_settings
 from app.clients.avito_auth_client import AvitoAuthClient, AvitoAuthError
+from app.clients.http_transport import http_transport
+from app.clients.avito_rate_limiter import avito_rate_limiter
+from app.clients.resilience import resilience_registry
 import logging
-from app.projects.models import Project, TimeRange
+from app.projects.models import Project
+from app.projects.schedule import compile_schedule
+from pydantic import ValidationError
 from app.projects.store import ProjectStore
-from typing import List
+from app.routing import AccountRoute, AccountRouter
+from app.storage.sqlite import SqliteStorage
+from app.storage.stores import SqliteChatState, SqliteConversationStore, SqliteProjectStore, SqliteTokenStore
+from typing import AsyncIterator, Awaitable, Callable, List, Sequence, Set
 from datetime import datetime
-import zoneinfo
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import secrets
 from app.avito_item_client import AvitoItemClient
-from app.prompts import build_system_prompt
-from datetime import timezone
+from app.prompts import AssembledPrompt, assemble_prompt, prefix_cache, prompt_cache
+from app.token_estimator import token_estimator
+from datetime import timedelta, timezone
 from app.error_handlers import (
     http_exception_handler,
     validation_exception_handler,
@@ -33,7 +41,18 @@ from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from dotenv import load_dotenv
 from app.chat_state import ChatState
+from app.conversation import ASSISTANT, USER, ConversationStore, Turn
+from app.dedup import WebhookDeduplicator
+from app.answer_cache import AnswerCache
+from app.semantic_cache import SemanticCache
+from app.transcription_cache import TranscriptionCache
+from app.stt_jobs import RecognitionJob, RecognitionJobScheduler
+from app.reply_chunker import ReplyChunker
+from app.debounce import ChatBurst, ChatDebouncer
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from app.metrics import metrics
+from app.leader import LeaderLease
+from app.pipeline import WebhookPipeline, PipelineNotRunning, PipelineQueueFull
 
 load_dotenv()
 
@@ -63,113 +82,611 @@ templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Клиенты внешних сервисов инициализируем один раз при старте приложения
-perplexity_client = PerplexityClient()
-stt_client = STTClient()
-avito_auth_client = AvitoAuthClient()
+perplexity_client = PerplexityClient(
+    max_concurrency=app_settings.llm_max_concurrency,
+    timeout=app_settings.llm_timeout_seconds,
+)
+transcription_cache = TranscriptionCache(
+    path=app_settings.transcription_cache_path,
+    ttl_seconds=app_settings.transcription_cache_ttl_seconds,
+    max_entries=app_settings.transcription_cache_max_entries,
+    flush_interval=app_settings.transcription_cache_flush_interval,
+)
+stt_client = STTClient(cache=transcription_cache)
+if app_settings.storage_backend == "sqlite":
+    storage = SqliteStorage(
+        app_settings.storage_sqlite_path,
+        busy_timeout=app_settings.storage_sqlite_busy_timeout,
+    )
+    avito_token_store = SqliteTokenStore(storage)
+    project_store = SqliteProjectStore(storage)
+    chat_state = SqliteChatState(
+        storage,
+        flush_interval=app_settings.chat_state_flush_interval,
+        batch_size=app_settings.chat_state_batch_size,
+    )
+    conversation_store = SqliteConversationStore(
+        storage,
+        max_turns=app_settings.conversation_max_turns,
+        max_chats=app_settings.conversation_cache_chats,
+    )
+else:
+    storage = None
+    avito_token_store = AvitoTokenStore()
+    project_store = ProjectStore()
+    chat_state = ChatState(
+        flush_interval=app_settings.chat_state_flush_interval,
+        batch_size=app_settings.chat_state_batch_size,
+        compact_threshold=app_settings.chat_state_compact_threshold,
+    )
+    conversation_store = ConversationStore(
+        directory=app_settings.conversation_dir,
+        max_turns=app_settings.conversation_max_turns,
+        max_chats=app_settings.conversation_cache_chats,
+    )
+avito_auth_client = AvitoAuthClient(token_store=avito_token_store)
 avito_messenger_client = AvitoMessengerClient(base_url=avito_settings.avito_api_base_url)
-avito_token_store = AvitoTokenStore()
-project_store = ProjectStore()
-chat_state = ChatState()
+account_router = AccountRouter(project_store, avito_token_store)
+metrics.register_gauge("account_router", account_router.stats)
+answer_cache = AnswerCache(
+    maxsize=app_settings.answer_cache_size,
+    ttl_seconds=app_settings.answer_cache_ttl_seconds,
+    max_message_length=app_settings.answer_cache_max_message_length,
+)
+semantic_cache = SemanticCache(
+    directory=app_settings.semantic_cache_dir,
+    dim=app_settings.semantic_cache_dim,
+    capacity=app_settings.semantic_cache_capacity,
+    threshold=app_settings.semantic_cache_threshold,
+    max_message_length=app_settings.answer_cache_max_message_length,
+    max_open_indexes=app_settings.semantic_cache_max_projects,
+)
+webhook_dedup = WebhookDeduplicator(
+    path=app_settings.webhook_dedup_path,
+    ttl_seconds=app_settings.webhook_dedup_ttl_seconds,
+    max_recent=app_settings.webhook_dedup_max_recent,
+    bloom_capacity=app_settings.webhook_dedup_bloom_capacity,
+    bloom_error_rate=app_settings.webhook_dedup_bloom_error_rate,
+    flush_interval=app_settings.webhook_dedup_flush_interval,
+)
 
 
-async def avito_auto_poller():
-    """Поллер: чаты → Perplexity → автоответ каждые 30 сек"""
-    try:
-        tokens = avito_token_store.get_default_tokens()
-        if not tokens:
-            logger.warning("Нет сохранённых токенов Avito — поллер пропускает итерацию")
-            return
+scheduler = AsyncIOScheduler()
+async def _cached_answer(project_id: str, user_message: str, system_prompt: str) -> str | None:
+    """Ответ из кэшей: сначала точное совпадение, затем похожий вопрос."""
+    cached = answer_cache.get(project_id, system_prompt, user_message)
+    if cached is not None:
+        return cached
+    # Поиск по матрице и первое открытие индекса проекта (memmap с диска) — в пуле потоков
+    cached = await asyncio.to_thread(semantic_cache.get, project_id, system_prompt, user_message)
+    if cached is not None:
+        answer_cache.put(project_id, system_prompt, user_message, cached)
+    return cached
+
 
-        account_id = tokens.account_id
-        if not account_id:
-            account_info = avito_messenger_client.get_account_info(tokens.access_token)
-            account_id = str(account_info.get("id")) if account_info else None
-            tokens.account_id = account_id
-            avito_token_store.save_default_tokens(tokens)
+async def _remember_answer(project_id: str, user_message: str, system_prompt: str, reply: str) -> None:
+    answer_cache.put(project_id, system_prompt, user_message, reply)
+    await asyncio.to_thread(semantic_cache.put, project_id, system_prompt, user_message, reply)
 
-        if not account_id:
-            logger.error("Не удалось определить account_id Avito, поллер остановлен на итерации")
+
+async def generate_reply_cached(
+    project_id: str,
+    user_message: str,
+    system_prompt: str,
+    history: Sequence[Turn] = (),
+) -> str:
+    """
+    Ответ Perplexity через кэши ответов: повторный вопрос в том же проекте
+    (с тем же промптом) отдаётся из памяти без вызова LLM — сначала точное
+    совпадение, затем похожий вопрос из семантического кэша.
+
+    Кэши работают только для первого сообщения чата: ответ с историей
+    зависит от предыдущих реплик и другому клиенту не подойдёт.
+    """
+    if not history:
+        cached = await _cached_answer(project_id, user_message, system_prompt)
+        if cached is not None:
+            return cached
+    reply = await perplexity_client.agenerate_reply(
+        user_message=user_message,
+        system_prompt=system_prompt,
+        history=history,
+    )
+    if not history:
+        await _remember_answer(project_id, user_message, system_prompt, reply)
+    return reply
+
+
+async def reply_parts(
+    project: Project | None,
+    user_message: str,
+    system_prompt: str,
+    history: Sequence[Turn] = (),
+) -> AsyncIterator[str]:
+    """
+    Части ответа в порядке отправки.
+
+    Обычно это один кусок (ответ из кэша или целиком от LLM). Если у проекта
+    включён stream_replies и ответа нет в кэше, ответ читается потоком:
+    первое законченное предложение отдаётся сразу, остальное — абзацами.
+    history — предыдущие реплики чата из conversation_store.
+    """
+    project_id = project.id if project else ""
+    if not (project and project.stream_replies):
+        yield await generate_reply_cached(project_id, user_message, system_prompt, history)
+        return
+
+    if not history:
+        cached = await _cached_answer(project_id, user_message, system_prompt)
+        if cached is not None:
+            yield cached
             return
 
-        chats = avito_messenger_client.get_chats(
-            access_token=tokens.access_token,
+    chunker = ReplyChunker()
+    async for delta in perplexity_client.astream_reply(
+        user_message=user_message,
+        system_prompt=system_prompt,
+        history=history,
+    ):
+        for part in chunker.feed(delta):
+            yield part
+    tail = chunker.flush()
+    if tail:
+        yield tail
+    if not history:
+        await _remember_answer(project_id, user_message, system_prompt, chunker.text.strip())
+
+
+async def send_reply_parts(
+    parts: AsyncIterator[str],
+    send: Callable[[str], Awaitable[None]],
+    metric_prefix: str,
+    generated: List[str],
+) -> None:
+    """
+    Отправляет части ответа по мере готовности.
+
+    Сгенерированные части складываются в generated (в том числе та, которую
+    не удалось отправить), чтобы вызывающий код мог показать ответ при ошибке.
+    Время от начала генерации до первого отправленного сообщения пишется
+    в метрику {metric_prefix}.time_to_first_message.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    iterator = parts.__aiter__()
+    try:
+        while True:
+            with metrics.timer(f"{metric_prefix}.stage.llm"):
+                try:
+                    part = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            generated.append(part)
+            with metrics.timer(f"{metric_prefix}.stage.send"):
+                await send(part)
+            if len(generated) == 1:
+                metrics.observe(f"{metric_prefix}.time_to_first_message", loop.time() - started)
+    finally:
+        await iterator.aclose()
+
+
+def _report_prompt(prompt: AssembledPrompt, metric_prefix: str, chat_id: str) -> None:
+    """Размер запроса к LLM — в метрики и лог (сопоставлять с {metric_prefix}.stage.llm)."""
+    metrics.inc(f"{metric_prefix}.prompts")
+    metrics.inc(f"{metric_prefix}.input_tokens", prompt.input_tokens)
+    if prompt.dropped_turns or prompt.description_trimmed or prompt.extras_dropped:
+        metrics.inc(f"{metric_prefix}.prompts_trimmed")
+        logger.info(
+            "Prompt for chat %s trimmed to budget %s: dropped_turns=%s description=%s extras=%s",
+            chat_id,
+            prompt.budget,
+            prompt.dropped_turns,
+            prompt.description_trimmed,
+            prompt.extras_dropped,
+        )
+    logger.info("Prompt for chat %s: ~%s input tokens", chat_id, prompt.input_tokens)
+
+
+POLLER_JOB_ID = "avito_auto_poller"
+
+
+def _defer_poller_until(run_at: datetime) -> None:
+    """
+    Переносит следующий запуск поллера, например на время открытия по расписанию.
+
+    Не дальше poller_max_defer_seconds; перенос отменяет _reset_poller_schedule.
+    """
+    job = scheduler.get_job(POLLER_JOB_ID)
+    if job is not None:
+        latest = datetime.now(timezone.utc) + timedelta(seconds=app_settings.poller_max_defer_seconds)
+        run_at = min(run_at, latest)
+        job.modify(next_run_time=run_at)
+        logger.info("Поллер отложен до %s (вне расписания)", run_at.isoformat())
+
+
+def _reset_poller_schedule() -> None:
+    """
+    Возвращает поллер к обычному интервалу, если его отложили.
+
+    Вызывается при изменении проекта и подключении аккаунта: новое расписание
+    или новый продавец могут быть открыты уже сейчас.
+    """
+    job = scheduler.get_job(POLLER_JOB_ID)
+    next_run_time = getattr(job, "next_run_time", None)
+    if next_run_time is None:
+        return
+    soon = datetime.now(timezone.utc) + timedelta(seconds=app_settings.poller_interval_seconds)
+    if next_run_time > soon:
+        job.modify(next_run_time=soon)
+        logger.info("Перенос поллера отменён, следующий тик в %s", soon.isoformat())
+
+
+project_store.add_listener(lambda project, version: _reset_poller_schedule())
+
+
+# Состояние последней итерации поллера — для /admin/metrics
+poller_stats: dict = {
+    "last_tick_at": None,
+    "backlog": 0,
+    "replied": 0,
+    "unfinished": 0,
+}
+metrics.register_gauge("poller", lambda: dict(poller_stats))
+
+
+async def _fetch_unread_chats(account_id: str, deadline: float) -> list:
+    """Постранично забирает все непрочитанные чаты (в пределах дедлайна итерации)."""
+    loop = asyncio.get_running_loop()
+    page_size = app_settings.poller_page_size
+    chats: list = []
+    for page in range(app_settings.poller_max_pages):
+        offset = page * page_size
+        batch = await avito_auth_client.call_with_refresh(
+            lambda t: avito_messenger_client.get_chats(
+                access_token=t.access_token,
+                account_id=account_id,
+                limit=page_size,
+                offset=offset,
+                unread_only=True,
+            ),
             account_id=account_id,
-            unread_only=True,
         )
+        chats.extend(batch)
+        if len(batch) < page_size or loop.time() >= deadline:
+            break
+    return chats
+
+
+def _chat_last_message_id(chat: dict) -> str | None:
+    """id последнего сообщения чата из списка чатов (если Avito его отдал)."""
+    last_message = chat.get("last_message") or {}
+    message_id = last_message.get("id")
+    return str(message_id) if message_id is not None else None
+
+
+def _messages_after_cursor(messages: list, cursor: str | None) -> list:
+    """
+    Сообщения новее курсора (список — от старых к новым).
+
+    Avito может проигнорировать since и вернуть и уже обработанные сообщения,
+    поэтому дополнительно отрезаем всё до курсора включительно.
+    """
+    if not cursor:
+        return messages
+    for index, message in enumerate(messages):
+        if str(message.get("id")) == cursor:
+            return messages[index + 1:]
+    return messages
 
-        project = project_store.get_project("default")
-        system_prompt = build_system_prompt(project, item_context="") if project else ""
 
-        for chat in chats[:3]:  # 3 активных чата
-            chat_id = chat.get("id")
-            messages = avito_messenger_client.get_chat_messages(
+async def _poll_chat(chat: dict, project: Project | None, account_id: str) -> bool:
+    """
+    Один чат: новые сообщения после курсора → Perplexity → автоответ.
+
+    Курсор (id последнего обработанного сообщения) хранится в chat_state.
+    Чат, у которого последнее сообщение совпадает с курсором, пропускается
+    без запросов к Avito; иначе забираются только сообщения новее курсора.
+    Курсор двигается после успешной отправки ответа (или если отвечать не на
+    что), поэтому при ошибке сообщение будет обработано в следующий тик.
+    Если часть ответа уже ушла клиенту, а дальше случились таймаут, отмена
+    или ошибка, курсор тоже двигается, а в историю пишется отправленная часть:
+    иначе следующий тик ответил бы на то же сообщение ещё раз.
+
+    Возвращает True, если ответ отправлен.
+    """
+    chat_id = str(chat.get("id"))
+    cursor = chat_state.get_last_message_id(chat_id)
+    last_message_id = _chat_last_message_id(chat)
+    if cursor is not None and last_message_id == cursor:
+        metrics.inc("poller.chats_unchanged")
+        return False
+
+    messages = await avito_auth_client.call_with_refresh(
+        lambda t: avito_messenger_client.get_chat_messages(
+            chat_id=chat_id,
+            access_token=t.access_token,
+            limit=app_settings.poller_messages_limit,
+            since_message_id=cursor,
+            account_id=account_id,
+        ),
+        account_id=account_id,
+    )
+    new_messages = _messages_after_cursor(messages, cursor)
+    if not new_messages:
+        metrics.inc("poller.chats_unchanged")
+        return False
+    newest_id = str(new_messages[-1].get("id"))
+
+    # Новые сообщения клиента (direction="in"); отвечаем на последнее,
+    # предыдущие уходят в историю чата
+    client_texts = [
+        text
+        for text in (((m.get("content") or {}).get("text")) for m in new_messages if m.get("direction") == "in")
+        if text
+    ]
+    if not client_texts:
+        chat_state.set_last_message_id(chat_id, newest_id)
+        return False
+    client_text = client_texts[-1]
+    logger.info(f"Новое сообщение в {chat_id}: {client_text}")
+    history = await asyncio.to_thread(conversation_store.recent, chat_id, app_settings.conversation_history_turns)
+    history += [Turn(USER, text) for text in client_texts[:-1]]
+
+    # Промпт нужен только когда действительно есть, на что отвечать
+    if project:
+        prompt = assemble_prompt(project, client_text, history)
+        _report_prompt(prompt, "poller", chat_id)
+        system_prompt, history = prompt.system_prompt, prompt.history
+    else:
+        system_prompt = "Ответь как продавец телескопов"
+
+    # Части, которые Avito принял (generated может содержать и неотправленную)
+    delivered: List[str] = []
+
+    async def send(text: str) -> None:
+        await avito_auth_client.call_with_refresh(
+            lambda t: avito_messenger_client.send_text_message(
                 chat_id=chat_id,
-                access_token=tokens.access_token,
-                limit=3,
+                text=text,
+                access_token=t.access_token,
+                account_id=account_id,
+            ),
+            account_id=account_id,
+        )
+        delivered.append(text)
+
+    def remember_reply(parts: List[str]) -> str:
+        # Пишет на диск — вызывается через asyncio.to_thread
+        ai_response = "\n\n".join(parts)
+        for text in client_texts:
+            conversation_store.append(chat_id, USER, text)
+        conversation_store.append(chat_id, ASSISTANT, ai_response)
+        chat_state.set_last_message_id(chat_id, newest_id)
+        return ai_response
+
+    generated: List[str] = []
+    try:
+        await send_reply_parts(
+            reply_parts(project, client_text, system_prompt, history),
+            send,
+            "poller",
+            generated,
+        )
+    except BaseException:
+        # Таймаут чата, дедлайн тика или ошибка посреди потока: то, что клиент
+        # уже получил, фиксируем, иначе следующий тик ответит заново
+        if delivered:
+            metrics.inc("poller.partial_replies")
+            # shield: повторная отмена не должна потерять уже отправленное
+            await asyncio.shield(asyncio.to_thread(remember_reply, delivered))
+        raise
+    # В историю — только после отправки: при ошибке сообщения вернутся в следующий тик
+    ai_response = await asyncio.to_thread(remember_reply, generated)
+    logger.info(f"✅ Отправлен автоответ: {ai_response}")
+    return True
+
+
+async def _poll_chat_bounded(
+    chat: dict,
+    project: Project | None,
+    account_id: str,
+    semaphore: asyncio.Semaphore,
+) -> bool:
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(
+                _poll_chat(chat, project, account_id),
+                timeout=app_settings.poller_chat_timeout,
             )
+        except asyncio.TimeoutError:
+            metrics.inc("poller.chats_timed_out")
+            logger.warning("Поллер: таймаут обработки чата %s", chat.get("id"))
+        except Exception as exc:
+            metrics.inc("poller.chats_failed")
+            logger.error("Поллер: ошибка в чате %s: %s", chat.get("id"), exc)
+        return False
+
+
+async def _poll_account(
+    account_id: str | None,
+    project: Project | None,
+    deadline: float,
+    semaphore: asyncio.Semaphore,
+) -> tuple:
+    """
+    Непрочитанные чаты одного аккаунта Avito.
 
-            # Последнее сообщение клиента (direction="in")
-            last_client_msg = next(
-                (m for m in reversed(messages) if getattr(m, "direction", m.get("direction")) == "in"),
-                None,
-            )
-            if last_client_msg:
-                content = getattr(last_client_msg, "content", last_client_msg.get("content", {}))
-                client_text = content.get("text")
-                if not client_text:
+    Возвращает (чатов в очереди, отвечено, не успели до дедлайна).
+    """
+    loop = asyncio.get_running_loop()
+    tokens = await avito_auth_client.get_valid_tokens(account_id)
+    if not tokens:
+        return 0, 0, 0
+
+    if not tokens.account_id:
+        account_info = await avito_messenger_client.get_account_info(tokens.access_token)
+        tokens.account_id = str(account_info.get("id")) if account_info else None
+        if tokens.account_id:
+            avito_token_store.save_tokens(tokens)
+    if not tokens.account_id:
+        logger.error("Не удалось определить account_id Avito, поллер пропускает аккаунт")
+        return 0, 0, 0
+    account_id = tokens.account_id
+
+    chats = await _fetch_unread_chats(account_id, deadline)
+    if not chats:
+        return 0, 0, 0
+
+    tasks = [
+        asyncio.create_task(_poll_chat_bounded(chat, project, account_id, semaphore))
+        for chat in chats
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=max(0.0, deadline - loop.time()))
+    finally:
+        # Дедлайн итерации или отмена всего тика (воркер перестал быть ведущим):
+        # незаконченные чаты отменяем, а не оставляем досылать ответы
+        unfinished = [task for task in tasks if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+    replied = sum(1 for task in done if task.result())
+    return len(chats), replied, len(pending)
+
+
+# Идущие итерации поллера — их отменяет _on_leader_lost
+_poller_ticks: Set["asyncio.Task[None]"] = set()
+
+
+async def avito_auto_poller():
+    """
+    Поллер: непрочитанные чаты → Perplexity → автоответ.
+
+    Обходит все аккаунты из стора токенов, каждый — со своим проектом
+    (см. AccountRouter). Непрочитанные чаты забираются постранично и
+    обрабатываются параллельно (не больше poller_concurrency одновременно
+    на все аккаунты), у каждого чата свой таймаут, а у всей итерации —
+    общий дедлайн: что не успели, доделаем в следующий тик.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + app_settings.poller_tick_deadline
+    tick = asyncio.current_task()
+    _poller_ticks.add(tick)
+    try:
+        accounts = [tokens.account_id for tokens in avito_token_store.list_tokens()]
+        if not accounts:
+            logger.warning("Нет сохранённых токенов Avito — поллер пропускает итерацию")
+            return
+
+        now_utc = datetime.now(timezone.utc)
+        active = []
+        next_opens = []
+        for account_id in accounts:
+            project = account_router.route(account_id).project
+            if project and not project.enabled:
+                continue
+            if project:
+                schedule = compile_schedule(project)
+                if not schedule.is_open(now_utc):
+                    next_open = schedule.next_transition(now_utc)
+                    if next_open is not None:
+                        next_opens.append(next_open)
                     continue
-                logger.info(f"Новое сообщение в {chat_id}: {client_text}")
+            active.append((account_id, project))
 
-                ai_response = perplexity_client.generate_reply(
-                    user_message=client_text,
-                    system_prompt=system_prompt or "Ответь как продавец телескопов",
-                )
+        if not active:
+            # Вне расписания у всех — не ходим в Avito вовсе и спим до ближайшего открытия
+            if next_opens:
+                _defer_poller_until(min(next_opens))
+            return
 
-                avito_messenger_client.send_text_message(
-                    chat_id=chat_id,
-                    text=ai_response,
-                    access_token=tokens.access_token,
-                )
-                logger.info(f"✅ Отправлен автоответ: {ai_response}")
+        semaphore = asyncio.Semaphore(app_settings.poller_concurrency)
+        results = await asyncio.gather(
+            *(_poll_account(account_id, project, deadline, semaphore) for account_id, project in active),
+            return_exceptions=True,
+        )
+        backlog = replied = unfinished = 0
+        for (account_id, _), result in zip(active, results):
+            if isinstance(result, Exception):
+                logger.error("Поллер: ошибка аккаунта %s: %s", account_id, result)
+                continue
+            backlog += result[0]
+            replied += result[1]
+            unfinished += result[2]
+
+        poller_stats["backlog"] = backlog
+        poller_stats["replied"] = replied
+        poller_stats["unfinished"] = unfinished
+        metrics.inc("poller.chats_replied", replied)
+        if unfinished:
+            metrics.inc("poller.chats_unfinished", unfinished)
+            logger.warning("Поллер: дедлайн итерации, не успели обработать %s чатов", unfinished)
 
     except Exception as e:
         logger.error(f"Поллер ошибка: {e}")
+    finally:
+        _poller_ticks.discard(tick)
+        poller_stats["last_tick_at"] = datetime.now(timezone.utc).isoformat()
+        metrics.observe("poller.tick", loop.time() - started)
+
+
+async def _on_leader_acquired() -> None:
+    """Этот воркер стал ведущим: запускаем поллер и обновление токенов."""
+    scheduler.resume()
+    await avito_auth_client.start_refresher()
+    logger.info("🚀 Автоответчик запущен! Каждые %s сек", app_settings.poller_interval_seconds)
+
+
+async def _on_leader_lost() -> None:
+    """Ведущим стал другой воркер: останавливаем поллер, включая идущую итерацию."""
+    scheduler.pause()
+    # pause() не трогает уже запущенную итерацию, а новый ведущий начнёт свою —
+    # два поллера ответили бы в одни и те же чаты
+    ticks = list(_poller_ticks)
+    for tick in ticks:
+        tick.cancel()
+    await asyncio.gather(*ticks, return_exceptions=True)
+    await avito_auth_client.stop_refresher()
+
+
+leader_lease = LeaderLease(
+    path=app_settings.leader_lock_path,
+    heartbeat_interval=app_settings.leader_heartbeat_interval,
+    on_acquired=_on_leader_acquired,
+    on_lost=_on_leader_lost,
+)
+metrics.register_gauge("leader", leader_lease.stats)
+
 
 # Запуск при старте приложения
 @app.on_event("startup")
 async def startup_scheduler():
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(avito_auto_poller, "interval", seconds=30)
-    scheduler.start()
-    logger.info("🚀 Автоответчик запущен! Каждые 30 сек")
+    scheduler.add_job(
+        avito_auto_poller,
+        "interval",
+        seconds=app_settings.poller_interval_seconds,
+        id=POLLER_JOB_ID,
+        replace_existing=True,
+    )
+    # Планировщик стоит на паузе, пока воркер не станет ведущим (см. app.leader):
+    # при uvicorn --workers N поллер работает в одном процессе, а не в N
+    scheduler.start(paused=True)
+    await leader_lease.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_scheduler():
+    await leader_lease.stop()
+    scheduler.shutdown(wait=False)
 
 def _is_within_schedule(project: Project, now_utc: datetime) -> bool:
     """
     Проверяет, попадает ли текущее время в рабочие интервалы проекта.
-    """
-    if project.schedule_mode == "always":
-        return True
-
-    tz = zoneinfo.ZoneInfo(project.timezone)
-    now_local = now_utc.astimezone(tz)
-    weekday = now_local.weekday()  # 0=Mon ... 6=Sun
-    time_str = now_local.strftime("%H:%M")
-
-    day_map = {
-        0: project.schedule.mon,
-        1: project.schedule.tue,
-        2: project.schedule.wed,
-        3: project.schedule.thu,
-        4: project.schedule.fri,
-        5: project.schedule.sat,
-        6: project.schedule.sun,
-    }
-    ranges: List[TimeRange] = day_map.get(weekday, [])
 
-    for r in ranges:
-        if r.start <= time_str <= r.end:
-            return True
-    return False
+    Расписание компилируется один раз на версию проекта (см. app.projects.schedule).
+    """
+    return compile_schedule(project).is_open(now_utc)
 
 def ensure_default_project() -> None:
     existing = project_store.get_project("default")
@@ -194,53 +711,129 @@ async def health_check():
     return {"status": "ok", "service": "avito-assist-backend", "version": "0.1.0"}
 
 
-@app.post(
-    "/webhooks/avito",
-    status_code=status.HTTP_200_OK,
-    summary="Avito Messenger webhook endpoint",
+def _skipped_result(reason: str) -> dict:
+    return {
+        "processed": False,
+        "reason": reason,
+        "stt_error": None,
+        "assistant_error": None,
+        "messaging_error": None,
+    }
+
+
+def _is_long_voice(content: AvitoMessageContent) -> bool:
+    """Голосовое длиннее лимита синхронного SpeechKit — распознаётся асинхронно."""
+    return bool(content.duration_ms) and content.duration_ms > app_settings.stt_sync_max_duration_ms
+
+
+async def _reply_in_chat(route: AccountRoute, chat_id: str, message_text: str, item_context: str = "") -> dict:
+    """
+    Ответ на сообщение клиента: история → промпт → LLM → отправка в Avito.
+
+    Возвращает assistant_reply, input_tokens и ошибки LLM/отправки.
+    """
+    project = route.project
+
+    async def send(text: str) -> None:
+        # Токены берём через auth-клиент: он заранее обновит истекающий
+        # access_token и на 401 сделает один refresh + повтор
+        await avito_auth_client.call_with_refresh(
+            lambda tokens: avito_messenger_client.send_text_message(
+                chat_id=chat_id,
+                text=text,
+                access_token=tokens.access_token,
+                account_id=tokens.account_id,
+            ),
+            account_id=route.account_id,
+        )
+
+    # История — из своего хранилища, без запроса сообщений чата в Avito
+    history = await asyncio.to_thread(conversation_store.recent, chat_id, app_settings.conversation_history_turns)
+    await asyncio.to_thread(conversation_store.append, chat_id, USER, message_text)
+
+    assistant_error: str | None = None
+    messaging_error: str | None = None
+    input_tokens: int | None = None
+    generated: List[str] = []
+    try:
+        with metrics.timer("webhook_pipeline.stage.prompt"):
+            prompt = assemble_prompt(project, message_text, history, item_context=item_context)
+        _report_prompt(prompt, "webhook_pipeline", chat_id)
+        input_tokens = prompt.input_tokens
+
+        await send_reply_parts(
+            reply_parts(project, message_text, prompt.system_prompt, prompt.history),
+            send,
+            "webhook_pipeline",
+            generated,
+        )
+    except PerplexityClientError as exc:
+        assistant_error = str(exc)
+        logger.error("Perplexity error for chat_id=%s: %s", chat_id, assistant_error)
+    except AvitoClientError as exc:
+        messaging_error = str(exc)
+        logger.error("Avito messaging error for chat_id=%s: %s", chat_id, messaging_error)
+    assistant_reply = "\n\n".join(generated) or None
+    if assistant_reply:
+        # Сохраняем и частично отправленный ответ: клиент его уже видел
+        await asyncio.to_thread(conversation_store.append, chat_id, ASSISTANT, assistant_reply)
+
+    return {
+        "assistant_reply": assistant_reply,
+        # оценка входных токенов запроса к LLM (см. app.prompts.assemble_prompt)
+        "input_tokens": input_tokens,
+        "assistant_error": assistant_error,
+        "messaging_error": messaging_error,
+    }
+
+
+async def _reply_to_burst(burst: ChatBurst) -> None:
+    """Окно склейки закрылось: сообщения пачки — одной репликой клиента."""
+    if len(burst.texts) > 1:
+        logger.info("Coalesced %s messages in chat %s", len(burst.texts), burst.chat_id)
+    route, item_context = burst.payload  # берём с последнего сообщения пачки
+    await _reply_in_chat(route, burst.chat_id, burst.text, item_context)
+
+
+reply_debouncer = ChatDebouncer(
+    _reply_to_burst,
+    quiet=app_settings.reply_debounce_quiet_ms / 1000,
+    max_wait=app_settings.reply_debounce_max_wait_ms / 1000,
+    tick=app_settings.reply_debounce_tick_ms / 1000,
+    concurrency=app_settings.webhook_workers,
 )
-async def avito_webhook_handler(webhook: AvitoWebhook):
-    logger.info(
-        "Received Avito webhook: id=%s type=%s chat_id=%s",
-        webhook.id,
-        webhook.payload.type,
-        webhook.payload.value.chat_id,
-    )
 
-    project = project_store.get_project("default")
+
+async def process_avito_webhook(webhook: AvitoWebhook) -> dict:
+    """
+    Полная обработка вебхука: STT → промпт → LLM → отправка в Avito.
+
+    Выполняется воркером конвейера, а не в HTTP-запросе. Клиенты Avito,
+    SpeechKit и Perplexity асинхронные (общий httpx.AsyncClient), так что
+    ожидание ответов не занимает ни event loop, ни потоки.
+
+    Если включена склейка (reply_debounce_quiet_ms > 0 и reply_debouncer
+    запущен), текст сообщения уходит в пачку чата, а отвечает уже
+    reply_debouncer — одним ответом на несколько сообщений подряд.
+    """
+    # Проект и токены — по аккаунту продавца, которому пришло сообщение
+    route = account_router.route(str(webhook.payload.value.user_id))
+    project = route.project
     if not project:
-        logger.error("No default project configured, skipping webhook")
-        return {
-            "processed": False,
-            "reason": "no_project",
-            "stt_error": None,
-            "assistant_error": None,
-            "messaging_error": None,
-        }
+        logger.error("No project for Avito account %s, skipping webhook", webhook.payload.value.user_id)
+        return _skipped_result("no_project")
 
     now_utc = datetime.now(timezone.utc)
     if not project.enabled:
         logger.info("Assistant disabled for project=%s, skipping", project.id)
-        return {
-            "processed": False,
-            "reason": "disabled",
-            "stt_error": None,
-            "assistant_error": None,
-            "messaging_error": None,
-        }
+        return _skipped_result("disabled")
 
     if not _is_within_schedule(project, now_utc):
         logger.info("Assistant out of schedule for project=%s, skipping", project.id)
-        return {
-            "processed": False,
-            "reason": "out_of_schedule",
-            "stt_error": None,
-            "assistant_error": None,
-            "messaging_error": None,
-        }
-     # Пока не получаем context — будем добавлять позже, когда Авито одобрит приложение
+        return _skipped_result("out_of_schedule")
+
+    # Пока не получаем context — будем добавлять позже, когда Авито одобрит приложение
     item_context_str = ""
-    author_id = webhook.payload.value.author_id
     original_message_type = webhook.payload.value.type
     content = webhook.payload.value.content
     chat_id = webhook.payload.value.chat_id
@@ -248,58 +841,47 @@ async def avito_webhook_handler(webhook: AvitoWebhook):
     # Исходный текст из Avito (для text-сообщений)
     message_text = content.text
 
-    assistant_reply: str | None = None
-    assistant_error: str | None = None
     stt_error: str | None = None
-    messaging_error: str | None = None
     recognized_text: str | None = None
+    reply = {"assistant_reply": None, "input_tokens": None, "assistant_error": None, "messaging_error": None}
 
     # Обработка голосовых сообщений: сначала распознаём речь
-    if original_message_type == "voice" and content.audio_url:
+    if original_message_type == "voice" and content.audio_url and _is_long_voice(content):
+        # Длинное голосовое: текст либо уже готов (вебхук вернулся из stt_jobs
+        # с текстом или то же аудио уже распознавали), либо запускаем
+        # асинхронное распознавание и освобождаем воркер
+        recognized_text = content.transcript or transcription_cache.get_by_url(content.audio_url)
+        if recognized_text is None:
+            try:
+                with metrics.timer("webhook_pipeline.stage.stt_submit"):
+                    await stt_jobs.submit(content.audio_url, webhook)
+            except STTClientError as exc:
+                stt_error = str(exc)
+            else:
+                return {**_skipped_result("stt_pending"), "status": "stt_pending", "webhook_id": webhook.id}
+        message_text = recognized_text
+    elif original_message_type == "voice" and content.audio_url:
         try:
-            recognized_text = stt_client.transcribe(content.audio_url)
+            with metrics.timer("webhook_pipeline.stage.stt"):
+                recognized_text = await stt_client.transcribe(content.audio_url)
             # После распознавания используем текст как обычное сообщение
             message_text = recognized_text
         except STTClientError as exc:
             stt_error = str(exc)
 
-    # Если у нас есть какой-то текст (исходный или распознанный) — зовём Perplexity
-    if message_text:
-        try:
-            system_prompt = build_system_prompt(project, item_context="")
-    
-            assistant_reply = perplexity_client.generate_reply(
-                user_message=message_text,
-                system_prompt=system_prompt,
-            )
-        except PerplexityClientError as exc:
-            assistant_error = str(exc)
-
-    # Если удалось сгенерировать ответ ассистента — отправляем его в чат Авито
-    if assistant_reply:
-        # Пробуем взять актуальный access_token из стора
-        tokens = avito_token_store.get_default_tokens()
-        if not tokens:
-            messaging_error = "No Avito access token configured"
-        else:
-            try:
-                avito_messenger_client.send_text_message(
-                    chat_id=chat_id,
-                    text=assistant_reply,
-                    access_token=tokens.access_token,
-                )
-            except AvitoClientError as exc:
-                messaging_error = str(exc)
-
     if stt_error:
         logger.error("STT error for chat_id=%s: %s", chat_id, stt_error)
-    if assistant_error:
-        logger.error("Perplexity error for chat_id=%s: %s", chat_id, assistant_error)
-    if messaging_error:
-        logger.error("Avito messaging error for chat_id=%s: %s", chat_id, messaging_error)
+
+    # Если у нас есть какой-то текст (исходный или распознанный) — зовём Perplexity
+    # и отправляем ответ в чат Авито (целиком или по частям, см. reply_parts)
+    if message_text and app_settings.reply_debounce_quiet_ms > 0 and reply_debouncer.running:
+        reply_debouncer.add(chat_id, message_text, (route, item_context_str))
+        return {**_skipped_result("debounced"), "status": "debounced", "webhook_id": webhook.id}
+    if message_text:
+        reply = await _reply_in_chat(route, chat_id, message_text, item_context_str)
 
     return {
-        "status": "received",
+        "status": "processed",
         "webhook_id": webhook.id,
         "event_type": webhook.payload.type,
         # исходный тип сообщения от Avito: "text" или "voice"
@@ -308,10 +890,131 @@ async def avito_webhook_handler(webhook: AvitoWebhook):
         "message_text": content.text,
         # текст, полученный из голосового сообщения (для voice)
         "recognized_text": recognized_text,
-        "assistant_reply": assistant_reply,
-        "assistant_error": assistant_error,
+        **reply,
         "stt_error": stt_error,
-        "messaging_error": messaging_error,
+    }
+
+
+webhook_pipeline = WebhookPipeline(
+    process_avito_webhook,
+    workers=app_settings.webhook_workers,
+    max_queue_size=app_settings.webhook_queue_maxsize,
+    name="webhook_pipeline",
+)
+
+
+async def _resume_after_transcription(job: RecognitionJob, text: str) -> None:
+    """
+    Длинное голосовое распознано: текст — в кэш, вебхук — обратно в конвейер.
+
+    Текст едет вместе с вебхуком: запись кэша могли вытеснить до того, как
+    воркер до него доберётся, и тогда распознавание запустилось бы заново.
+    """
+    transcription_cache.put(job.audio_url, job.digest, text)
+    webhook_pipeline.submit(job.payload.with_transcript(text))
+
+
+stt_jobs = RecognitionJobScheduler(
+    stt_client,
+    on_done=_resume_after_transcription,
+    initial_delay=app_settings.stt_job_poll_initial,
+    max_delay=app_settings.stt_job_poll_max,
+    backoff=app_settings.stt_job_poll_backoff,
+    timeout=app_settings.stt_job_timeout,
+    concurrency=app_settings.stt_job_concurrency,
+)
+metrics.register_gauge("webhook_pipeline", webhook_pipeline.stats)
+metrics.register_gauge("stt_jobs", stt_jobs.stats)
+metrics.register_gauge("prompt_cache", prompt_cache.stats)
+metrics.register_gauge("prompt_prefix_cache", prefix_cache.stats)
+metrics.register_gauge("webhook_dedup", webhook_dedup.stats)
+metrics.register_gauge("answer_cache", answer_cache.stats)
+metrics.register_gauge("semantic_cache", semantic_cache.stats)
+metrics.register_gauge("conversations", conversation_store.stats)
+metrics.register_gauge("token_estimator", token_estimator.stats)
+metrics.register_gauge("debounce", reply_debouncer.stats)
+metrics.register_gauge("transcription_cache", transcription_cache.stats)
+metrics.register_gauge("avito_rate_limiter", avito_rate_limiter.stats)
+metrics.register_gauge("resilience", resilience_registry.snapshot)
+
+
+@app.on_event("startup")
+async def startup_pipeline():
+    await http_transport.start()
+    await webhook_pipeline.start()
+    await stt_jobs.start()
+    await reply_debouncer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_pipeline():
+    await stt_jobs.stop()
+    await webhook_pipeline.stop(drain_timeout=app_settings.webhook_drain_timeout)
+    # После конвейера: вебхуки, дошедшие при сливе очереди, тоже попадут в пачки
+    await reply_debouncer.stop(timeout=app_settings.webhook_drain_timeout)
+    await http_transport.aclose()
+    chat_state.close()
+    # Сжатие и запись Bloom-фильтров — не на event loop
+    await asyncio.to_thread(webhook_dedup.close)
+    await asyncio.to_thread(transcription_cache.close)
+    if storage is not None:
+        storage.close()
+
+
+def _webhook_dedup_keys(webhook: AvitoWebhook) -> tuple:
+    """Ключи дедупликации: id события и id сообщения."""
+    return (f"event:{webhook.id}", f"message:{webhook.payload.value.id}")
+
+
+@app.post(
+    "/webhooks/avito",
+    status_code=status.HTTP_200_OK,
+    summary="Avito Messenger webhook endpoint",
+)
+async def avito_webhook_handler(webhook: AvitoWebhook):
+    """
+    Принимает вебхук Avito: валидирует, ставит в очередь и сразу отвечает 200.
+
+    Вся обработка (STT, LLM, отправка) идёт в воркерах конвейера,
+    поэтому Avito не ждёт ответа модели и не ретраит по таймауту.
+    Если очередь переполнена — отвечаем 503, Avito доставит событие повторно.
+    Повторные доставки (тот же id события или сообщения) подтверждаются
+    сразу, без постановки в очередь.
+    """
+    dedup_keys = _webhook_dedup_keys(webhook)
+    if webhook_dedup.seen(dedup_keys):
+        metrics.inc("webhook.duplicates")
+        logger.info("Duplicate Avito webhook id=%s, skipping", webhook.id)
+        return {
+            "status": "duplicate",
+            "webhook_id": webhook.id,
+            "event_type": webhook.payload.type,
+            "queued": False,
+        }
+
+    logger.info(
+        "Received Avito webhook: id=%s type=%s chat_id=%s",
+        webhook.id,
+        webhook.payload.type,
+        webhook.payload.value.chat_id,
+    )
+
+    try:
+        webhook_pipeline.submit(webhook)
+    except PipelineQueueFull:
+        logger.warning("Webhook queue is full, rejecting webhook id=%s", webhook.id)
+        raise HTTPException(status_code=503, detail="Webhook queue is full")
+    except PipelineNotRunning:
+        logger.error("Webhook pipeline is not running, rejecting webhook id=%s", webhook.id)
+        raise HTTPException(status_code=503, detail="Webhook pipeline is not running")
+
+    # Запоминаем только принятые в очередь события: повтор после 503 должен пройти
+    webhook_dedup.add(dedup_keys)
+    return {
+        "status": "received",
+        "webhook_id": webhook.id,
+        "event_type": webhook.payload.type,
+        "queued": True,
     }
 
 
@@ -354,16 +1057,18 @@ async def avito_oauth_callback(code: str | None = None, error: str | None = None
         raise HTTPException(status_code=400, detail="Missing authorization code")
 
     try:
-        tokens = avito_auth_client.exchange_code_for_tokens(code)
+        tokens = await avito_auth_client.exchange_code_for_tokens(code)
         avito_tokens = AvitoTokens.from_oauth_response(tokens)
-        # Сохраняем токены в файловом хранилище как "default"
+        # Токены сохраняются под account_id (первый аккаунт — как "default")
         try:
-            account_info = avito_messenger_client.get_account_info(avito_tokens.access_token)
+            account_info = await avito_messenger_client.get_account_info(avito_tokens.access_token)
             avito_tokens.account_id = str(account_info.get("id")) if account_info else None
         except AvitoClientError as exc:
             logger.warning("Не удалось получить account_id у Avito: %s", exc)
 
-        avito_token_store.save_default_tokens(avito_tokens)
+        avito_token_store.save_tokens(avito_tokens)
+        # Новый аккаунт — поллер мог спать до открытия расписания других проектов
+        _reset_poller_schedule()
 
     except AvitoAuthError as exc:
         raise HTTPException(status_code=502, detail=str(exc))
@@ -407,8 +1112,48 @@ def update_project(
     if project.id != project_id:
         raise HTTPException(status_code=400, detail="Project ID mismatch")
     project_store.upsert_project(project)
+    answer_cache.purge(project.id)
+    semantic_cache.purge(project.id)
     return project
 
+@app.get("/admin/metrics")
+def get_metrics(current_admin: str = Depends(get_current_admin)):
+    """
+    Снимок метрик: глубина очереди вебхуков, число воркеров,
+    тайминги этапов конвейера и прочие счётчики.
+    """
+    return metrics.snapshot()
+
+
+@app.delete("/admin/answer-cache")
+def purge_answer_cache(project_id: str | None = None, current_admin: str = Depends(get_current_admin)):
+    """Сбрасывает кэши ответов LLM (точный и семантический) — целиком или для одного проекта."""
+    removed = answer_cache.purge(project_id)
+    removed_semantic = semantic_cache.purge(project_id)
+    return {"status": "ok", "project_id": project_id, "removed": removed, "removed_semantic": removed_semantic}
+
+
+@app.delete("/admin/transcription-cache")
+def purge_transcription_cache(current_admin: str = Depends(get_current_admin)):
+    """Сбрасывает кэш распознанных голосовых (например, после смены модели STT)."""
+    return {"status": "ok", "removed": transcription_cache.purge()}
+
+
+@app.get("/admin/resilience")
+def get_resilience(current_admin: str = Depends(get_current_admin)):
+    """Состояние circuit breaker и бюджета повторов по каждой внешней зависимости."""
+    return resilience_registry.snapshot()
+
+
+@app.post("/admin/resilience/{name}/reset")
+def reset_resilience(name: str, current_admin: str = Depends(get_current_admin)):
+    """Принудительно замыкает цепь зависимости (например, после ручной проверки)."""
+    if name not in resilience_registry.snapshot():
+        raise HTTPException(status_code=404, detail="Unknown dependency")
+    resilience_registry.reset(name)
+    return {"status": "ok", **resilience_registry.snapshot()[name]}
+
+
 @app.get("/admin/debug/avito-self")
 async def debug_avito_self(current_admin: str = Depends(get_current_admin)):
     """
@@ -424,7 +1169,8 @@ async def debug_avito_self(current_admin: str = Depends(get_current_admin)):
     }
     
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        await avito_rate_limiter.acquire(tokens.account_id, "read")
+        resp = await http_transport.request("GET", url, headers=headers)
         return {
             "status": "ok",
             "status_code": resp.status_code,
@@ -441,7 +1187,7 @@ async def debug_chats(current_admin: str = Depends(get_current_admin)):
     tokens = avito_token_store.get_default_tokens()
     if not tokens or not tokens.account_id:
         raise HTTPException(status_code=404, detail="No Avito account id saved")
-    chats = avito_messenger_client.get_chats(
+    chats = await avito_messenger_client.get_chats(
         access_token=tokens.access_token,
         account_id=tokens.account_id,
         limit=5,
@@ -451,20 +1197,22 @@ async def debug_chats(current_admin: str = Depends(get_current_admin)):
 @app.get("/admin/debug/chat/{chat_id}/messages")
 async def debug_chat_messages(chat_id: str, current_admin: str = Depends(get_current_admin)):
     tokens = avito_token_store.get_default_tokens()
-    messages = avito_messenger_client.get_chat_messages(
+    messages = await avito_messenger_client.get_chat_messages(
         chat_id=chat_id,
         access_token=tokens.access_token,
         limit=5,
+        account_id=tokens.account_id,
     )
     return {"chat_id": chat_id, "messages": messages[:3]}
 
 @app.post("/admin/debug/chat/{chat_id}/send")
 async def debug_send_message(chat_id: str, text: str, current_admin: str = Depends(get_current_admin)):
     tokens = avito_token_store.get_default_tokens()
-    avito_messenger_client.send_text_message(
+    await avito_messenger_client.send_text_message(
         chat_id=chat_id,
         text=text,
         access_token=tokens.access_token,
+        account_id=tokens.account_id,
     )
     return {"sent": True}
 
@@ -496,7 +1244,9 @@ async def ui_update_project(
     schedule_mode: str = Form(...),
     tone: str = Form(...),
     allow_price_discussion: bool = Form(False),
+    stream_replies: bool = Form(False),
     extra_instructions: str = Form(""),
+    prompt_token_budget: str = Form(""),
     current_admin: str = Depends(get_current_admin),
 ):
 
@@ -504,15 +1254,29 @@ async def ui_update_project(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    project.name = name
-    project.business_type = business_type  # доверяем HTML‑select
-    project.timezone = timezone
-    project.enabled = enabled
-    project.schedule_mode = schedule_mode  # "always" или "by_schedule"
-    project.tone = tone
-    project.allow_price_discussion = allow_price_discussion
-    project.extra_instructions = extra_instructions or None
+    # Project неизменяемый (его же отдаёт кэш стора) — собираем новую версию
+    try:
+        project = Project.model_validate(
+            {
+                **project.model_dump(),
+                "name": name,
+                "business_type": business_type,
+                "timezone": timezone,
+                "enabled": enabled,
+                "schedule_mode": schedule_mode,  # "always" или "by_schedule"
+                "tone": tone,
+                "allow_price_discussion": allow_price_discussion,
+                "stream_replies": stream_replies,
+                "extra_instructions": extra_instructions or None,
+                # Пустое поле — бюджет по умолчанию из настроек
+                "prompt_token_budget": prompt_token_budget.strip() or None,
+            }
+        )
+    except ValidationError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     project_store.upsert_project(project)
+    answer_cache.purge(project.id)
+    semantic_cache.purge(project.id)
 
     return RedirectResponse(url="/ui/project", status_code=303)
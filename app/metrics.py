@@ -0,0 +1,114 @@
+"""
+Простейший in-process реестр метрик.
+
+Хранит счётчики, тайминги (с ограниченной выборкой для перцентилей)
+и gauge-функции, которые вычисляются в момент снимка.
+Снимок отдаётся через админский эндпоинт /admin/metrics.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator
+
+
+class _TimingStats:
+    """Агрегаты по одному таймингу: count/total/max + последние N значений."""
+
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self, reservoir_size: int) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=reservoir_size)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def pct(q: float) -> float:
+            if not ordered:
+                return 0.0
+            idx = min(len(ordered) - 1, int(q * len(ordered)))
+            return ordered[idx] * 1000
+
+        return {
+            "count": self.count,
+            "avg_ms": (self.total / self.count * 1000) if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+        }
+
+
+class Metrics:
+    """Потокобезопасный реестр счётчиков, таймингов и gauge-функций."""
+
+    def __init__(self, reservoir_size: int = 1024) -> None:
+        self._lock = threading.Lock()
+        self._reservoir_size = reservoir_size
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, _TimingStats] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._timings.get(name)
+            if stats is None:
+                stats = self._timings[name] = _TimingStats(self._reservoir_size)
+            stats.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Замеряет длительность блока и пишет её в тайминг name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def register_gauge(self, name: str, fn: Callable[[], Any]) -> None:
+        """Регистрирует функцию, значение которой попадает в снимок."""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: s.snapshot() for name, s in self._timings.items()}
+            gauges = dict(self._gauges)
+
+        gauge_values: Dict[str, Any] = {}
+        for name, fn in gauges.items():
+            try:
+                gauge_values[name] = fn()
+            except Exception as exc:  # gauge не должен ломать весь снимок
+                gauge_values[name] = f"error: {exc}"
+
+        return {"counters": counters, "timings": timings, "gauges": gauge_values}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+# Глобальный реестр приложения
+metrics = Metrics()
@@ -0,0 +1,158 @@
+"""
+Асинхронный конвейер обработки вебхуков.
+
+Эндпоинт вебхука только валидирует событие и кладёт его в in-process очередь,
+а пул asyncio-воркеров разбирает очередь и выполняет тяжёлые этапы
+(STT → промпт → LLM → отправка) уже вне HTTP-запроса.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from app.metrics import Metrics, metrics as default_metrics
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PipelineError(Exception):
+    """Базовое исключение конвейера."""
+    pass
+
+
+class PipelineNotRunning(PipelineError):
+    """Конвейер ещё не запущен (или уже остановлен) — задачу некуда положить."""
+    pass
+
+
+class PipelineQueueFull(PipelineError):
+    """Очередь переполнена — вызывающая сторона должна ответить 503."""
+    pass
+
+
+class WebhookPipeline(Generic[T]):
+    """
+    Очередь + пул воркеров.
+
+    - submit() неблокирующий: кладёт задачу в очередь или бросает исключение;
+    - handler(item) выполняется воркером, исключения логируются и не роняют воркер;
+    - в метрики пишутся время ожидания в очереди и общее время обработки задачи.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[T], Awaitable[Any]],
+        workers: int = 4,
+        max_queue_size: int = 1000,
+        name: str = "pipeline",
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        self._handler = handler
+        self._workers_count = workers
+        self._max_queue_size = max_queue_size
+        self.name = name
+        self._metrics = metrics or default_metrics
+
+        self._queue: Optional["asyncio.Queue[Tuple[float, T]]"] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._busy = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def worker_count(self) -> int:
+        return len(self._workers)
+
+    @property
+    def busy_workers(self) -> int:
+        return self._busy
+
+    async def start(self) -> None:
+        """Создаёт очередь и запускает воркеров в текущем event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self._workers_count)
+        ]
+        logger.info("%s started: workers=%s queue_max=%s", self.name, self._workers_count, self._max_queue_size)
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """
+        Останавливает воркеров.
+
+        Сначала ждём до drain_timeout секунд, пока очередь опустеет,
+        затем отменяем воркеров. Недообработанные задачи теряются (и логируются).
+        """
+        if not self.running or self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s: drain timeout, dropping %s queued jobs", self.name, self._queue.qsize())
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        logger.info("%s stopped", self.name)
+
+    def submit(self, item: T) -> None:
+        """Кладёт задачу в очередь, не дожидаясь обработки."""
+        if self._queue is None:
+            raise PipelineNotRunning(f"{self.name} is not running")
+        try:
+            self._queue.put_nowait((time.perf_counter(), item))
+        except asyncio.QueueFull as exc:
+            self._metrics.inc(f"{self.name}.rejected")
+            raise PipelineQueueFull(f"{self.name} queue is full") from exc
+        self._metrics.inc(f"{self.name}.enqueued")
+
+    async def join(self) -> None:
+        """Ждёт, пока все поставленные задачи будут обработаны (удобно в тестах)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "workers": self.worker_count,
+            "busy_workers": self._busy,
+            "queue_depth": self.queue_depth,
+            "queue_max": self._max_queue_size,
+        }
+
+    async def _worker(self, index: int) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            enqueued_at, item = await queue.get()
+            self._busy += 1
+            started = time.perf_counter()
+            self._metrics.observe(f"{self.name}.queue_wait", started - enqueued_at)
+            try:
+                await self._handler(item)
+                self._metrics.inc(f"{self.name}.processed")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._metrics.inc(f"{self.name}.failed")
+                logger.exception("%s worker %s: job failed", self.name, index)
+            finally:
+                self._metrics.observe(f"{self.name}.job", time.perf_counter() - started)
+                self._busy -= 1
+                queue.task_done()
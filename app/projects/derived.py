@@ -0,0 +1,69 @@
+"""
+Кэш данных, производных от проекта (скомпилированное расписание, хэш и т.п.).
+
+Project неизменяемый, а ProjectStore отдаёт один и тот же объект, пока проект
+не изменился. Поэтому производные данные можно считать один раз на объект:
+ключ — id(project), а сам объект держим в кэше, чтобы id не переиспользовался.
+Изменение проекта = новый объект = пересчёт.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Tuple, TypeVar
+
+from .models import Project
+
+
+T = TypeVar("T")
+
+
+class ProjectDerivedCache(Generic[T]):
+    """LRU-кэш factory(project), привязанный к конкретному объекту Project."""
+
+    def __init__(self, factory: Callable[[Project], T], maxsize: int = 1024) -> None:
+        self._factory = factory
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[int, Tuple[Project, T]]" = OrderedDict()
+
+    def get(self, project: Project) -> T:
+        key = id(project)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] is project:
+                self._items.move_to_end(key)
+                return item[1]
+
+        value = self._factory(project)
+
+        with self._lock:
+            self._items[key] = (project, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def _content_hash(project: Project) -> str:
+    return hashlib.sha256(project.model_dump_json().encode("utf-8")).hexdigest()
+
+
+_revisions: ProjectDerivedCache[str] = ProjectDerivedCache(_content_hash)
+
+
+def project_revision(project: Project) -> str:
+    """
+    Хэш содержимого проекта.
+
+    Меняется при любом изменении настроек, поэтому годится как часть ключа
+    кэшей (промпты, ответы). Для одного объекта считается один раз.
+    """
+    return _revisions.get(project)
@@ -1,25 +1,38 @@
-from typing import List, Literal, Optional
-from pydantic import BaseModel, Field
+from typing import Literal, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field
+
+
+# Модели неизменяемые: ProjectStore отдаёт один и тот же объект из кэша
+# всем читателям, поэтому менять его на месте нельзя — только через upsert.
 
 
 class TimeRange(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     start: str  # формат "HH:MM"
     end: str    # формат "HH:MM"
 
 
 class WeeklySchedule(BaseModel):
-    mon: List[TimeRange] = Field(default_factory=list)
-    tue: List[TimeRange] = Field(default_factory=list)
-    wed: List[TimeRange] = Field(default_factory=list)
-    thu: List[TimeRange] = Field(default_factory=list)
-    fri: List[TimeRange] = Field(default_factory=list)
-    sat: List[TimeRange] = Field(default_factory=list)
-    sun: List[TimeRange] = Field(default_factory=list)
+    model_config = ConfigDict(frozen=True)
+
+    mon: Tuple[TimeRange, ...] = ()
+    tue: Tuple[TimeRange, ...] = ()
+    wed: Tuple[TimeRange, ...] = ()
+    thu: Tuple[TimeRange, ...] = ()
+    fri: Tuple[TimeRange, ...] = ()
+    sat: Tuple[TimeRange, ...] = ()
+    sun: Tuple[TimeRange, ...] = ()
 
 
 class Project(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     name: str
+    # Аккаунт Avito (user_id продавца), чьи чаты обслуживает проект;
+    # None — проект не привязан и используется как "default"
+    avito_account_id: Optional[str] = None
     business_type: Literal["real_estate", "auto", "services", "goods", "other"]
     timezone: str = "Europe/Moscow"
     enabled: bool = True
@@ -29,3 +42,8 @@ class Project(BaseModel):
     tone: Literal["friendly", "neutral", "formal"] = "friendly"
     allow_price_discussion: bool = True
     extra_instructions: Optional[str] = None
+    # Потоковый ответ: первое предложение уходит в чат сразу, остальное следом
+    stream_replies: bool = False
+    # Бюджет входных токенов запроса к LLM (см. app.prompts.assemble_prompt);
+    # None — app_settings.prompt_token_budget
+    prompt_token_budget: Optional[int] = Field(default=None, gt=0)
@@ -0,0 +1,145 @@
+"""
+Скомпилированное недельное расписание проекта.
+
+WeeklySchedule один раз превращается в:
+- битовую карту минут недели (10080 байт) — "открыто ли сейчас" за O(1);
+- отсортированный список минут, где состояние меняется, — "когда следующее
+  открытие/закрытие" за O(log n) через bisect.
+
+Интервалы включают минуту окончания (09:00–18:00 открыт и в 18:00), как и
+прежняя проверка строками. Ночные интервалы (22:00–02:00) переходят на
+следующий день, с воскресенья — на понедельник.
+"""
+
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from .derived import ProjectDerivedCache
+from .models import Project, TimeRange
+
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+_DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+@lru_cache(maxsize=None)
+def get_zoneinfo(name: str) -> ZoneInfo:
+    """ZoneInfo по имени; объекты переиспользуются между проектами."""
+    return ZoneInfo(name)
+
+
+def _parse_hhmm(value: str) -> int:
+    hours, minutes = value.split(":")
+    h, m = int(hours), int(minutes)
+    if h == 24 and m == 0:
+        # "24:00" — конец суток
+        return MINUTES_PER_DAY - 1
+    if not (0 <= h < 24 and 0 <= m < 60):
+        raise ValueError(f"invalid time {value!r}")
+    return h * 60 + m
+
+
+def _ranges_to_minutes(day_index: int, time_range: TimeRange) -> List[Tuple[int, int]]:
+    """Интервал дня → список включительных отрезков в минутах недели."""
+    start = _parse_hhmm(time_range.start)
+    end = _parse_hhmm(time_range.end)
+    day_offset = day_index * MINUTES_PER_DAY
+
+    if start <= end:
+        return [(day_offset + start, day_offset + end)]
+
+    # Ночной интервал: до конца текущих суток и с начала следующих
+    next_day_offset = ((day_index + 1) % 7) * MINUTES_PER_DAY
+    return [
+        (day_offset + start, day_offset + MINUTES_PER_DAY - 1),
+        (next_day_offset, next_day_offset + end),
+    ]
+
+
+class CompiledSchedule:
+    """Готовый к быстрым запросам вид расписания одного проекта."""
+
+    __slots__ = ("always", "tz", "_open", "_transitions")
+
+    def __init__(self, always: bool, tz: ZoneInfo, open_minutes: bytearray, transitions: List[int]) -> None:
+        self.always = always
+        self.tz = tz
+        self._open = open_minutes
+        self._transitions = transitions
+
+    @classmethod
+    def from_project(cls, project: Project) -> "CompiledSchedule":
+        tz = get_zoneinfo(project.timezone)
+        if project.schedule_mode == "always":
+            return cls(True, tz, bytearray(), [])
+
+        open_minutes = bytearray(MINUTES_PER_WEEK)
+        for day_index, day in enumerate(_DAYS):
+            for time_range in getattr(project.schedule, day):
+                try:
+                    segments = _ranges_to_minutes(day_index, time_range)
+                except ValueError:
+                    logger.warning(
+                        "Invalid schedule range %s-%s in project=%s, ignoring",
+                        time_range.start,
+                        time_range.end,
+                        project.id,
+                    )
+                    continue
+                for seg_start, seg_end in segments:
+                    open_minutes[seg_start:seg_end + 1] = b"\x01" * (seg_end - seg_start + 1)
+
+        # Минуты, в которые состояние отличается от предыдущей (по кругу недели)
+        transitions = [
+            minute
+            for minute in range(MINUTES_PER_WEEK)
+            if open_minutes[minute] != open_minutes[minute - 1]
+        ]
+        return cls(False, tz, open_minutes, transitions)
+
+    def _minute_of_week(self, now_utc: datetime) -> Tuple[datetime, int]:
+        now_local = now_utc.astimezone(self.tz)
+        minute = now_local.weekday() * MINUTES_PER_DAY + now_local.hour * 60 + now_local.minute
+        return now_local, minute
+
+    def is_open(self, now_utc: datetime) -> bool:
+        if self.always:
+            return True
+        _, minute = self._minute_of_week(now_utc)
+        return bool(self._open[minute])
+
+    def next_transition(self, now_utc: datetime) -> Optional[datetime]:
+        """
+        Момент (в UTC) следующей смены состояния открыто/закрыто.
+
+        None — если состояние не меняется никогда (always, пустое или
+        круглосуточное расписание).
+        """
+        if self.always or not self._transitions:
+            return None
+
+        now_local, minute = self._minute_of_week(now_utc)
+        idx = bisect_right(self._transitions, minute)
+        if idx < len(self._transitions):
+            delta = self._transitions[idx] - minute
+        else:
+            delta = self._transitions[0] + MINUTES_PER_WEEK - minute
+
+        minute_start = now_local.replace(second=0, microsecond=0)
+        return (minute_start + timedelta(minutes=delta)).astimezone(now_utc.tzinfo)
+
+
+_compiled = ProjectDerivedCache(CompiledSchedule.from_project)
+
+
+def compile_schedule(project: Project) -> CompiledSchedule:
+    """Скомпилированное расписание; пересобирается только при смене проекта."""
+    return _compiled.get(project)
@@ -1,20 +1,53 @@
 import json
 import os
 import threading
-from typing import Dict, List, Optional
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 from .models import Project
 
 
+# (st_ino, st_mtime_ns, st_size) — по изменению сигнатуры понимаем,
+# что файл переписали снаружи (руками, другим процессом, деплоем).
+# Другие бэкенды хранения подставляют свою сигнатуру (см. app.storage).
+FileSignature = Optional[Tuple[int, ...]]
+
+
+class _Snapshot:
+    """Снимок содержимого файла: сырые dict'ы и уже распарсенные проекты."""
+
+    __slots__ = ("raw", "parsed")
+
+    def __init__(self, raw: Dict[str, dict]) -> None:
+        self.raw = raw
+        self.parsed: Dict[str, Project] = {}
+
+
 class ProjectStore:
     """
     Простое файловое хранилище проектов.
     В MVP храним всё в data/projects.json.
+
+    Поверх файла — read-through кэш неизменяемых Project:
+    - чтения не трогают диск и не берут lock, пока кэш свежий;
+    - не чаще раза в check_interval секунд проверяем stat() файла
+      и перечитываем его, если файл изменили снаружи;
+    - upsert_project обновляет кэш сразу.
+
+    version растёт при каждой смене снимка. Производные индексы (например,
+    app.routing.AccountRouter) подписываются через add_listener на upsert,
+    а по version замечают, что файл перечитан целиком.
     """
 
-    def __init__(self, path: str = "data/projects.json") -> None:
+    def __init__(self, path: str = "data/projects.json", check_interval: float = 1.0) -> None:
         self.path = path
+        self.check_interval = check_interval
         self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._signature: FileSignature = None
+        self._checked_at = 0.0
+        self._version = 0
+        self._listeners: List[Callable[[Project, int], None]] = []
 
     def _load_all(self) -> Dict[str, dict]:
         if not os.path.exists(self.path):
@@ -32,21 +65,93 @@ class ProjectStore:
             json.dump(data, f, ensure_ascii=False, indent=2)
         os.replace(tmp_path, self.path)
 
-    def list_projects(self) -> List[Project]:
+    def _persist(self, raw: Dict[str, dict], project: Project) -> None:
+        """Сохраняет изменённый проект; JSON-файл приходится переписывать целиком."""
+        self._save_all(raw)
+
+    def _file_signature(self) -> FileSignature:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _current(self) -> _Snapshot:
+        """
+        Возвращает актуальный снимок.
+
+        Быстрый путь — без I/O и без lock. Медленный путь (раз в check_interval)
+        делает stat() и перечитывает файл только если он изменился.
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
         with self._lock:
-            raw = self._load_all()
-            return [Project(**p) for p in raw.values()]
+            return self._refresh_locked(now)
+
+    def _refresh_locked(self, now: float) -> _Snapshot:
+        # Сигнатуру снимаем до чтения: если файл поменяют во время чтения,
+        # следующая проверка увидит расхождение и перечитает его ещё раз.
+        signature = self._file_signature()
+        if self._snapshot is None or signature != self._signature:
+            self._snapshot = _Snapshot(self._load_all())
+            self._signature = signature
+            self._version += 1
+        self._checked_at = now
+        return self._snapshot
+
+    def _parse(self, snapshot: _Snapshot, project_id: str) -> Optional[Project]:
+        project = snapshot.parsed.get(project_id)
+        if project is not None:
+            return project
+        data = snapshot.raw.get(project_id)
+        if not data:
+            return None
+        project = Project(**data)
+        snapshot.parsed[project_id] = project
+        return project
+
+    @property
+    def version(self) -> int:
+        """Номер актуального снимка (с той же проверкой свежести, что и чтения)."""
+        self._current()
+        return self._version
+
+    def add_listener(self, listener: Callable[[Project, int], None]) -> None:
+        """listener(project, version) вызывается после каждого upsert_project."""
+        self._listeners.append(listener)
+
+    def list_projects(self) -> List[Project]:
+        snapshot = self._current()
+        return [self._parse(snapshot, project_id) for project_id in list(snapshot.raw)]
 
     def get_project(self, project_id: str) -> Optional[Project]:
-        with self._lock:
-            raw = self._load_all()
-            data = raw.get(project_id)
-            if not data:
-                return None
-            return Project(**data)
+        return self._parse(self._current(), project_id)
 
     def upsert_project(self, project: Project) -> None:
         with self._lock:
-            raw = self._load_all()
-            raw[project.id] = project.model_dump()
-            self._save_all(raw)
+            # Перед записью сверяемся с диском, чтобы не затереть внешние правки
+            snapshot = self._refresh_locked(time.monotonic())
+            raw = dict(snapshot.raw)
+            raw[project.id] = project.model_dump(mode="json")
+            self._persist(raw, project)
+
+            new_snapshot = _Snapshot(raw)
+            new_snapshot.parsed = dict(snapshot.parsed)
+            new_snapshot.parsed[project.id] = project
+            self._snapshot = new_snapshot
+            self._signature = self._file_signature()
+            self._version += 1
+            version = self._version
+
+        for listener in self._listeners:
+            listener(project, version)
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш: следующее чтение перечитает файл."""
+        with self._lock:
+            self._snapshot = None
+            self._signature = None
+            self._version += 1
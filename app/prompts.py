@@ -1,68 +1,129 @@
 """
 Модуль для построения system prompts для Perplexity API.
 Учитывает настройки проекта и контекст объявления.
+
+Промпт состоит из двух частей:
+- статический префикс проекта (роль, тон, торг, указания владельца, общие правила) —
+  собирается один раз на версию проекта и побайтно совпадает между вызовами,
+  поэтому на стороне провайдера работает prompt caching;
+- небольшой динамический суффикс (контекст объявления).
+
+Готовые промпты кэшируются в LRU по ключу
+(project id, хэш содержимого проекта, хэш item_context).
+
+assemble_prompt собирает весь запрос (промпт, история чата, сообщение
+клиента) в бюджет токенов проекта, урезая части по приоритету.
 """
 
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Optional, Sequence, Tuple
+
+from app.avito_item_client import DESCRIPTION_LABEL
+from app.conversation import Turn
+from app.projects.derived import project_revision
 from app.projects.models import Project
+from app.settings import app_settings
+from app.token_estimator import MESSAGE_OVERHEAD_TOKENS, token_estimator
 
 
-def build_system_prompt(project: Project, item_context: str = "") -> str:
-    """
-    Строит system prompt для Perplexity на основе настроек проекта и контекста объявления.
-    
-    Args:
-        project: Объект с настройками проекта
-        item_context: Отформатированная информация об объявлении
-        
-    Returns:
-        System prompt для LLM
-    """
-    
-    # Базовая инструкция в зависимости от типа бизнеса
-    business_prompts = {
-        "services": (
-            "Ты — ассистент для продажи услуг на Avito. "
-            "Твоя задача — отвечать на вопросы клиентов о предоставляемых услугах, "
-            "условиях работы, ценах и сроках выполнения."
-        ),
-        "goods": (
-            "Ты — ассистент для продажи товаров на Avito. "
-            "Твоя задача — отвечать на вопросы о товаре, его характеристиках, "
-            "состоянии, условиях доставки и оплаты."
-        ),
-        "real_estate": (  # было "realestate"
-            "Ты — ассистент по недвижимости на Avito. "
-            "Твоя задача — отвечать на вопросы о недвижимости, условиях аренды/продажи, "
-            "документах, просмотрах и особенностях объекта."
-        ),
-        "auto": (
-            "Ты — ассистент по продаже автомобилей на Avito. "
-            "Твоя задача — отвечать на вопросы о состоянии авто, комплектации, "
-            "истории эксплуатации, документах и условиях продажи."
-        ),
-    }
-    
-    base_instruction = business_prompts.get(
-        project.business_type,
-        "Ты — ассистент для чатов на Avito. Отвечай на вопросы клиентов вежливо и по существу."
-    )
-    
-    # Контекст объявления
-    item_section = ""
-    if item_context:
-        item_section = f"\n\n**Информация о товаре/услуге:**\n{item_context}"
-    
+# Базовая инструкция в зависимости от типа бизнеса
+BUSINESS_PROMPTS = {
+    "services": (
+        "Ты — ассистент для продажи услуг на Avito. "
+        "Твоя задача — отвечать на вопросы клиентов о предоставляемых услугах, "
+        "условиях работы, ценах и сроках выполнения."
+    ),
+    "goods": (
+        "Ты — ассистент для продажи товаров на Avito. "
+        "Твоя задача — отвечать на вопросы о товаре, его характеристиках, "
+        "состоянии, условиях доставки и оплаты."
+    ),
+    "real_estate": (  # было "realestate"
+        "Ты — ассистент по недвижимости на Avito. "
+        "Твоя задача — отвечать на вопросы о недвижимости, условиях аренды/продажи, "
+        "документах, просмотрах и особенностях объекта."
+    ),
+    "auto": (
+        "Ты — ассистент по продаже автомобилей на Avito. "
+        "Твоя задача — отвечать на вопросы о состоянии авто, комплектации, "
+        "истории эксплуатации, документах и условиях продажи."
+    ),
+}
+
+DEFAULT_BUSINESS_PROMPT = (
+    "Ты — ассистент для чатов на Avito. Отвечай на вопросы клиентов вежливо и по существу."
+)
+
+GENERAL_RULES = (
+    "\n\n**Общие правила:**"
+    "\n- Всегда отвечай на русском языке"
+    "\n- Будь кратким и по делу"
+    "\n- Если не знаешь точного ответа — честно скажи об этом"
+    "\n- Не придумывай информацию, которой нет в контексте"
+)
+
+
+class PromptCache:
+    """Потокобезопасный LRU-кэш готовых строк промпта со счётчиками."""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], str]) -> str:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = build()
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+prefix_cache = PromptCache(maxsize=app_settings.prompt_cache_size)
+prompt_cache = PromptCache(maxsize=app_settings.prompt_cache_size)
+
+
+def _text_hash(text: str) -> str:
+    if not text:
+        return ""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _build_static_prefix(project: Project, with_extras: bool = True) -> str:
+    base_instruction = BUSINESS_PROMPTS.get(project.business_type, DEFAULT_BUSINESS_PROMPT)
+
     # Тон общения
     tone_instruction = ""
     if project.tone == "formal":
         tone_instruction = "\nИспользуй формальный стиль общения, обращайся на 'Вы'."
     elif project.tone == "friendly":
         tone_instruction = "\nОбщайся дружелюбно и неформально, но соблюдай профессионализм."
-    elif project.tone == "neutral":  # добавь эту ветку, если её нет
+    elif project.tone == "neutral":
         tone_instruction = "\nОбщайся нейтрально и профессионально."
-    
+
     # Торг
-    price_instruction = ""
     if project.allow_price_discussion:
         price_instruction = (
             "\n\nКлиент может просить скидку. Ты можешь обсуждать возможность снижения цены, "
@@ -74,24 +135,154 @@ def build_system_prompt(project: Project, item_context: str = "") -> str:
             "\n\nЦена указана в объявлении и не подлежит обсуждению. "
             "Вежливо сообщи клиенту, что цена фиксированная."
         )
-    
+
     # Дополнительные инструкции от владельца
     extra_instruction = ""
-    if project.extra_instructions:
+    if with_extras and project.extra_instructions:
         extra_instruction = f"\n\n**Дополнительные указания от владельца:**\n{project.extra_instructions}"
-    
-    # Собираем всё вместе
-    system_prompt = (
-        base_instruction +
-        item_section +
-        tone_instruction +
-        price_instruction +
-        extra_instruction +
-        "\n\n**Общие правила:**"
-        "\n- Всегда отвечай на русском языке"
-        "\n- Будь кратким и по делу"
-        "\n- Если не знаешь точного ответа — честно скажи об этом"
-        "\n- Не придумывай информацию, которой нет в контексте"
+
+    return base_instruction + tone_instruction + price_instruction + extra_instruction + GENERAL_RULES
+
+
+def build_static_prefix(project: Project, with_extras: bool = True) -> str:
+    """
+    Статическая часть промпта проекта.
+
+    Один и тот же объект строки для одной версии проекта — подходит
+    для provider-side prompt caching (совпадающий префикс запроса).
+    with_extras=False — без дополнительных указаний владельца (не влезли в бюджет).
+    """
+    key = (project.id, project_revision(project), with_extras)
+    return prefix_cache.get_or_build(key, lambda: _build_static_prefix(project, with_extras))
+
+
+def build_dynamic_suffix(item_context: str = "") -> str:
+    """Динамическая часть промпта: контекст объявления (может быть пустым)."""
+    if not item_context:
+        return ""
+    return f"\n\n**Информация о товаре/услуге:**\n{item_context}"
+
+
+def build_system_prompt(project: Project, item_context: str = "", with_extras: bool = True) -> str:
+    """
+    Строит system prompt для Perplexity на основе настроек проекта и контекста объявления.
+
+    Args:
+        project: Объект с настройками проекта
+        item_context: Отформатированная информация об объявлении
+        with_extras: Включать ли extra_instructions проекта
+
+    Returns:
+        System prompt для LLM
+    """
+    key = (project.id, project_revision(project), _text_hash(item_context), with_extras)
+    return prompt_cache.get_or_build(
+        key,
+        lambda: build_static_prefix(project, with_extras) + build_dynamic_suffix(item_context),
+    )
+
+
+class AssembledPrompt(NamedTuple):
+    """Запрос к LLM, уложенный в бюджет токенов."""
+
+    system_prompt: str
+    history: Tuple[Turn, ...]
+    # Оценка входных токенов всего запроса (промпт + история + сообщение)
+    input_tokens: int
+    budget: int
+    # Что пришлось урезать: сколько старых реплик выброшено,
+    # укорочено ли описание объявления, выброшены ли указания владельца
+    dropped_turns: int = 0
+    description_trimmed: bool = False
+    extras_dropped: bool = False
+
+
+def _message_tokens(text: str) -> int:
+    return token_estimator.count(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _trim_description(item_context: str, max_tokens: int) -> str:
+    """
+    Укорачивает строку с описанием в item_context до max_tokens токенов
+    (или убирает её совсем); название, цена и прочие короткие поля остаются.
+    """
+    lines = item_context.split("\n")
+    for index, line in enumerate(lines):
+        if not line.startswith(DESCRIPTION_LABEL):
+            continue
+        line_tokens = token_estimator.count(line)
+        if line_tokens <= max_tokens:
+            return item_context
+        keep_chars = int(len(line) * max_tokens / line_tokens) - 1
+        if keep_chars <= len(DESCRIPTION_LABEL):
+            del lines[index]
+        else:
+            # Режем по границе слова, чтобы не оставлять обрубков
+            cut = line[:keep_chars]
+            space = cut.rfind(" ")
+            lines[index] = (cut[:space] if space > len(DESCRIPTION_LABEL) else cut) + "…"
+        break
+    return "\n".join(lines)
+
+
+def assemble_prompt(
+    project: Project,
+    user_message: str,
+    history: Sequence[Turn] = (),
+    item_context: str = "",
+    budget: Optional[int] = None,
+) -> AssembledPrompt:
+    """
+    Собирает запрос к LLM в бюджет токенов проекта (project.prompt_token_budget,
+    по умолчанию app_settings.prompt_token_budget).
+
+    Если запрос не влезает, части урезаются по приоритету:
+    1. старые реплики истории (с самой старой);
+    2. описание объявления в item_context;
+    3. дополнительные указания владельца (extra_instructions).
+    Роль, правила и само сообщение клиента не урезаются никогда: если не
+    влезают и они, запрос уходит как есть, сверх бюджета.
+    """
+    budget = budget or project.prompt_token_budget or app_settings.prompt_token_budget
+    system_prompt = build_system_prompt(project, item_context)
+    system_tokens = _message_tokens(system_prompt)
+    history_tokens = [_message_tokens(turn.text) for turn in history]
+    fixed_tokens = _message_tokens(user_message)
+    total = system_tokens + sum(history_tokens) + fixed_tokens
+
+    dropped_turns = 0
+    while total > budget and dropped_turns < len(history):
+        total -= history_tokens[dropped_turns]
+        dropped_turns += 1
+
+    description_trimmed = False
+    if total > budget and item_context:
+        without_description = _trim_description(item_context, 0)
+        base_tokens = _message_tokens(build_system_prompt(project, without_description))
+        # Разница между промптом с описанием и без него — это сама строка описания
+        trimmed_context = _trim_description(item_context, max(0, budget - (total - system_tokens) - base_tokens))
+        if trimmed_context != item_context:
+            item_context = trimmed_context
+            description_trimmed = True
+            system_prompt = build_system_prompt(project, item_context)
+            total -= system_tokens
+            system_tokens = _message_tokens(system_prompt)
+            total += system_tokens
+
+    extras_dropped = False
+    if total > budget and project.extra_instructions:
+        extras_dropped = True
+        system_prompt = build_system_prompt(project, item_context, with_extras=False)
+        total -= system_tokens
+        system_tokens = _message_tokens(system_prompt)
+        total += system_tokens
+
+    return AssembledPrompt(
+        system_prompt=system_prompt,
+        history=tuple(history[dropped_turns:]),
+        input_tokens=total,
+        budget=budget,
+        dropped_turns=dropped_turns,
+        description_trimmed=description_trimmed,
+        extras_dropped=extras_dropped,
     )
-    
-    return system_prompt
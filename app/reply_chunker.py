@@ -0,0 +1,66 @@
+"""
+Нарезка потокового ответа LLM на сообщения для Avito.
+
+Первое сообщение уходит, как только готово первое законченное предложение
+(или абзац), — покупатель видит ответ через доли секунды после начала
+генерации. Остальной текст отправляется абзацами, хвост — в конце потока.
+"""
+
+import re
+from typing import List, Optional
+
+
+# Конец предложения: знак препинания (и закрывающие кавычки/скобки), пробел и
+# заглавная буква или цифра следующего предложения. Так не режем "3.5" посреди
+# токена и сокращения вроде "тыс. рублей"; перевод строки — всегда граница.
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\"»)\]]*\s+(?=[A-ZА-ЯЁ0-9«\"])|\n")
+_PARAGRAPH_END_RE = re.compile(r"\n\s*\n")
+
+
+class ReplyChunker:
+    """Накапливает дельты потока и отдаёт готовые к отправке куски текста."""
+
+    def __init__(self, min_first_chars: int = 10) -> None:
+        # Слишком короткое первое предложение ("Да.") склеиваем со следующим
+        self.min_first_chars = min_first_chars
+        self._parts: List[str] = []
+        self._buffer = ""
+        self._first_sent = False
+
+    @property
+    def text(self) -> str:
+        """Весь полученный на данный момент текст."""
+        return "".join(self._parts)
+
+    def feed(self, delta: str) -> List[str]:
+        """Добавляет дельту и возвращает куски, которые уже можно отправлять."""
+        self._parts.append(delta)
+        self._buffer += delta
+        ready: List[str] = []
+
+        if not self._first_sent:
+            for match in _SENTENCE_END_RE.finditer(self._buffer):
+                if len(self._buffer[:match.end()].strip()) >= self.min_first_chars:
+                    ready.append(self._take(match.end()))
+                    self._first_sent = True
+                    break
+
+        if self._first_sent:
+            while True:
+                match = _PARAGRAPH_END_RE.search(self._buffer)
+                if match is None:
+                    break
+                chunk = self._take(match.end())
+                if chunk:
+                    ready.append(chunk)
+
+        return [chunk for chunk in ready if chunk]
+
+    def flush(self) -> Optional[str]:
+        """Остаток текста после окончания потока (None, если пусто)."""
+        chunk = self._take(len(self._buffer))
+        return chunk or None
+
+    def _take(self, end: int) -> str:
+        chunk, self._buffer = self._buffer[:end], self._buffer[end:]
+        return chunk.strip()
@@ -0,0 +1,135 @@
+"""
+Маршрутизация аккаунт Avito → проект и токены.
+
+Вебхук приходит с payload.value.user_id — аккаунтом продавца, которому
+написали. По нему нужно найти проект (настройки ассистента) и токены,
+от имени которых отвечать. Проекты хранятся по своему id, поэтому
+AccountRouter держит обратный индекс account_id → project_id:
+- строится из ProjectStore один раз и обновляется точечно на каждый
+  upsert_project (подписка через ProjectStore.add_listener);
+- если файл проектов перечитан целиком (правка снаружи, invalidate),
+  ProjectStore.version уходит вперёд и индекс перестраивается при
+  следующем обращении.
+Токены AvitoTokenStore и так держит в памяти по account_id, так что
+маршрут одного сообщения — пара обращений к dict, сколько бы продавцов
+ни обслуживал процесс.
+
+Аккаунт, не привязанный ни к одному проекту, обслуживается как в MVP:
+проектом "default" и токенами "default".
+"""
+
+import logging
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from app.projects.models import Project
+from app.projects.store import ProjectStore
+from app.token_store import AvitoTokenStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class AccountRoute(NamedTuple):
+    project: Optional[Project]
+    # Аккаунт, чьими токенами отвечать (None — токены "default")
+    account_id: Optional[str]
+
+
+class AccountRouter:
+    """Индекс account_id → проект поверх ProjectStore и AvitoTokenStore."""
+
+    def __init__(
+        self,
+        project_store: ProjectStore,
+        token_store: AvitoTokenStore,
+        default_project_id: str = "default",
+    ) -> None:
+        self.project_store = project_store
+        self.token_store = token_store
+        self.default_project_id = default_project_id
+        self.rebuilds = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._project_by_account: Dict[str, str] = {}
+        self._account_by_project: Dict[str, str] = {}
+        # Версия ProjectStore, по которой построен индекс (None — не построен)
+        self._version: Optional[int] = None
+        project_store.add_listener(self._on_project_upsert)
+
+    def _rebuild_locked(self, version: int) -> None:
+        project_by_account: Dict[str, str] = {}
+        account_by_project: Dict[str, str] = {}
+        for project in self.project_store.list_projects():
+            if not project.avito_account_id:
+                continue
+            taken = project_by_account.get(project.avito_account_id)
+            if taken is not None:
+                logger.warning(
+                    "Avito account %s is bound to projects %s and %s, using %s",
+                    project.avito_account_id, taken, project.id, taken,
+                )
+                continue
+            project_by_account[project.avito_account_id] = project.id
+            account_by_project[project.id] = project.avito_account_id
+        self._project_by_account = project_by_account
+        self._account_by_project = account_by_project
+        self._version = version
+        self.rebuilds += 1
+
+    def _on_project_upsert(self, project: Project, version: int) -> None:
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                # Индекс отстал не только на этот upsert — перестроим целиком при чтении
+                self._version = None
+                return
+            previous = self._account_by_project.get(project.id)
+            account_id = project.avito_account_id or None
+            if account_id != previous:
+                if previous is not None or account_id in self._project_by_account:
+                    # Перепривязка или конфликт: аккаунт мог освободиться для
+                    # другого проекта — проще перестроить индекс при чтении
+                    self._version = None
+                    return
+                self._project_by_account[account_id] = project.id
+                self._account_by_project[project.id] = account_id
+            self._version = version
+
+    def _fresh_index(self) -> Dict[str, str]:
+        version = self.project_store.version
+        if version != self._version:
+            with self._lock:
+                version = self.project_store.version
+                if version != self._version:
+                    self._rebuild_locked(version)
+        return self._project_by_account
+
+    def project_id_for(self, account_id: Optional[str]) -> Optional[str]:
+        """id проекта, привязанного к аккаунту (None — не привязан)."""
+        if account_id is None:
+            return None
+        return self._fresh_index().get(account_id)
+
+    def route(self, account_id: Optional[str]) -> AccountRoute:
+        """
+        Проект и аккаунт токенов для сообщения аккаунту account_id.
+
+        Привязанный аккаунт отвечает только своими токенами (если их нет,
+        отправка упадёт с понятной ошибкой, а не уйдёт от чужого имени).
+        """
+        account_id = str(account_id) if account_id is not None else None
+        project_id = self.project_id_for(account_id)
+        if project_id is not None:
+            return AccountRoute(self.project_store.get_project(project_id), account_id)
+
+        self.fallbacks += 1
+        if account_id is not None and not self.token_store.has_tokens(account_id):
+            account_id = None
+        return AccountRoute(self.project_store.get_project(self.default_project_id), account_id)
+
+    def stats(self) -> dict:
+        return {
+            "accounts": len(self._project_by_account),
+            "rebuilds": self.rebuilds,
+            "fallbacks": self.fallbacks,
+        }
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class AvitoMessageContent(BaseModel):
@@ -21,6 +21,14 @@ class AvitoMessageContent(BaseModel):
     audio_url: Optional[str] = None
     duration_ms: Optional[int] = None
 
+    # Текст голосового, распознанного асинхронно (app.stt_jobs). Не часть
+    # схемы Avito: из тела вебхука не читается, ставится AvitoWebhook.with_transcript
+    _transcript: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def transcript(self) -> Optional[str]:
+        return self._transcript
+
 
 
 class AvitoMessageValue(BaseModel):
@@ -69,3 +77,9 @@ class AvitoWebhook(BaseModel):
     version: int | str
     timestamp: str | int
     payload: AvitoWebhookPayload
+
+    def with_transcript(self, text: str) -> "AvitoWebhook":
+        """Копия вебхука с уже распознанным текстом голосового."""
+        webhook = self.model_copy(deep=True)
+        webhook.payload.value.content._transcript = text
+        return webhook
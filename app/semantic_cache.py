@@ -0,0 +1,386 @@
+"""
+Семантический кэш ответов: похожие (а не только одинаковые) вопросы
+получают ранее сгенерированный ответ.
+
+Без внешних эмбеддингов: вопрос превращается в вектор TF-IDF по символьным
+n-граммам (3–5 символов нормализованного текста), n-граммы хэшируются crc32
+в фиксированное число измерений (hashing trick). Векторы проекта лежат
+строками в матрице NumPy, поиск — один батчевый косинус по всей матрице.
+
+IDF не хранится, а считается из самой матрицы при запросе: в строках лежат
+нормированные TF-векторы, а вес idf² применяется к запросу и к нормам строк.
+Поэтому добавление вопросов не требует пересчёта старых векторов.
+
+У каждого проекта своя матрица фиксированной ёмкости в memory-mapped файле
+({directory}/{project_id}.npy) и JSON с ответами рядом, так что после
+рестарта кэш не пустой. При переполнении вытесняется давно не
+использованная запись. Каждая строка помнит хэш system prompt, с которым
+получен ответ, и ищется только среди строк с тем же хэшем: промпт зависит
+от объявления и обрезки контекста, так что ответы под разные промпты живут
+в одном индексе, а устаревшие со временем вытесняются.
+
+Запись на диск и пересчёт весов IDF идут вне общего lock — get() не ждёт,
+пока put() из пула потоков пишет файлы. Открытых индексов не больше
+max_open_indexes: давно не использованный сохраняется и выгружается, его
+файлы остаются на диске до следующего обращения. Открытие индекса — файловый
+ввод-вывод, поэтому get() и put() вызываются из пула потоков, не с event loop.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.answer_cache import normalize_message
+
+
+logger = logging.getLogger(__name__)
+
+_SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _prompt_hash(system_prompt: str) -> str:
+    return hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class NgramVectorizer:
+    """Символьные n-граммы → разреженный TF-вектор фиксированной размерности."""
+
+    def __init__(self, dim: int = 2048, ngram_range: Tuple[int, int] = (3, 5)) -> None:
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        padded = f" {normalize_message(text)} "
+        low, high = self.ngram_range
+        indices = [
+            zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dim
+            for n in range(low, high + 1)
+            for i in range(len(padded) - n + 1)
+        ]
+        if indices:
+            np.add.at(vector, indices, 1.0)
+            # Сублинейный TF, затем L2-нормировка
+            np.log1p(vector, out=vector)
+            vector /= np.linalg.norm(vector)
+        return vector
+
+
+class _ProjectIndex:
+    """Матрица векторов одного проекта (memmap) + ответы и метаданные."""
+
+    def __init__(self, vectors_path: str, meta_path: str, capacity: int, dim: int) -> None:
+        self.vectors_path = vectors_path
+        self.meta_path = meta_path
+        self.capacity = capacity
+        self.dim = dim
+
+        self.answers: List[Optional[str]] = [None] * capacity
+        # Хэш system prompt каждой строки (object-массив — сравнение с строкой поэлементное)
+        self.prompt_hashes = np.full(capacity, None, dtype=object)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.vectors = self._open_vectors()
+        # idf² и нормы строк с весами idf — пересчитываются только после вставки
+        self._weights: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # Растёт при каждом изменении матрицы: веса, посчитанные по старой, не ставятся
+        self.generation = 0
+        # Сериализует запись файлов; общий lock кэша при этом не держится
+        self.save_lock = threading.Lock()
+        self._load_meta()
+
+    def _open_vectors(self) -> np.ndarray:
+        if os.path.exists(self.vectors_path):
+            try:
+                vectors = np.lib.format.open_memmap(self.vectors_path, mode="r+")
+                if vectors.shape == (self.capacity, self.dim) and vectors.dtype == np.float32:
+                    return vectors
+                logger.warning("Semantic cache %s has a different shape, recreating", self.vectors_path)
+            except Exception:
+                logger.exception("Failed to open semantic cache %s, recreating", self.vectors_path)
+        os.makedirs(os.path.dirname(self.vectors_path) or ".", exist_ok=True)
+        return np.lib.format.open_memmap(
+            self.vectors_path, mode="w+", dtype=np.float32, shape=(self.capacity, self.dim)
+        )
+
+    def _load_meta(self) -> None:
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception:
+            logger.exception("Failed to read semantic cache metadata %s, starting empty", self.meta_path)
+            return
+        # Старый формат: один prompt_hash на весь индекс и строки без хэша
+        default_hash = meta.get("prompt_hash")
+        for row, answer, last_used, *rest in meta.get("rows", []):
+            if 0 <= row < self.capacity:
+                self.answers[row] = answer
+                self.last_used[row] = last_used
+                self.prompt_hashes[row] = rest[0] if rest else default_hash
+                self.used[row] = True
+
+    def snapshot(self) -> dict:
+        """Метаданные для записи на диск; вызывать под lock кэша."""
+        return {
+            "rows": [
+                [int(row), self.answers[row], float(self.last_used[row]), self.prompt_hashes[row]]
+                for row in np.flatnonzero(self.used)
+            ],
+        }
+
+    def save(self, lock: threading.Lock) -> None:
+        """Пишет индекс на диск, держа lock кэша только на время снимка метаданных."""
+        with self.save_lock:
+            # Снимок берётся уже под save_lock — последним пишется самое свежее состояние
+            with lock:
+                meta = self.snapshot()
+            self.vectors.flush()
+            self._write_meta(meta)
+
+    def close(self, lock: threading.Lock) -> None:
+        """
+        Сохраняет вытесненный индекс. memmap не закрывается явно: его ещё
+        может держать get() или put() из другого потока — отображение
+        освобождается вместе с последней ссылкой на индекс.
+        """
+        self.save(lock)
+
+    def _write_meta(self, meta: dict) -> None:
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.meta_path)
+
+    def reset(self) -> None:
+        self.answers = [None] * self.capacity
+        self.prompt_hashes[:] = None
+        self.last_used[:] = 0
+        self.used[:] = False
+        self.vectors[:] = 0
+        self._weights = None
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return int(self.used.sum())
+
+    def compute_weights(self) -> Tuple[np.ndarray, np.ndarray]:
+        """idf² и нормы строк по текущей матрице; результат не запоминается."""
+        matrix = self.vectors
+        total = int(self.used.sum())
+        # IDF по текущему содержимому индекса (сглаженный, как в sklearn);
+        # свободные строки нулевые и в df не попадают
+        df = np.count_nonzero(matrix, axis=0)
+        idf = np.log((1.0 + total) / (1.0 + df)) + 1.0
+        idf_sq = (idf * idf).astype(np.float32)
+        row_norms = np.sqrt((matrix * matrix) @ idf_sq)
+        row_norms[row_norms == 0] = 1.0
+        return idf_sq, row_norms
+
+    def set_weights(self, weights: Tuple[np.ndarray, np.ndarray], generation: int) -> None:
+        if generation == self.generation:
+            self._weights = weights
+
+    def search(self, query: np.ndarray, prompt_hash: str) -> Tuple[int, float]:
+        """Лучшая строка с тем же промптом по косинусу TF-IDF: (row, similarity) или (-1, 0.0)."""
+        candidates = self.used & (self.prompt_hashes == prompt_hash)
+        if not candidates.any():
+            return -1, 0.0
+        if self._weights is None:
+            # Обычно веса уже посчитал put(); сюда попадаем только в гонке с ним
+            self._weights = self.compute_weights()
+        idf_sq, row_norms = self._weights
+
+        weighted_query = query * idf_sq
+        query_norm = float(np.sqrt(np.dot(query, weighted_query)))
+        if query_norm == 0.0:
+            return -1, 0.0
+        similarities = (self.vectors @ weighted_query) / (row_norms * query_norm)
+        similarities[~candidates] = -1.0
+
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def insert(self, vector: np.ndarray, answer: str, prompt_hash: str, now: float) -> None:
+        free = np.flatnonzero(~self.used)
+        if free.size:
+            row = int(free[0])
+        else:
+            # Вытесняем давно не использованную запись
+            row = int(np.argmin(self.last_used))
+        self.vectors[row] = vector
+        self.answers[row] = answer
+        self.prompt_hashes[row] = prompt_hash
+        self.last_used[row] = now
+        self.used[row] = True
+        self._weights = None
+        self.generation += 1
+
+
+class SemanticCache:
+    """Пер-проектный кэш ответов с поиском ближайшего вопроса по косинусу."""
+
+    def __init__(
+        self,
+        directory: str = "data/semantic_cache",
+        dim: int = 2048,
+        capacity: int = 1000,
+        threshold: float = 0.8,
+        max_message_length: int = 200,
+        max_open_indexes: int = 32,
+    ) -> None:
+        self.directory = directory
+        self.capacity = capacity
+        self.threshold = threshold
+        self.max_message_length = max_message_length
+        self.max_open_indexes = max_open_indexes
+        self.vectorizer = NgramVectorizer(dim=dim)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Открытые индексы в порядке LRU (последний — самый свежий)
+        self._indexes: "OrderedDict[str, _ProjectIndex]" = OrderedDict()
+        # Сериализует открытие, вытеснение и удаление файлов индексов;
+        # общий lock на время этого ввода-вывода не держится
+        self._open_lock = threading.Lock()
+
+    def _paths(self, project_id: str) -> Tuple[str, str]:
+        name = _SAFE_NAME_RE.sub("_", project_id) or "_"
+        return os.path.join(self.directory, f"{name}.npy"), os.path.join(self.directory, f"{name}.json")
+
+    def _loaded(self, project_id: str) -> Optional[_ProjectIndex]:
+        """Открытый индекс проекта (и отметка о его использовании); вызывать под lock."""
+        index = self._indexes.get(project_id)
+        if index is not None:
+            self._indexes.move_to_end(project_id)
+        return index
+
+    def _index(self, project_id: str) -> _ProjectIndex:
+        with self._lock:
+            index = self._loaded(project_id)
+        if index is not None:
+            return index
+        with self._open_lock:
+            with self._lock:
+                index = self._loaded(project_id)
+            if index is not None:
+                return index
+            index = _ProjectIndex(*self._paths(project_id), self.capacity, self.vectorizer.dim)
+            with self._lock:
+                self._indexes[project_id] = index
+                evicted = []
+                while len(self._indexes) > self.max_open_indexes:
+                    evicted.append(self._indexes.popitem(last=False))
+            for evicted_id, evicted_index in evicted:
+                try:
+                    evicted_index.close(self._lock)
+                except Exception:
+                    logger.exception("Failed to persist evicted semantic cache for project=%s", evicted_id)
+        return index
+
+    def _accepts(self, user_message: str) -> bool:
+        normalized = normalize_message(user_message)
+        return bool(normalized) and len(normalized) <= self.max_message_length
+
+    def get(self, project_id: str, system_prompt: str, user_message: str) -> Optional[str]:
+        if not self._accepts(user_message):
+            return None
+        query = self.vectorizer.transform(user_message)
+        index = self._index(project_id)
+        with self._lock:
+            row, similarity = index.search(query, _prompt_hash(system_prompt))
+            if row < 0 or similarity < self.threshold:
+                self.misses += 1
+                return None
+            index.last_used[row] = time.time()
+            self.hits += 1
+            return index.answers[row]
+
+    def put(self, project_id: str, system_prompt: str, user_message: str, answer: str) -> None:
+        if not answer or not self._accepts(user_message):
+            return
+        vector = self.vectorizer.transform(user_message)
+        prompt_hash = _prompt_hash(system_prompt)
+        index = self._index(project_id)
+        with self._lock:
+            index.insert(vector, answer, prompt_hash, time.time())
+            generation = index.generation
+        # Тяжёлое — вне lock: get() ждёт только саму вставку
+        weights = index.compute_weights()
+        with self._lock:
+            index.set_weights(weights, generation)
+        try:
+            index.save(self._lock)
+        except Exception:
+            logger.exception("Failed to persist semantic cache for project=%s", project_id)
+
+    def purge(self, project_id: Optional[str] = None) -> int:
+        """
+        Очищает индекс проекта (или все). Возвращает число записей.
+
+        Невыгруженный индекс не открывается: его файлы просто удаляются,
+        а для проекта без кэша ничего не создаётся.
+        """
+        with self._open_lock:
+            with self._lock:
+                if project_id is None:
+                    indexes = list(self._indexes.values())
+                else:
+                    index = self._indexes.get(project_id)
+                    indexes = [index] if index is not None else []
+                removed = 0
+                for index in indexes:
+                    removed += len(index)
+                    index.reset()
+                loaded = {path for index in self._indexes.values() for path in (index.vectors_path, index.meta_path)}
+            if project_id is None:
+                self._remove_unloaded_files(loaded)
+            elif not indexes:
+                removed = self._remove_files(*self._paths(project_id))
+        for index in indexes:
+            index.save(self._lock)
+        return removed
+
+    def _remove_files(self, vectors_path: str, meta_path: str) -> int:
+        """Удаляет файлы невыгруженного индекса. Возвращает число записей в нём."""
+        removed = 0
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                removed = len(json.load(f).get("rows", []))
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception("Failed to read semantic cache metadata %s", meta_path)
+        for path in (vectors_path, meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _remove_unloaded_files(self, loaded: Set[str]) -> None:
+        """Удаляет с диска индексы проектов, которые сейчас не загружены."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith((".npy", ".json")) and path not in loaded:
+                os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "projects": len(self._indexes),
+            "size": sum(len(index) for index in self._indexes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
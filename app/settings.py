@@ -1,5 +1,4 @@
-from pydantic_settings import BaseSettings, SettingsConfigDict
-
+from typing import Dict, Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -20,6 +19,25 @@ class AvitoSettings(BaseSettings):
     avito_api_base_url: str = "https://api.avito.ru"
     avito_auth_base_url: str = "https://api.avito.ru"
 
+    # Проактивное обновление токенов: за сколько секунд до expires_at
+    # обновлять access_token и как часто фоновая задача перепроверяет стор.
+    avito_token_refresh_margin: int = 300
+    avito_token_refresh_check_interval: float = 60.0
+    avito_token_refresh_retry_delay: float = 30.0
+
+    # Лимиты запросов к Avito API: запросов в секунду на аккаунт для каждого
+    # класса эндпоинтов (read — сообщения/аккаунт, list — списки чатов,
+    # send — отправка), допустимый всплеск и адаптация на 429:
+    # скорость умножается на decrease_factor (не ниже min_rate) и после
+    # каждого успешного запроса растёт на recovery_step от номинала.
+    avito_rate_limits: Dict[str, float] = {"read": 5.0, "list": 2.0, "send": 2.0}
+    avito_rate_burst: int = 5
+    avito_rate_min_rate: float = 0.2
+    avito_rate_decrease_factor: float = 0.5
+    avito_rate_recovery_step: float = 0.05
+    avito_rate_max_retries: int = 3
+    avito_rate_max_retry_after: float = 60.0
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
     # Тестовый access_token для одного аккаунта Авито (MVP / dev).
@@ -37,8 +55,169 @@ class AppSettings(BaseSettings):
 
     app_name: str = "Avito Assist Backend"
 
+    # Конвейер обработки вебхуков: размер пула воркеров и ёмкость очереди.
+    # При переполнении очереди вебхук получает 503, и Avito повторит доставку.
+    webhook_workers: int = 4
+    webhook_queue_maxsize: int = 1000
+    webhook_drain_timeout: float = 10.0
+
+    # Хранилище проектов, токенов и курсоров чатов: "json" — файлы в data/
+    # (для разработки), "sqlite" — одна база в режиме WAL, общая для всех
+    # воркеров. Перенос данных: python -m app.storage.importer
+    storage_backend: Literal["json", "sqlite"] = "json"
+    storage_sqlite_path: str = "data/avito_assist.db"
+    storage_sqlite_busy_timeout: float = 5.0
+
+    # ChatState: журнал изменений сбрасывается на диск раз в flush_interval
+    # секунд или каждые batch_size записей — это и есть окно потерь при падении.
+    chat_state_flush_interval: float = 1.0
+    chat_state_batch_size: int = 256
+    chat_state_compact_threshold: int = 10_000
+
+    # История переписки (app/conversation.py): в запрос к LLM уходят последние
+    # conversation_history_turns реплик чата; в памяти — не больше
+    # conversation_max_turns реплик на чат и conversation_cache_chats чатов (LRU),
+    # остальное поднимается из conversation_dir (или таблицы в SQLite)
+    conversation_history_turns: int = 10
+    conversation_max_turns: int = 20
+    conversation_cache_chats: int = 10_000
+    conversation_dir: str = "data/conversations"
+
+    # Склейка сообщений (app/debounce.py): сообщения чата копятся и получают
+    # один ответ, когда в чате reply_debounce_quiet_ms тишина или с первого
+    # сообщения прошло reply_debounce_max_wait_ms; 0 — отвечать на каждое сразу.
+    # Сроки проверяются раз в reply_debounce_tick_ms.
+    # Выключено по умолчанию: вебхук подтверждается и попадает в дедупликацию
+    # сразу, а текст пачки живёт только в памяти. Падение процесса или stop()
+    # по таймауту теряют накопленные сообщения, и повтор от Avito отбрасывается
+    # как дубль. Включать (например, 1500), если один ответ на пачку важнее.
+    reply_debounce_quiet_ms: int = 0
+    reply_debounce_max_wait_ms: int = 6000
+    reply_debounce_tick_ms: int = 50
+
+    # Дедупликация вебхуков: точное множество id за ttl + Bloom-фильтр
+    # на два поколения, состояние сохраняется на диск раз в flush_interval.
+    # Состояние у каждого воркера своё (см. app/dedup.py): при нескольких
+    # воркерах повтор, попавший в другой процесс, обработается ещё раз.
+    webhook_dedup_path: str = "data/webhook_dedup.json"
+    webhook_dedup_ttl_seconds: float = 24 * 3600
+    webhook_dedup_max_recent: int = 50_000
+    webhook_dedup_bloom_capacity: int = 200_000
+    webhook_dedup_bloom_error_rate: float = 1e-6
+    webhook_dedup_flush_interval: float = 5.0
+
+    # STT: голосовое читается из Avito и отправляется в SpeechKit кусками
+    # stt_chunk_size байт; файлы больше stt_max_audio_bytes (лимит синхронного
+    # распознавания SpeechKit — 1 МБ) отклоняются
+    stt_max_audio_bytes: int = 1024 * 1024
+    stt_chunk_size: int = 64 * 1024
+    # Скачанное аудио держится в памяти до этого размера, дальше — во временном файле
+    stt_spool_memory_bytes: int = 256 * 1024
+
+    # Длинные голосовые (duration_ms больше stt_sync_max_duration_ms) распознаются
+    # асинхронной задачей SpeechKit: операция опрашивается с backoff от
+    # stt_job_poll_initial до stt_job_poll_max секунд, но не дольше stt_job_timeout
+    stt_sync_max_duration_ms: int = 30_000
+    stt_async_max_audio_bytes: int = 10 * 1024 * 1024
+    stt_async_api_base_url: str = "https://stt.api.cloud.yandex.net"
+    stt_operation_api_base_url: str = "https://operation.api.cloud.yandex.net"
+    stt_job_poll_initial: float = 2.0
+    stt_job_poll_max: float = 30.0
+    stt_job_poll_backoff: float = 1.5
+    stt_job_timeout: float = 900.0
+    stt_job_concurrency: int = 4
+
+    # Кэш распознанного текста: sha256 аудио → текст, плюс индекс URL → sha256;
+    # файл переписывается фоновым потоком не чаще раза в flush_interval секунд
+    transcription_cache_path: str = "data/transcription_cache.json"
+    transcription_cache_ttl_seconds: float = 7 * 24 * 3600
+    transcription_cache_max_entries: int = 10_000
+    transcription_cache_flush_interval: float = 5.0
+
+    # Фоновые задачи (поллер, обновление токенов) запускает только ведущий
+    # воркер хоста — тот, кто держит flock на leader_lock_path. Остальные
+    # пробуют перехватить лидерство раз в leader_heartbeat_interval секунд.
+    leader_lock_path: str = "data/leader.lock"
+    leader_heartbeat_interval: float = 2.0
+
+    # Автополлер: интервал, параллелизм по чатам, таймаут на чат и общий
+    # дедлайн итерации (должен быть меньше интервала, чтобы тики не наслаивались).
+    poller_interval_seconds: int = 30
+    # Вне расписания у всех проектов следующий тик переносится на ближайшее
+    # открытие, но не дальше poller_max_defer_seconds: правки проектов и новые
+    # аккаунты в этом процессе сбрасывают перенос сразу, а сделанные другим
+    # воркером подхватываются не позже этого срока.
+    poller_max_defer_seconds: int = 600
+    poller_concurrency: int = 8
+    poller_chat_timeout: float = 20.0
+    poller_tick_deadline: float = 25.0
+    poller_page_size: int = 100
+    poller_max_pages: int = 50
+    poller_messages_limit: int = 20
+
+    # Perplexity: одновременных запросов к API и таймаут одного запроса (сек)
+    llm_max_concurrency: int = 8
+    llm_timeout_seconds: float = 30.0
+
+    # Кэш ответов LLM на повторяющиеся вопросы (по проекту и промпту)
+    answer_cache_size: int = 2048
+    answer_cache_ttl_seconds: float = 3600.0
+    answer_cache_max_message_length: int = 200
+
+    # Семантический кэш ответов: TF-IDF по символьным n-граммам, матрица
+    # capacity x dim на проект в memmap-файле, порог косинусной близости
+    semantic_cache_dir: str = "data/semantic_cache"
+    semantic_cache_dim: int = 2048
+    semantic_cache_capacity: int = 1000
+    semantic_cache_threshold: float = 0.8
+    # Сколько индексов проектов держать открытыми (каждый — capacity x dim x 4 байт)
+    semantic_cache_max_projects: int = 32
+
+    # LRU-кэш готовых system prompt (на комбинацию проект + контекст объявления)
+    prompt_cache_size: int = 1024
+    # Бюджет входных токенов запроса к LLM по умолчанию (промпт + история +
+    # сообщение); у проекта можно задать свой — Project.prompt_token_budget
+    prompt_token_budget: int = 3000
+
+    # Повторы и circuit breaker для внешних зависимостей (app/clients/resilience.py):
+    # попыток на вызов, задержки backoff (сек), доля повторов от запросов за окно,
+    # сбоев подряд до размыкания цепи и пауза до пробного запроса (сек)
+    resilience_max_attempts: int = 3
+    resilience_base_delay: float = 0.2
+    resilience_max_delay: float = 5.0
+    resilience_retry_budget_ratio: float = 0.2
+    resilience_retry_budget_min: int = 3
+    resilience_retry_budget_window: float = 10.0
+    resilience_failure_threshold: int = 5
+    resilience_recovery_timeout: float = 30.0
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+
+class HttpSettings(BaseSettings):
+    """
+    Настройки общего HTTP-транспорта (httpx.AsyncClient) для внешних клиентов.
+
+    http_host_limits позволяет задать свой лимит соединений для отдельного хоста,
+    например HTTP_HOST_LIMITS='{"api.avito.ru": 20}'. HTTP/2 включается только
+    при установленном пакете h2 (pip install "httpx[http2]").
+    """
+
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_per_host_limit: int = 10
+    http_host_limits: Dict[str, int] = {}
+    http_http2: bool = False
+
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 15.0
+    http_write_timeout: float = 15.0
+    http_pool_timeout: float = 5.0
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
 avito_settings = AvitoSettings()
 app_settings = AppSettings()
+http_settings = HttpSettings()
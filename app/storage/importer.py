@@ -0,0 +1,113 @@
+"""
+Разовый перенос состояния из JSON-файлов data/ в базу SQLite.
+
+Запуск из корня репозитория (приложение при этом лучше остановить):
+
+    python -m app.storage.importer
+    python -m app.storage.importer --data-dir data --db data/avito_assist.db --overwrite
+
+Переносятся projects.json, avito_tokens.json и chat_state.json вместе с
+его журналом (.log). Без --overwrite строки, которые уже есть в базе,
+не трогаются — повторный запуск ничего не портит. Исходные файлы
+остаются на месте; после переноса включите STORAGE_BACKEND=sqlite.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+from app.chat_state import ChatState
+from app.projects.models import Project
+from app.storage.sqlite import SqliteStorage
+from app.token_store import AvitoTokens
+
+
+def _read_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _insert(storage: SqliteStorage, table: str, sql: str, rows: List[Tuple], overwrite: bool) -> int:
+    """
+    Вставляет строки одной транзакцией. Возвращает число перенесённых:
+    с overwrite — все, без него — только тех, которых в базе ещё не было.
+    """
+    if not rows:
+        return 0
+    verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+    with storage.transaction() as conn:
+        before = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        conn.executemany(sql.format(verb=verb), rows)
+        after = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return len(rows) if overwrite else after - before
+
+
+def import_json_data(storage: SqliteStorage, data_dir: str = "data", overwrite: bool = False) -> Dict[str, int]:
+    """Переносит JSON-состояние из data_dir в storage. Возвращает число перенесённых строк по таблицам."""
+    now = time.time()
+
+    projects = []
+    for project_id, raw in _read_json(os.path.join(data_dir, "projects.json")).items():
+        project = Project(**raw)  # проверяем, что файл не битый, до записи в базу
+        projects.append((project_id, project.avito_account_id, json.dumps(raw, ensure_ascii=False), now))
+
+    tokens = []
+    for key, raw in _read_json(os.path.join(data_dir, "avito_tokens.json")).items():
+        parsed = AvitoTokens.from_dict(raw)
+        tokens.append((key, parsed.account_id, json.dumps(parsed.to_dict(), ensure_ascii=False), now))
+
+    chat_state = ChatState(path=os.path.join(data_dir, "chat_state.json"))
+    try:
+        cursors = [(chat_id, message_id, now) for chat_id, message_id in chat_state.snapshot().items()]
+    finally:
+        chat_state.close()
+
+    return {
+        "projects": _insert(
+            storage,
+            "projects",
+            "{verb} INTO projects (id, avito_account_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            projects,
+            overwrite,
+        ),
+        "avito_tokens": _insert(
+            storage,
+            "avito_tokens",
+            "{verb} INTO avito_tokens (key, account_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            tokens,
+            overwrite,
+        ),
+        "chat_state": _insert(
+            storage,
+            "chat_state",
+            "{verb} INTO chat_state (chat_id, last_message_id, updated_at) VALUES (?, ?, ?)",
+            cursors,
+            overwrite,
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--db", default="data/avito_assist.db")
+    parser.add_argument("--overwrite", action="store_true", help="заменить строки, которые уже есть в базе")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    storage = SqliteStorage(args.db)
+    try:
+        imported = import_json_data(storage, data_dir=args.data_dir, overwrite=args.overwrite)
+    finally:
+        storage.close()
+    for table, count in imported.items():
+        print(f"{table:>14}: {count}")
+
+
+if __name__ == "__main__":
+    main()
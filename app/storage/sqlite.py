@@ -0,0 +1,195 @@
+"""
+Встроенная база SQLite для состояния приложения (проекты, токены, курсоры
+и история чатов).
+
+JSON-хранилища переписывают файл целиком на каждую запись и защищены
+threading.Lock, который ничего не значит для второго воркера uvicorn.
+Здесь вместо этого:
+- журнал WAL: читатели не блокируют писателя и друг друга, в том числе
+  из разных процессов; запись — одна строка (INSERT ... ON CONFLICT);
+- поиск по первичному ключу, а не разбор всего файла;
+- схема версионируется через PRAGMA user_version: MIGRATIONS применяются
+  по порядку при первом подключении, каждая в своей транзакции;
+- на таблицы, которые процессы кэшируют в памяти (projects, avito_tokens),
+  повешены триггеры, увеличивающие счётчик в storage_revisions. По нему
+  сторы замечают, что данные изменил другой процесс.
+
+Соединение своё у каждого потока (sqlite3 не любит делить его между
+потоками), транзакции записи открываются через BEGIN IMMEDIATE.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def _revision_triggers(table: str) -> str:
+    return "\n".join(
+        f"""
+        CREATE TRIGGER {table}_revision_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            UPDATE storage_revisions SET revision = revision + 1 WHERE name = '{table}';
+        END;
+        """
+        for event in ("INSERT", "UPDATE", "DELETE")
+    )
+
+
+# Миграция N переводит схему с user_version N-1 на N. Уже выпущенные
+# миграции не меняем — только дописываем новые в конец.
+MIGRATIONS: List[str] = [
+    """
+    CREATE TABLE storage_revisions (
+        name TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO storage_revisions (name) VALUES ('projects'), ('avito_tokens');
+
+    CREATE TABLE projects (
+        id TEXT PRIMARY KEY,
+        avito_account_id TEXT,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX projects_avito_account_id ON projects (avito_account_id);
+
+    CREATE TABLE avito_tokens (
+        key TEXT PRIMARY KEY,
+        account_id TEXT,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX avito_tokens_account_id ON avito_tokens (account_id);
+
+    CREATE TABLE chat_state (
+        chat_id TEXT PRIMARY KEY,
+        last_message_id TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """
+    + _revision_triggers("projects")
+    + _revision_triggers("avito_tokens"),
+    """
+    CREATE TABLE conversation_turns (
+        chat_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        text TEXT NOT NULL,
+        at REAL NOT NULL,
+        PRIMARY KEY (chat_id, seq)
+    ) WITHOUT ROWID;
+    """,
+]
+
+
+class SqliteStorage:
+    """Файл базы, миграции схемы и соединения по потокам."""
+
+    def __init__(self, path: str = "data/avito_assist.db", busy_timeout: float = 5.0) -> None:
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # isolation_level=None: транзакциями управляем сами (см. transaction)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL-режиме NORMAL не теряет закоммиченное при падении процесса,
+        # только при отключении питания — и экономит fsync на каждый коммит
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (схема к этому моменту уже актуальна)."""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            with self._lock:
+                self._connections.append(conn)
+                if not self._migrated:
+                    self._migrate(conn)
+                    self._migrated = True
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        # Каждая миграция — под BEGIN IMMEDIATE: иначе два процесса могли бы
+        # одновременно прочитать user_version и применить миграцию дважды
+        for version in range(len(MIGRATIONS)):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if current == version:
+                    for statement in _split_statements(MIGRATIONS[version]):
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version={version + 1}")
+                    logger.info("SQLite storage %s migrated to schema version %s", self.path, version + 1)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @property
+    def schema_version(self) -> int:
+        return self.connection().execute("PRAGMA user_version").fetchone()[0]
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Транзакция записи: BEGIN IMMEDIATE сразу берёт блокировку писателя."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def revision(self, name: str) -> int:
+        """Счётчик изменений таблицы name (растёт с каждой изменённой строкой)."""
+        row = self.connection().execute(
+            "SELECT revision FROM storage_revisions WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def checkpoint(self) -> None:
+        """Переносит WAL в основной файл базы и обрезает журнал."""
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+def _split_statements(script: str) -> List[str]:
+    """Делит скрипт миграции на отдельные выражения (executescript сам коммитит)."""
+    statements: List[str] = []
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip():
+                statements.append(buffer.strip())
+            buffer = ""
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
@@ -0,0 +1,211 @@
+"""
+SQLite-бэкенд для ProjectStore, AvitoTokenStore, ChatState и ConversationStore.
+
+Классы наследуют JSON-сторы и подменяют только хранение: интерфейс,
+in-memory кэши и их инвалидация остаются прежними, поэтому остальной
+код не знает, какой бэкенд выбран (см. app_settings.storage_backend).
+"""
+
+import dataclasses
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.chat_state import ChatState
+from app.conversation import ConversationStore, Turn
+from app.projects.models import Project
+from app.projects.store import FileSignature, ProjectStore
+from app.storage.sqlite import SqliteStorage
+from app.token_store import AvitoTokens, AvitoTokenStore
+
+
+class SqliteProjectStore(ProjectStore):
+    """
+    Проекты в таблице projects: upsert пишет одну строку.
+
+    Вместо stat() файла сигнатурой служит счётчик storage_revisions —
+    правки из другого воркера видны через check_interval секунд.
+    """
+
+    def __init__(self, storage: SqliteStorage, check_interval: float = 1.0) -> None:
+        super().__init__(path=storage.path, check_interval=check_interval)
+        self.storage = storage
+
+    def _load_all(self) -> Dict[str, dict]:
+        rows = self.storage.connection().execute("SELECT id, data FROM projects").fetchall()
+        return {project_id: json.loads(data) for project_id, data in rows}
+
+    def _persist(self, raw: Dict[str, dict], project: Project) -> None:
+        with self.storage.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO projects (id, avito_account_id, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    avito_account_id = excluded.avito_account_id,
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+                """,
+                (project.id, project.avito_account_id, json.dumps(raw[project.id], ensure_ascii=False), time.time()),
+            )
+
+    def _file_signature(self) -> FileSignature:
+        return (self.storage.revision("projects"),)
+
+
+class SqliteTokenStore(AvitoTokenStore):
+    """
+    Токены в таблице avito_tokens (ключ — как в JSON: "default" или account_id).
+
+    Кэш в памяти сверяется со счётчиком storage_revisions на каждом чтении
+    (один запрос по первичному ключу): токены, обновлённые другим воркером,
+    подхватываются сразу, а не после рестарта.
+    """
+
+    def __init__(self, storage: SqliteStorage) -> None:
+        super().__init__(path=storage.path)
+        self.storage = storage
+        self._revision: Optional[int] = None
+
+    def _file_signature(self) -> FileSignature:
+        # Свежесть кэша проверяется по storage_revisions (см. _cached_locked)
+        return None
+
+    def _load_all(self) -> Dict[str, Dict]:
+        rows = self.storage.connection().execute("SELECT key, data FROM avito_tokens").fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def _cached_locked(self) -> Dict[str, AvitoTokens]:
+        revision = self.storage.revision("avito_tokens")
+        if revision != self._revision:
+            self._cache = None
+        cache = super()._cached_locked()
+        self._revision = revision
+        return cache
+
+    def _save_locked(self, key: str, tokens: AvitoTokens) -> None:
+        cache = self._cached_locked()
+        with self.storage.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO avito_tokens (key, account_id, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    account_id = excluded.account_id,
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+                """,
+                (key, tokens.account_id, json.dumps(tokens.to_dict(), ensure_ascii=False), time.time()),
+            )
+            revision = conn.execute(
+                "SELECT revision FROM storage_revisions WHERE name = 'avito_tokens'"
+            ).fetchone()[0]
+        if revision == self._revision + 1:
+            # Между чтением кэша и записью никто больше не писал — кэш актуален
+            cache[key] = dataclasses.replace(tokens)
+            self._revision = revision
+        else:
+            self._cache = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cache = None
+            self._revision = None
+
+
+class SqliteChatState(ChatState):
+    """
+    Курсоры чатов в таблице chat_state.
+
+    Запись, как и в JSON-бэкенде, копится в буфере и уходит пачкой —
+    одной транзакцией с upsert по строке на чат. В памяти держатся только
+    ещё не записанные значения; чтение — буфер, затем поиск по ключу в базе,
+    поэтому курсоры видны всем воркерам, а память не растёт с числом чатов.
+    """
+
+    def __init__(self, storage: SqliteStorage, flush_interval: float = 1.0, batch_size: int = 256) -> None:
+        self.storage = storage
+        super().__init__(path=storage.path, flush_interval=flush_interval, batch_size=batch_size)
+
+    def _load(self) -> Dict[str, str]:
+        return {}
+
+    def _write_pending(self, pending: List[Tuple[str, str]]) -> None:
+        now = time.time()
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO chat_state (chat_id, last_message_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    last_message_id = excluded.last_message_id,
+                    updated_at = excluded.updated_at
+                """,
+                [(chat_id, message_id, now) for chat_id, message_id in pending],
+            )
+        with self._lock:
+            # Убираем из буфера только записанное: set мог обновить чат, пока шла транзакция
+            for chat_id, message_id in pending:
+                if self._state.get(chat_id) == message_id:
+                    del self._state[chat_id]
+
+    def _write_snapshot(self, state: Dict[str, str]) -> None:
+        self.storage.checkpoint()
+
+    def snapshot(self) -> Dict[str, str]:
+        with self._lock:
+            rows = self.storage.connection().execute("SELECT chat_id, last_message_id FROM chat_state").fetchall()
+            state = dict(rows)
+            state.update(self._state)
+            return state
+
+    def get_last_message_id(self, chat_id: str) -> Optional[str]:
+        with self._lock:
+            message_id = self._state.get(chat_id)
+        if message_id is not None:
+            return message_id
+        # Значения нет в буфере — значит, оно уже закоммичено (из буфера убираем после commit)
+        row = self.storage.connection().execute(
+            "SELECT last_message_id FROM chat_state WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.storage.connection().execute("SELECT COUNT(*) FROM chat_state").fetchone()[0]
+
+
+class SqliteConversationStore(ConversationStore):
+    """
+    История чатов в таблице conversation_turns: реплика — строка с ключом
+    (chat_id, seq). Дописывание — один INSERT, обрезка — DELETE старых seq.
+    """
+
+    def __init__(self, storage: SqliteStorage, max_turns: int = 20, max_chats: int = 10_000) -> None:
+        super().__init__(directory=None, max_turns=max_turns, max_chats=max_chats)
+        self.storage = storage
+
+    def _load_turns(self, chat_id: str) -> List[Turn]:
+        rows = self.storage.connection().execute(
+            "SELECT role, text, at FROM conversation_turns WHERE chat_id = ? ORDER BY seq DESC LIMIT ?",
+            (chat_id, self.max_turns),
+        ).fetchall()
+        return [Turn(role, text, at) for role, text, at in reversed(rows)]
+
+    def _persist_turn(self, chat_id: str, turn: Turn) -> None:
+        with self.storage.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO conversation_turns (chat_id, seq, role, text, at)
+                SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM conversation_turns WHERE chat_id = ?
+                """,
+                (chat_id, turn.role, turn.text, turn.at, chat_id),
+            )
+
+    def _compact(self, chat_id: str, turns: List[Turn]) -> None:
+        with self.storage.transaction() as conn:
+            conn.execute(
+                """
+                DELETE FROM conversation_turns WHERE chat_id = ? AND seq <= (
+                    SELECT MAX(seq) FROM conversation_turns WHERE chat_id = ?
+                ) - ?
+                """,
+                (chat_id, chat_id, len(turns)),
+            )
@@ -0,0 +1,174 @@
+"""
+Планировщик асинхронного распознавания длинных голосовых.
+
+Синхронный SpeechKit принимает аудио до ~30 секунд. Более длинные голосовые
+уходят асинхронной операцией (STTClient.start_long_recognition), а воркер
+конвейера сразу освобождается. Дальше операцию опрашивает этот планировщик:
+одна фоновая задача держит кучу (heapq) заданий по времени следующего опроса
+и просыпается к ближайшему. Интервал опроса растёт от initial_delay в
+backoff раз до max_delay; задание, не готовое за timeout секунд, считается
+неудачным.
+
+Когда текст готов, вызывается on_done(job, text) — в приложении он кладёт
+текст в кэш распознаваний и возвращает вебхук в конвейер, который на
+этот раз находит текст в кэше. Если on_done упал (например, очередь
+конвейера переполнена), задание опрашивается и доставляется повторно.
+Задания живут только в памяти процесса.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.clients.stt_client import STTClient, STTClientError, STTOperationError
+from app.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionJob:
+    """Операция распознавания одного голосового и то, что нужно для продолжения."""
+
+    __slots__ = ("operation_id", "audio_url", "digest", "payload", "created_at", "polls", "delay")
+
+    def __init__(self, operation_id: str, audio_url: str, digest: str, payload: Any, delay: float) -> None:
+        self.operation_id = operation_id
+        self.audio_url = audio_url
+        self.digest = digest
+        # Что возобновлять после распознавания (в приложении — вебхук)
+        self.payload = payload
+        self.created_at = time.monotonic()
+        self.polls = 0
+        self.delay = delay
+
+
+class RecognitionJobScheduler:
+    """Опрос операций SpeechKit с backoff; не больше concurrency опросов одновременно."""
+
+    def __init__(
+        self,
+        stt_client: STTClient,
+        on_done: Callable[[RecognitionJob, str], Awaitable[None]],
+        on_error: Optional[Callable[[RecognitionJob, Exception], Awaitable[None]]] = None,
+        initial_delay: float = 2.0,
+        max_delay: float = 30.0,
+        backoff: float = 1.5,
+        timeout: float = 900.0,
+        concurrency: int = 4,
+    ) -> None:
+        self.stt_client = stt_client
+        self.on_done = on_done
+        self.on_error = on_error
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+        self._heap: List[Tuple[float, int, RecognitionJob]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._polls: Set["asyncio.Task[None]"] = set()
+        self._counters: Dict[str, int] = {"submitted": 0, "completed": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run(), name="stt-job-scheduler")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        for poll in list(self._polls):
+            poll.cancel()
+        await asyncio.gather(task, *self._polls, return_exceptions=True)
+        if self._heap:
+            logger.warning("STT job scheduler stopped with %s pending jobs", len(self._heap))
+
+    async def submit(self, audio_url: str, payload: Any) -> RecognitionJob:
+        """Создаёт операцию распознавания и ставит её на опрос. STTClientError — если не удалось."""
+        operation_id, digest = await self.stt_client.start_long_recognition(audio_url)
+        job = RecognitionJob(operation_id, audio_url, digest, payload, self.initial_delay)
+        self._counters["submitted"] += 1
+        metrics.inc("stt_jobs.submitted")
+        logger.info("SpeechKit operation %s started for %s", operation_id, audio_url)
+        self._schedule(job, self.initial_delay)
+        return job
+
+    def _schedule(self, job: RecognitionJob, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+                poll = asyncio.create_task(self._poll(job))
+                self._polls.add(poll)
+                poll.add_done_callback(self._polls.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: RecognitionJob) -> None:
+        async with self._semaphore:
+            job.polls += 1
+            try:
+                text = await self.stt_client.poll_long_recognition(job.operation_id)
+                if text is not None:
+                    await self.on_done(job, text)
+                    self._counters["completed"] += 1
+                    metrics.inc("stt_jobs.completed")
+                    metrics.observe("stt_jobs.duration", time.monotonic() - job.created_at)
+                    return
+            except STTOperationError as exc:
+                await self._fail(job, exc)
+                return
+            except STTClientError as exc:
+                # 4xx (операция не найдена, нет доступа) — окончательно;
+                # сбой связи, 5xx, разомкнутая цепь — повод опросить позже
+                if exc.status_code is not None and 400 <= exc.status_code < 500:
+                    await self._fail(job, exc)
+                    return
+                logger.warning("Polling SpeechKit operation %s failed: %s", job.operation_id, exc)
+            except Exception:
+                logger.exception("Delivering transcript of SpeechKit operation %s failed", job.operation_id)
+
+        if time.monotonic() - job.created_at >= self.timeout:
+            await self._fail(job, STTClientError(f"SpeechKit operation {job.operation_id} timed out"))
+            return
+        job.delay = min(self.max_delay, job.delay * self.backoff)
+        self._schedule(job, job.delay)
+
+    async def _fail(self, job: RecognitionJob, exc: Exception) -> None:
+        self._counters["failed"] += 1
+        metrics.inc("stt_jobs.failed")
+        logger.error("SpeechKit operation %s for %s failed: %s", job.operation_id, job.audio_url, exc)
+        if self.on_error is not None:
+            try:
+                await self.on_error(job, exc)
+            except Exception:
+                logger.exception("on_error handler failed for SpeechKit operation %s", job.operation_id)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._heap), "polling": len(self._polls), **self._counters}
@@ -0,0 +1,96 @@
+"""
+Быстрая локальная оценка числа токенов в промпте — без токенизатора модели.
+
+Токенизатор Perplexity (sonar) недоступен локально, а точный подсчёт
+не нужен: бюджет промпта (app.prompts.assemble_prompt) — это ограничение
+сверху, а не биллинг. Оценка — по долям символов:
+- кириллица (в UTF-8 — два байта на символ) даёт примерно токен на
+  cyrillic_chars_per_token символов;
+- ASCII (латиница, цифры, пунктуация) — токен на ascii_chars_per_token;
+- пробелы и переводы строк почти всегда входят в соседний токен и не
+  считаются.
+
+Доли уточняются по факту: API возвращает usage.prompt_tokens, и
+calibrate() подстраивает общий множитель (скользящее среднее отношения
+факта к оценке). Оценка строки кэшируется в LRU — статический префикс
+промпта один и тот же объект на версию проекта и считается один раз.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+
+# Служебные токены на одно сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenEstimator:
+    """Оценка токенов по долям символов с калибровкой по фактическому usage."""
+
+    def __init__(
+        self,
+        cyrillic_chars_per_token: float = 3.2,
+        ascii_chars_per_token: float = 4.0,
+        cache_size: int = 4096,
+        calibration_weight: float = 0.05,
+    ) -> None:
+        self.cyrillic_chars_per_token = cyrillic_chars_per_token
+        self.ascii_chars_per_token = ascii_chars_per_token
+        self.cache_size = cache_size
+        self.calibration_weight = calibration_weight
+        # Множитель к сырой оценке, уточняется calibrate()
+        self.scale = 1.0
+        self.calibrations = 0
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+
+    def _raw(self, text: str) -> float:
+        # Все не-ASCII символы считаем кириллицей: лишний байт UTF-8 на символ
+        non_ascii = len(text.encode("utf-8")) - len(text)
+        spaces = text.count(" ") + text.count("\n")
+        ascii_chars = max(0, len(text) - non_ascii - spaces)
+        return non_ascii / self.cyrillic_chars_per_token + ascii_chars / self.ascii_chars_per_token
+
+    def _raw_cached(self, text: str) -> float:
+        with self._lock:
+            raw = self._cache.get(text)
+            if raw is not None:
+                self._cache.move_to_end(text)
+                return raw
+        raw = self._raw(text)
+        with self._lock:
+            self._cache[text] = raw
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return raw
+
+    def count(self, text: str) -> int:
+        """Оценка числа токенов в тексте."""
+        if not text:
+            return 0
+        return math.ceil(self._raw_cached(text) * self.scale)
+
+    def count_messages(self, texts: Iterable[str]) -> int:
+        """Оценка для списка сообщений чата (с учётом служебных токенов)."""
+        return sum(self.count(text) + MESSAGE_OVERHEAD_TOKENS for text in texts)
+
+    def calibrate(self, estimated: int, actual: int) -> None:
+        """Учитывает фактическое число токенов запроса, для которого оценка была estimated."""
+        if estimated <= 0 or actual <= 0:
+            return
+        with self._lock:
+            ratio = self.scale * actual / estimated
+            self.scale += self.calibration_weight * (ratio - self.scale)
+            self.calibrations += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "scale": round(self.scale, 4),
+            "calibrations": self.calibrations,
+            "cached": len(self._cache),
+        }
+
+
+token_estimator = TokenEstimator()
@@ -1,9 +1,12 @@
+import dataclasses
 import json
 import os
 import threading
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
+
+from app.projects.store import FileSignature
 
 
 @dataclass
@@ -53,15 +56,24 @@ class AvitoTokens:
 
 class AvitoTokenStore:
     """
-    Простейшее файловое хранилище токенов Avito.
+    Простейшее файловое хранилище токенов Avito (data/avito_tokens.json).
 
-    В MVP храним один набор токенов под ключом "default" в data/avito_tokens.json.
-    В будущем можно расширить до нескольких аккаунтов/проектов.
+    Ключ записи — account_id аккаунта Avito. Первый подключённый аккаунт
+    (и аккаунт, чей id ещё не известен) хранится под ключом "default" —
+    так файл MVP с одним аккаунтом читается без миграции. Поиск токенов
+    по account_id — stat() файла и обращение к dict в памяти.
     """
 
     def __init__(self, path: str = "data/avito_tokens.json") -> None:
         self.path = path
         self._lock = threading.Lock()
+        # In-memory кэш: файл перечитывается, только если его сигнатура
+        # (inode, mtime, размер) изменилась — например, ведущий воркер обновил
+        # токены, и остальные должны увидеть новый refresh_token.
+        # Кэш привязан к пути, чтобы подмена path (тесты, миграции) его сбрасывала.
+        self._cache: Optional[Dict[str, AvitoTokens]] = None
+        self._cache_path: Optional[str] = None
+        self._signature: FileSignature = None
 
     def _load_all(self) -> Dict[str, Dict[str, Any]]:
         if not os.path.exists(self.path):
@@ -81,22 +93,104 @@ class AvitoTokenStore:
             json.dump(data, f, ensure_ascii=False, indent=2)
         os.replace(tmp_path, self.path)
 
+    def _file_signature(self) -> FileSignature:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _cached_locked(self) -> Dict[str, AvitoTokens]:
+        # Сигнатуру снимаем до чтения: запись во время чтения заметим в следующий раз
+        signature = self._file_signature()
+        if self._cache is None or self._cache_path != self.path or signature != self._signature:
+            cache: Dict[str, AvitoTokens] = {}
+            for key, raw in self._load_all().items():
+                try:
+                    cache[key] = AvitoTokens.from_dict(raw)
+                except Exception:
+                    continue
+            self._cache = cache
+            self._cache_path = self.path
+            self._signature = signature
+        return self._cache
+
+    @staticmethod
+    def _key_locked(cache: Dict[str, AvitoTokens], account_id: Optional[str]) -> Optional[str]:
+        """Ключ, под которым лежат токены аккаунта (None — таких токенов нет)."""
+        if account_id is None:
+            return "default"
+        if account_id in cache:
+            return account_id
+        default = cache.get("default")
+        if default is not None and default.account_id == account_id:
+            return "default"
+        return None
+
+    def save_tokens(self, tokens: AvitoTokens) -> None:
+        """
+        Сохраняет токены аккаунта tokens.account_id.
+
+        Пока "default" свободен или принадлежит этому же аккаунту (или аккаунту
+        без id), токены пишутся в "default"; токены остальных аккаунтов — под их id.
+        """
+        with self._lock:
+            cache = self._cached_locked()
+            key = self._key_locked(cache, tokens.account_id)
+            if key is None:
+                default = cache.get("default")
+                key = "default" if default is None or default.account_id is None else tokens.account_id
+            self._save_locked(key, tokens)
+
+    def get_tokens(self, account_id: Optional[str] = None) -> Optional[AvitoTokens]:
+        """Токены аккаунта (account_id=None — "default") или None. Отдаёт копию."""
+        with self._lock:
+            cache = self._cached_locked()
+            key = self._key_locked(cache, account_id)
+            tokens = cache.get(key) if key is not None else None
+            return dataclasses.replace(tokens) if tokens else None
+
+    def resolve_key(self, account_id: Optional[str] = None) -> Optional[str]:
+        """Ключ записи с токенами аккаунта ("default" или account_id) или None, если токенов нет."""
+        with self._lock:
+            return self._key_locked(self._cached_locked(), account_id)
+
+    def has_tokens(self, account_id: str) -> bool:
+        with self._lock:
+            return self._key_locked(self._cached_locked(), account_id) is not None
+
+    def list_tokens(self) -> List[AvitoTokens]:
+        """Копии токенов всех аккаунтов (account_id=None у ещё не опознанного "default")."""
+        with self._lock:
+            return [dataclasses.replace(tokens) for tokens in self._cached_locked().values()]
+
+    def _save_locked(self, key: str, tokens: AvitoTokens) -> None:
+        data = self._load_all()
+        data[key] = tokens.to_dict()
+        self._save_all(data)
+        # В файле могли быть и чужие изменения — перечитываем его целиком
+        self._cache = None
+        self._cached_locked()
+
     def save_default_tokens(self, tokens: AvitoTokens) -> None:
         """
         Сохраняет токены как "default".
         """
         with self._lock:
-            data = self._load_all()
-            data["default"] = tokens.to_dict()
-            self._save_all(data)
+            self._save_locked("default", tokens)
 
     def get_default_tokens(self) -> Optional[AvitoTokens]:
         """
         Возвращает токены "default" или None, если их нет.
+
+        Читается из in-memory кэша; отдаём копию, чтобы вызывающий код
+        мог менять поля (например, account_id) без порчи кэша.
         """
         with self._lock:
-            data = self._load_all()
-            raw = data.get("default")
-            if not raw:
-                return None
-            return AvitoTokens.from_dict(raw)
+            tokens = self._cached_locked().get("default")
+            return dataclasses.replace(tokens) if tokens else None
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш: следующее чтение перечитает файл."""
+        with self._lock:
+            self._cache = None
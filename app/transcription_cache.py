@@ -0,0 +1,206 @@
+"""
+Кэш распознанного текста голосовых сообщений.
+
+Одно и то же голосовое распознаётся повторно при redelivery вебхука, когда
+его снова видит поллер, или при ручном повторе из админки. Запись кэша
+адресуется содержимым — SHA-256 байт аудио, — а URL лишь указывает на хэш:
+- по URL (url → sha256) повтор обходится без скачивания файла;
+- по хэшу (sha256 → текст) — без вызова SpeechKit, даже если тот же файл
+  пришёл по другой (например, заново подписанной) ссылке.
+
+Записи живут ttl_seconds, при переполнении вытесняется давно не
+использованная. Состояние целиком лежит в JSON-файле и атомарно
+перезаписывается (tmp + os.replace) фоновым потоком раз в flush_interval
+секунд, если что-то добавилось, и при close. put() только помечает кэш
+изменённым: файл на 10 тысяч записей не переписывается на event loop, а
+под lock снимается лишь копия записей.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """Потокобезопасный TTL/LRU-кэш "sha256 аудио → текст" с индексом по URL."""
+
+    def __init__(
+        self,
+        path: Optional[str] = "data/transcription_cache.json",
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_entries: int = 10_000,
+        flush_interval: float = 5.0,
+    ) -> None:
+        # path=None — кэш только в памяти (тесты, скрипты)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.url_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # sha256 -> (время добавления, текст); порядок — от давно использованных к недавним
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # url -> sha256
+        self._urls: "OrderedDict[str, str]" = OrderedDict()
+        self._dirty = False
+        # Сериализует запись файла; _lock на это время не держится
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            logger.exception("Failed to read transcription cache %s, starting empty", self.path)
+            return
+        now = time.time()
+        for digest, created_at, text in data.get("entries", []):
+            if now - created_at < self.ttl_seconds:
+                self._entries[digest] = (created_at, text)
+        for url, digest in data.get("urls", []):
+            if digest in self._entries:
+                self._urls[url] = digest
+
+    def _write(self, data: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _lookup(self, digest: str) -> Optional[str]:
+        item = self._entries.get(digest)
+        if item is None:
+            return None
+        if time.time() - item[0] >= self.ttl_seconds:
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return item[1]
+
+    def get_by_url(self, url: str) -> Optional[str]:
+        """Текст по URL аудио. Промах здесь ещё не промах кэша — см. get_by_hash."""
+        with self._lock:
+            digest = self._urls.get(url)
+            text = self._lookup(digest) if digest is not None else None
+            if text is None:
+                self._urls.pop(url, None)
+                return None
+            self._urls.move_to_end(url)
+            self.url_hits += 1
+        return text
+
+    def get_by_hash(self, digest: str, url: Optional[str] = None) -> Optional[str]:
+        """Текст по SHA-256 содержимого; при попадании запоминает и URL."""
+        with self._lock:
+            text = self._lookup(digest)
+            if text is None:
+                self.misses += 1
+            else:
+                self.content_hits += 1
+                if url:
+                    self._remember_url(url, digest)
+        return text
+
+    def _remember_url(self, url: str, digest: str) -> None:
+        self._urls[url] = digest
+        self._urls.move_to_end(url)
+        # URL-ов может быть больше, чем файлов, но не бесконечно
+        while len(self._urls) > 2 * self.max_entries:
+            self._urls.popitem(last=False)
+
+    def put(self, url: Optional[str], digest: str, text: str) -> None:
+        if not text:
+            return
+        with self._lock:
+            self._entries[digest] = (time.time(), text)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                # URL-ы вытесненной записи отпадут сами при следующем обращении
+                self._entries.popitem(last=False)
+            if url:
+                self._remember_url(url, digest)
+            self._mark_dirty_locked()
+
+    def _mark_dirty_locked(self) -> None:
+        if not self.path:
+            return
+        self._dirty = True
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stop.clear()
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="transcription-cache-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to persist transcription cache %s", self.path)
+
+    def flush(self) -> None:
+        """Сохраняет кэш на диск, если он менялся."""
+        with self._save_lock:
+            # Копию снимаем уже под _save_lock — последним пишется самое свежее состояние
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {
+                    "entries": [[digest, created_at, text] for digest, (created_at, text) in self._entries.items()],
+                    "urls": [[url, digest] for url, digest in self._urls.items()],
+                }
+                self._dirty = False
+            try:
+                self._write(data)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def close(self) -> None:
+        """Сохраняет кэш и останавливает фоновый поток."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        self.flush()
+
+    def purge(self) -> int:
+        """Очищает кэш (и файл — сразу). Возвращает число удалённых записей."""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._urls.clear()
+            self._mark_dirty_locked()
+        self.flush()
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.url_hits + self.content_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "urls": len(self._urls),
+            "url_hits": self.url_hits,
+            "content_hits": self.content_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.url_hits + self.content_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
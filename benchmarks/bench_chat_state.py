@@ -0,0 +1,70 @@
+"""
+Бенчмарк ChatState: стоимость одной записи при разном числе чатов.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_chat_state
+    python -m benchmarks.bench_chat_state --sizes 1000 100000 --writes 20000
+
+Для сравнения "полная перезапись" повторяет прежний _save:
+json.dump всего состояния с indent=2 + os.replace на каждую запись.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from app.chat_state import ChatState
+
+
+def _full_rewrite_write_us(path: str, state: Dict[str, str], writes: int) -> float:
+    started = time.perf_counter()
+    for i in range(writes):
+        state[f"chat_{i % len(state)}"] = f"msg_new_{i}"
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    return (time.perf_counter() - started) / writes * 1e6
+
+
+def _chat_state_write_us(path: str, size: int, writes: int) -> float:
+    state = ChatState(path=path, flush_interval=1.0)
+    for i in range(size):
+        state.set_last_message_id(f"chat_{i}", f"msg_{i}")
+    state.compact()
+
+    started = time.perf_counter()
+    for i in range(writes):
+        state.set_last_message_id(f"chat_{i % size}", f"msg_new_{i}")
+    state.flush()
+    elapsed = time.perf_counter() - started
+    state.close()
+    return elapsed / writes * 1e6
+
+
+def run(sizes: List[int], writes: int) -> None:
+    print(f"{'chats':>10} {'full rewrite, us':>18} {'chat state, us':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            state = {f"chat_{i}": f"msg_{i}" for i in range(size)}
+            # Полная перезапись на больших размерах очень медленная — меньше итераций
+            rewrite_writes = max(3, min(writes, 2_000_000 // size))
+            rewrite = _full_rewrite_write_us(os.path.join(tmp, f"full_{size}.json"), state, rewrite_writes)
+            wal = _chat_state_write_us(os.path.join(tmp, f"wal_{size}.json"), size, writes)
+            print(f"{size:>10} {rewrite:>18.1f} {wal:>16.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--writes", type=int, default=20_000)
+    args = parser.parse_args()
+    run(args.sizes, args.writes)
+
+
+if __name__ == "__main__":
+    main()
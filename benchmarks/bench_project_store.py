@@ -0,0 +1,87 @@
+"""
+Бенчмарк ProjectStore: чтение проекта без кэша (как было) и с кэшем.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_project_store
+    python -m benchmarks.bench_project_store --sizes 100 10000 --reads 2000
+
+"Без кэша" повторяет прежний путь get_project: lock → json.load всего
+файла → Project(**data). "С кэшем" — текущий ProjectStore.get_project.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, List
+
+from app.projects.models import Project
+from app.projects.store import ProjectStore
+
+
+def _make_projects_file(path: str, count: int) -> None:
+    data = {}
+    for i in range(count):
+        project_id = "default" if i == 0 else f"project_{i}"
+        data[project_id] = Project(
+            id=project_id,
+            name=f"Project {i}",
+            business_type="goods",
+            extra_instructions="Всегда уточняй город доставки",
+        ).model_dump(mode="json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def _uncached_reader(path: str) -> Callable[[str], Project]:
+    lock = threading.Lock()
+
+    def get_project(project_id: str) -> Project:
+        with lock:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            return Project(**raw[project_id])
+
+    return get_project
+
+
+def _measure(fn: Callable[[str], Project], reads: int) -> float:
+    """Среднее время одного чтения в микросекундах."""
+    fn("default")  # прогрев
+    started = time.perf_counter()
+    for _ in range(reads):
+        fn("default")
+    return (time.perf_counter() - started) / reads * 1e6
+
+
+def run(sizes: List[int], reads: int) -> None:
+    print(f"{'projects':>10} {'uncached, us':>15} {'cached, us':>12} {'speedup':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f"projects_{size}.json")
+            _make_projects_file(path, size)
+
+            # Без кэша каждое чтение парсит весь файл — на больших файлах
+            # ограничиваем число итераций, чтобы бенчмарк не шёл минутами.
+            uncached_reads = max(3, min(reads, 2_000_000 // size))
+            uncached = _measure(_uncached_reader(path), uncached_reads)
+
+            store = ProjectStore(path=path)
+            cached = _measure(store.get_project, reads)
+
+            print(f"{size:>10} {uncached:>15.1f} {cached:>12.2f} {uncached / cached:>9.0f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--reads", type=int, default=10_000)
+    args = parser.parse_args()
+    run(args.sizes, args.reads)
+
+
+if __name__ == "__main__":
+    main()
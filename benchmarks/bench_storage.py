@@ -0,0 +1,182 @@
+"""
+Бенчмарк бэкендов хранения: JSON-файлы против SQLite (WAL).
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --sizes 10000 100000 --ops 2000
+
+Для каждого стора (проекты, токены, курсоры чатов) и числа строк меряется
+среднее время чтения одной записи по ключу и записи одной записи.
+Курсоры чатов пишутся батчами в обоих бэкендах — время записи включает
+последний flush. JSON-сторы проектов и токенов переписывают файл целиком,
+поэтому на больших размерах число их записей ограничено.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Tuple
+
+from app.chat_state import ChatState
+from app.projects.models import Project
+from app.projects.store import ProjectStore
+from app.storage.sqlite import SqliteStorage
+from app.storage.stores import SqliteChatState, SqliteProjectStore, SqliteTokenStore
+from app.token_store import AvitoTokenStore, AvitoTokens
+
+
+def _project(i: int) -> Project:
+    return Project(
+        id=f"project_{i}",
+        name=f"Project {i}",
+        business_type="goods",
+        avito_account_id=str(100_000 + i),
+        extra_instructions="Всегда уточняй город доставки",
+    )
+
+
+def _tokens(i: int) -> AvitoTokens:
+    return AvitoTokens(
+        access_token=f"access_{i}",
+        refresh_token=f"refresh_{i}",
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        account_id=str(100_000 + i),
+    )
+
+
+def _per_op_us(fn: Callable[[int], object], ops: int, size: int) -> float:
+    keys = [random.randrange(size) for _ in range(ops)]
+    started = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def _fill_json(tmp: str, size: int) -> Tuple[str, str, str]:
+    projects_path = os.path.join(tmp, "projects.json")
+    with open(projects_path, "w", encoding="utf-8") as f:
+        json.dump({f"project_{i}": _project(i).model_dump(mode="json") for i in range(size)}, f, ensure_ascii=False)
+    tokens_path = os.path.join(tmp, "avito_tokens.json")
+    with open(tokens_path, "w", encoding="utf-8") as f:
+        json.dump({"default" if i == 0 else str(100_000 + i): _tokens(i).to_dict() for i in range(size)}, f)
+    chat_state_path = os.path.join(tmp, "chat_state.json")
+    with open(chat_state_path, "w", encoding="utf-8") as f:
+        json.dump({f"chat_{i}": f"msg_{i}" for i in range(size)}, f)
+    return projects_path, tokens_path, chat_state_path
+
+
+def _fill_sqlite(storage: SqliteStorage, size: int) -> None:
+    now = time.time()
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO projects (id, avito_account_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            [
+                (f"project_{i}", str(100_000 + i), json.dumps(_project(i).model_dump(mode="json")), now)
+                for i in range(size)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO avito_tokens (key, account_id, data, updated_at) VALUES (?, ?, ?, ?)",
+            [
+                ("default" if i == 0 else str(100_000 + i), str(100_000 + i), json.dumps(_tokens(i).to_dict()), now)
+                for i in range(size)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO chat_state (chat_id, last_message_id, updated_at) VALUES (?, ?, ?)",
+            [(f"chat_{i}", f"msg_{i}", now) for i in range(size)],
+        )
+
+
+def _measure(
+    project_store: ProjectStore,
+    token_store: AvitoTokenStore,
+    chat_state: ChatState,
+    size: int,
+    ops: int,
+    rewrite_ops: int,
+) -> List[Tuple[str, float, float]]:
+    project_store.get_project("project_0")  # прогрев кэшей
+    token_store.get_default_tokens()
+
+    def write_cursor(i: int) -> None:
+        chat_state.set_last_message_id(f"chat_{i}", f"msg_new_{i}")
+
+    started = time.perf_counter()
+    for i in range(ops):
+        write_cursor(random.randrange(size))
+    chat_state.flush()
+    cursor_write = (time.perf_counter() - started) / ops * 1e6
+
+    return [
+        (
+            "projects",
+            _per_op_us(lambda i: project_store.get_project(f"project_{i}"), ops, size),
+            _per_op_us(lambda i: project_store.upsert_project(_project(i)), rewrite_ops, size),
+        ),
+        (
+            "tokens",
+            _per_op_us(lambda i: token_store.get_tokens(str(100_000 + i)), ops, size),
+            _per_op_us(lambda i: token_store.save_tokens(_tokens(i)), rewrite_ops, size),
+        ),
+        (
+            "chat_state",
+            _per_op_us(lambda i: chat_state.get_last_message_id(f"chat_{i}"), ops, size),
+            cursor_write,
+        ),
+    ]
+
+
+def run(sizes: List[int], ops: int) -> None:
+    print(f"{'store':>12} {'rows':>8} {'json read, us':>14} {'sqlite read, us':>16} "
+          f"{'json write, us':>15} {'sqlite write, us':>17}")
+    for size in sizes:
+        # Перезапись JSON на 100k строк — сотни миллисекунд, итераций меньше
+        rewrite_ops = max(3, min(ops, 1_000_000 // size))
+        with tempfile.TemporaryDirectory() as tmp:
+            projects_path, tokens_path, chat_state_path = _fill_json(tmp, size)
+            chat_state = ChatState(path=chat_state_path, flush_interval=60)
+            json_rows = _measure(
+                ProjectStore(path=projects_path, check_interval=60),
+                AvitoTokenStore(path=tokens_path),
+                chat_state,
+                size,
+                ops,
+                rewrite_ops,
+            )
+            chat_state.close()
+
+            storage = SqliteStorage(os.path.join(tmp, "state.db"))
+            _fill_sqlite(storage, size)
+            chat_state = SqliteChatState(storage, flush_interval=60)
+            sqlite_rows = _measure(
+                SqliteProjectStore(storage, check_interval=60),
+                SqliteTokenStore(storage),
+                chat_state,
+                size,
+                ops,
+                ops,
+            )
+            chat_state.close()
+            storage.close()
+
+        for (name, json_read, json_write), (_, sqlite_read, sqlite_write) in zip(json_rows, sqlite_rows):
+            print(f"{name:>12} {size:>8} {json_read:>14.2f} {sqlite_read:>16.2f} "
+                  f"{json_write:>15.1f} {sqlite_write:>17.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=2_000)
+    args = parser.parse_args()
+    run(args.sizes, args.ops)
+
+
+if __name__ == "__main__":
+    main()
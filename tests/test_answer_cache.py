@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from app.answer_cache import AnswerCache, normalize_message
+from app.semantic_cache import SemanticCache
+
+
+def test_normalize_message_ignores_case_punctuation_and_yo():
+    assert normalize_message("  Ещё   актуально?!") == "еще актуально"
+    assert normalize_message("ЕЩЕ актуально") == "еще актуально"
+
+
+def test_answer_cache_hit_for_same_question_and_prompt():
+    cache = AnswerCache()
+    cache.put("p1", "prompt", "Где забрать?", "У метро")
+
+    assert cache.get("p1", "prompt", "где забрать") == "У метро"
+    assert cache.get("p1", "other prompt", "где забрать") is None
+    assert cache.get("p2", "prompt", "где забрать") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2}
+
+
+def test_answer_cache_lru_and_ttl(monkeypatch):
+    cache = AnswerCache(maxsize=2, ttl_seconds=10)
+    cache.put("p", "prompt", "a", "A")
+    cache.put("p", "prompt", "b", "B")
+    cache.get("p", "prompt", "a")
+    cache.put("p", "prompt", "c", "C")
+
+    assert cache.get("p", "prompt", "b") is None
+    assert cache.get("p", "prompt", "a") == "A"
+
+    now = time.monotonic()
+    monkeypatch.setattr("app.answer_cache.time.monotonic", lambda: now + 11)
+    assert cache.get("p", "prompt", "a") is None
+
+
+def test_answer_cache_skips_long_messages_and_purges_by_project():
+    cache = AnswerCache(max_message_length=10)
+    cache.put("p", "prompt", "очень длинный и уникальный вопрос", "ответ")
+    assert cache.stats()["size"] == 0
+
+    cache.put("p1", "prompt", "торг?", "Нет")
+    cache.put("p2", "prompt", "торг?", "Да")
+    assert cache.purge("p1") == 1
+    assert cache.get("p2", "prompt", "торг") == "Да"
+
+
+@pytest.mark.asyncio
+async def test_generate_reply_cached_calls_llm_once(monkeypatch, tmp_path):
+    from app import main as main_module
+
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path)))
+    main_module.answer_cache.purge()
+    calls = []
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        calls.append(user_message)
+        return "Да, актуально"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
+
+    first = await main_module.generate_reply_cached("default", "Ещё актуально?", "prompt")
+    second = await main_module.generate_reply_cached("default", "еще актуально", "prompt")
+
+    assert first == second == "Да, актуально"
+    assert calls == ["Ещё актуально?"]
+    main_module.answer_cache.purge()
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from app.clients.avito_auth_client import AvitoAuthClient
+from app.clients.avito_client import AvitoClientError
+from app.clients.http_transport import HttpTransport
+from app.token_store import AvitoTokenStore, AvitoTokens
+
+
+def make_auth_client(tmp_path, expires_in: timedelta, calls: list):
+    """
+    Клиент со стором во временном файле и фейковым /token,
+    который на каждый refresh выдаёт новую пару токенов.
+    """
+    store = AvitoTokenStore(path=str(tmp_path / "tokens.json"))
+    store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS_0",
+            refresh_token="REFRESH_0",
+            expires_at=datetime.now(timezone.utc) + expires_in,
+            account_id="42",
+        )
+    )
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        form = {k: v[0] for k, v in parse_qs(request.content.decode()).items()}
+        calls.append(form)
+        await asyncio.sleep(0.01)  # даём конкурентам встать в очередь
+        n = len(calls)
+        return httpx.Response(
+            200,
+            json={"access_token": f"ACCESS_{n}", "refresh_token": f"REFRESH_{n}", "expires_in": 3600},
+        )
+
+    transport = HttpTransport(transport=httpx.MockTransport(handler))
+    return AvitoAuthClient(transport=transport, token_store=store), store
+
+
+@pytest.mark.asyncio
+async def test_refresh_uses_refresh_token_grant_and_keeps_account(tmp_path):
+    calls = []
+    client, store = make_auth_client(tmp_path, timedelta(hours=1), calls)
+
+    tokens = await client.refresh()
+
+    assert calls[0]["grant_type"] == "refresh_token"
+    assert calls[0]["refresh_token"] == "REFRESH_0"
+    assert tokens.access_token == "ACCESS_1"
+    assert tokens.account_id == "42"
+    assert store.get_default_tokens().refresh_token == "REFRESH_1"
+
+
+@pytest.mark.asyncio
+async def test_get_valid_tokens_does_not_refresh_fresh_tokens(tmp_path):
+    calls = []
+    client, _ = make_auth_client(tmp_path, timedelta(hours=1), calls)
+
+    tokens = await client.get_valid_tokens()
+
+    assert tokens.access_token == "ACCESS_0"
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_single_refresh(tmp_path):
+    calls = []
+    # До истечения меньше, чем refresh_margin — токены нужно обновить заранее
+    client, _ = make_auth_client(tmp_path, timedelta(seconds=10), calls)
+
+    results = await asyncio.gather(*[client.get_valid_tokens() for _ in range(10)])
+
+    assert len(calls) == 1
+    assert {t.access_token for t in results} == {"ACCESS_1"}
+
+
+@pytest.mark.asyncio
+async def test_default_and_its_account_id_share_single_refresh(tmp_path):
+    calls = []
+    client, _ = make_auth_client(tmp_path, timedelta(seconds=10), calls)
+
+    # None и "42" — одни и те же токены в "default"
+    results = await asyncio.gather(*[client.get_valid_tokens(account_id) for account_id in [None, "42"] * 5])
+
+    assert len(calls) == 1
+    assert {t.access_token for t in results} == {"ACCESS_1"}
+
+
+@pytest.mark.asyncio
+async def test_call_with_refresh_retries_once_on_401(tmp_path):
+    calls = []
+    client, _ = make_auth_client(tmp_path, timedelta(hours=1), calls)
+    used_tokens = []
+
+    async def send(tokens: AvitoTokens) -> str:
+        used_tokens.append(tokens.access_token)
+        if tokens.access_token == "ACCESS_0":
+            raise AvitoClientError("Unauthorized", status_code=401)
+        return "sent"
+
+    assert await client.call_with_refresh(send) == "sent"
+    assert used_tokens == ["ACCESS_0", "ACCESS_1"]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_call_with_refresh_gives_up_after_second_401(tmp_path):
+    calls = []
+    client, _ = make_auth_client(tmp_path, timedelta(hours=1), calls)
+
+    async def always_401(tokens: AvitoTokens) -> None:
+        raise AvitoClientError("Unauthorized", status_code=401)
+
+    with pytest.raises(AvitoClientError):
+        await client.call_with_refresh(always_401)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_is_scoped_to_account(tmp_path):
+    calls = []
+    client, store = make_auth_client(tmp_path, timedelta(hours=1), calls)
+    store.save_tokens(
+        AvitoTokens(
+            access_token="OTHER_0",
+            refresh_token="OTHER_REFRESH_0",
+            expires_at=datetime.now(timezone.utc) + timedelta(seconds=10),
+            account_id="77",
+        )
+    )
+
+    tokens = await client.get_valid_tokens("77")
+
+    assert calls[0]["refresh_token"] == "OTHER_REFRESH_0"
+    assert tokens.account_id == "77"
+    assert store.get_tokens("77").access_token == tokens.access_token
+    assert store.get_default_tokens().access_token == "ACCESS_0"
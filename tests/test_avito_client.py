@@ -1,62 +1,102 @@
 import json
 
+import httpx
 import pytest
 
 from app.clients.avito_client import AvitoMessengerClient, AvitoClientError
+from app.clients.avito_rate_limiter import AvitoRateLimiter
+from app.clients.http_transport import HttpTransport
+from app.clients.resilience import Resilience
+
+
+def make_client(handler) -> AvitoMessengerClient:
+    transport = HttpTransport(transport=httpx.MockTransport(handler))
+    return AvitoMessengerClient(
+        base_url="https://api.avito.test",
+        transport=transport,
+        rate_limiter=AvitoRateLimiter(),
+        resilience=Resilience("avito_api", base_delay=0),
+    )
 
 
-class DummyResponse:
-    def __init__(self, status_code: int = 200, text: str = "", json_data=None):
-        self.status_code = status_code
-        self._text = text
-        self._json_data = json_data
-
-    @property
-    def text(self) -> str:
-        return self._text
-
-    def json(self):
-        if self._json_data is not None:
-            return self._json_data
-        return json.loads(self._text or "{}")
-
-
-def test_avito_send_text_message_success(monkeypatch):
-    client = AvitoMessengerClient(base_url="https://api.avito.test")
-
-    def mock_post(url: str, json=None, headers=None, timeout: int = 10):
-        assert url == "https://api.avito.test/messenger/v1/chats/chat_1/messages"
-        assert json == {"type": "text", "message": "Привет из теста"}
-        assert headers["Authorization"].startswith("Bearer ")
-        return DummyResponse(status_code=200, text="OK")
-
-    import app.clients.avito_client as avito_module
+@pytest.mark.asyncio
+async def test_avito_send_text_message_success():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.method == "POST"
+        assert str(request.url) == "https://api.avito.test/messenger/v3/accounts/42/chats/chat_1/messages/"
+        assert json.loads(request.content) == {"type": "text", "message": "Привет из теста"}
+        assert request.headers["Authorization"].startswith("Bearer ")
+        return httpx.Response(200, json={"id": "msg_1"})
 
-    monkeypatch.setattr(avito_module.requests, "post", mock_post)
+    client = make_client(handler)
 
     # Если исключения не было — считаем успехом
-    client.send_text_message(
+    await client.send_text_message(
         chat_id="chat_1",
         text="Привет из теста",
         access_token="TEST_TOKEN",
+        account_id="42",
     )
 
 
-def test_avito_send_text_message_non_2xx(monkeypatch):
-    client = AvitoMessengerClient(base_url="https://api.avito.test")
-
-    def mock_post(url: str, json=None, headers=None, timeout: int = 10):
-        return DummyResponse(status_code=403, text="Forbidden")
-
-    import app.clients.avito_client as avito_module
+@pytest.mark.asyncio
+async def test_avito_send_text_message_non_2xx():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(403, text="Forbidden")
 
-    monkeypatch.setattr(avito_module.requests, "post", mock_post)
+    client = make_client(handler)
 
     with pytest.raises(AvitoClientError) as exc_info:
-        client.send_text_message(
+        await client.send_text_message(
             chat_id="chat_1",
             text="Привет",
             access_token="TEST_TOKEN",
+            account_id="42",
         )
 
-    assert "status 403" in str(exc_info.value) or "status 4" in str(exc_info.value)
+    assert "403" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_avito_send_text_message_requires_account_id():
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("request should not be sent without account_id")
+
+    client = make_client(handler)
+
+    with pytest.raises(AvitoClientError):
+        await client.send_text_message(chat_id="chat_1", text="Привет", access_token="TEST_TOKEN")
+
+
+@pytest.mark.asyncio
+async def test_avito_get_chats_unread_only():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/messenger/v2/accounts/42/chats"
+        assert request.url.params["unread_only"] == "true"
+        assert request.url.params["limit"] == "5"
+        return httpx.Response(200, json={"chats": [{"id": "chat_1"}]})
+
+    client = make_client(handler)
+
+    chats = await client.get_chats(access_token="TEST_TOKEN", account_id="42", limit=5, unread_only=True)
+    assert chats == [{"id": "chat_1"}]
+
+
+@pytest.mark.asyncio
+async def test_avito_client_retries_after_429_with_retry_after():
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        if len(attempts) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"}, text="Too Many Requests")
+        return httpx.Response(200, json={"chats": [{"id": "chat_1"}]})
+
+    client = make_client(handler)
+    chats = await client.get_chats(access_token="TEST_TOKEN", account_id="42")
+
+    assert chats == [{"id": "chat_1"}]
+    assert len(attempts) == 2
+    # Лимитер замедлился после 429
+    bucket = client.rate_limiter.bucket("42", "list")
+    assert bucket.rate < bucket.max_rate
@@ -1,7 +1,7 @@
+import httpx
 import pytest
-from unittest.mock import AsyncMock, patch
 from app.avito_item_client import AvitoItemClient
-import pytest
+from app.clients.http_transport import HttpTransport
 
 pytest_plugins = ('pytest_asyncio',)
 
@@ -9,8 +9,6 @@ pytest_plugins = ('pytest_asyncio',)
 @pytest.mark.asyncio
 async def test_get_item_details_success():
     """Тест успешного получения данных объявления"""
-    client = AvitoItemClient(access_token="fake_token")
-    
     mock_response = {
         "title": "iPhone 13 Pro 128GB",
         "description": "Состояние отличное, без царапин",
@@ -19,27 +17,32 @@ async def test_get_item_details_success():
         "address": "Москва, м. Сокол"
     }
     
-    with patch("httpx.AsyncClient.get") as mock_get:
-        mock_get.return_value = AsyncMock(status_code=200, json=lambda: mock_response)
-        
-        result = await client.get_item_details(user_id=12345, item_id=67890)
-        
-        assert result is not None
-        assert result["title"] == "iPhone 13 Pro 128GB"
-        assert result["price"]["value"] == 65000
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/core/v1/accounts/12345/items/67890"
+        assert request.headers["Authorization"] == "Bearer fake_token"
+        return httpx.Response(200, json=mock_response)
+
+    transport = HttpTransport(transport=httpx.MockTransport(handler))
+    client = AvitoItemClient(access_token="fake_token", transport=transport)
+
+    result = await client.get_item_details(user_id=12345, item_id=67890)
+
+    assert result is not None
+    assert result["title"] == "iPhone 13 Pro 128GB"
+    assert result["price"]["value"] == 65000
 
 
 @pytest.mark.asyncio
 async def test_get_item_details_not_found():
     """Тест случая, когда объявление не найдено"""
-    client = AvitoItemClient(access_token="fake_token")
-    
-    with patch("httpx.AsyncClient.get") as mock_get:
-        mock_get.return_value = AsyncMock(status_code=404, text="Not Found")
-        
-        result = await client.get_item_details(user_id=12345, item_id=99999)
-        
-        assert result is None
+    transport = HttpTransport(
+        transport=httpx.MockTransport(lambda request: httpx.Response(404, text="Not Found"))
+    )
+    client = AvitoItemClient(access_token="fake_token", transport=transport)
+
+    result = await client.get_item_details(user_id=12345, item_id=99999)
+
+    assert result is None
 
 
 def test_format_item_for_prompt():
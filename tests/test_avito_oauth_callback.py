@@ -9,9 +9,9 @@ client = TestClient(app)
 def test_avito_oauth_callback_saves_tokens(monkeypatch, tmp_path):
     # подменяем стор на временный файл
     from app import main as main_module
-    main_module.avito_token_store.path = str(tmp_path / "tokens.json")
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
 
-    def mock_exchange_code_for_tokens(code: str) -> dict:
+    async def mock_exchange_code_for_tokens(code: str) -> dict:
         assert code == "TEST_CODE"
         return {
             "access_token": "ACCESS123",
@@ -25,13 +25,25 @@ def test_avito_oauth_callback_saves_tokens(monkeypatch, tmp_path):
         mock_exchange_code_for_tokens,
     )
 
-    response = client.get("/avito/oauth/callback", params={"code": "TEST_CODE"})
-    assert response.status_code == 200
-    data = response.json()
-    assert data["status"] == "ok"
-    assert data["tokens"]["access_token"] == "ACCESS123"
+    async def mock_get_account_info(access_token: str) -> dict:
+        return {"id": 107238239}
+
+    monkeypatch.setattr(
+        main_module.avito_messenger_client,
+        "get_account_info",
+        mock_get_account_info,
+    )
+
+    response = client.get(
+        "/avito/oauth/callback",
+        params={"code": "TEST_CODE"},
+        follow_redirects=False,
+    )
+    # после сохранения токенов callback уводит в UI настроек проекта
+    assert response.status_code == 303
 
     tokens = main_module.avito_token_store.get_default_tokens()
     assert tokens is not None
     assert tokens.access_token == "ACCESS123"
     assert tokens.refresh_token == "REFRESH123"
+    assert tokens.account_id == "107238239"
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.clients.avito_client import AvitoMessengerClient
+from app.clients.avito_rate_limiter import AvitoRateLimiter, TokenBucket, parse_retry_after
+from app.clients.http_transport import HttpTransport
+from app.clients.resilience import Resilience
+from app.settings import AvitoSettings
+
+
+class StubAvito:
+    """
+    Локальный HTTP-сервер, который ведёт себя как Avito под нагрузкой:
+    строгий token bucket (limit запросов/с, всплеск burst), сверх лимита — 429.
+    """
+
+    def __init__(self, limit: float, burst: int, retry_after: str = "0.1") -> None:
+        self.limit = limit
+        self.burst = burst
+        self.retry_after = retry_after
+        self.accepted = 0
+        self.rejected = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                allowed = stub._take()
+                if allowed:
+                    body = json.dumps({"messages": []}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                else:
+                    body = b"Too Many Requests"
+                    self.send_response(429)
+                    self.send_header("Retry-After", stub.retry_after)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.limit)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.accepted += 1
+                return True
+            self.rejected += 1
+            return False
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_client(base_url: str, rate: float, burst: int, max_retries: int = 3) -> AvitoMessengerClient:
+    settings = AvitoSettings(
+        avito_rate_limits={"read": rate},
+        avito_rate_burst=burst,
+        avito_rate_max_retries=max_retries,
+    )
+    return AvitoMessengerClient(
+        base_url=base_url,
+        transport=HttpTransport(),
+        rate_limiter=AvitoRateLimiter(settings),
+        resilience=Resilience("avito_api"),
+    )
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, burst=3)
+    delays = [bucket.reserve(now=100.0) for _ in range(5)]
+
+    assert delays[:3] == [0, 0, 0]
+    assert delays[3] == pytest.approx(0.1)
+    assert delays[4] == pytest.approx(0.2)
+
+
+def test_token_bucket_backs_off_on_429_and_recovers():
+    bucket = TokenBucket(rate=10, burst=3, min_rate=1, decrease_factor=0.5, recovery_step=0.1)
+    bucket.on_throttled(retry_after=2.0, now=100.0)
+
+    assert bucket.rate == 5
+    assert bucket.reserve(now=100.0) == pytest.approx(2.0)
+    # Второй 429 от уже отправленного запроса не снижает скорость повторно
+    bucket.on_throttled(retry_after=2.0, now=100.1)
+    assert bucket.rate == 5
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 10
+
+
+def test_parse_retry_after_seconds_and_http_date():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("garbage") is None
+    assert parse_retry_after(formatdate(1000.0 + 5, usegmt=True), now=1000.0) == pytest.approx(5.0)
+
+
+@pytest.mark.asyncio
+async def test_sustained_throughput_stays_just_under_the_limit():
+    limit, burst, requests = 20.0, 2, 45
+    # У сервера запас по всплеску больше, чем у клиента, — на сетевой джиттер
+    with StubAvito(limit=limit, burst=5) as stub:
+        client = make_client(stub.base_url, rate=limit * 0.95, burst=burst)
+
+        started = time.monotonic()
+        await asyncio.gather(*(
+            client.get_chat_messages(chat_id="chat_1", access_token="TOKEN", account_id="42")
+            for _ in range(requests)
+        ))
+        elapsed = time.monotonic() - started
+        await client.transport.aclose()
+
+    # Всплеск проходит сразу, дальше — не быстрее лимита и без 429
+    sustained = (requests - burst) / elapsed
+    assert stub.rejected == 0
+    assert stub.accepted == requests
+    assert 0.85 * limit <= sustained <= limit
+
+
+@pytest.mark.asyncio
+async def test_limiter_adapts_to_429_and_queues_instead_of_failing():
+    limit, burst, requests = 20.0, 2, 30
+    with StubAvito(limit=limit, burst=5) as stub:
+        # Номинал вдвое выше реального лимита Avito
+        client = make_client(stub.base_url, rate=limit * 2, burst=burst, max_retries=10)
+
+        results = await asyncio.gather(*(
+            client.get_chat_messages(chat_id="chat_1", access_token="TOKEN", account_id="42")
+            for _ in range(requests)
+        ))
+        await client.transport.aclose()
+
+    assert results == [[]] * requests
+    assert stub.accepted == requests
+    assert stub.rejected > 0
+    assert client.rate_limiter.bucket("42", "read").rate < limit * 2
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+
+from app.chat_state import ChatState
+
+
+def wait_for(predicate, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition was not met in time"
+        time.sleep(0.01)
+
+
+def test_chat_state_persists_and_loads_on_startup(tmp_path):
+    path = str(tmp_path / "chat_state.json")
+    state = ChatState(path=path)
+    state.set_last_message_id("chat_1", "msg_1")
+    state.set_last_message_id("chat_2", "msg_2")
+    state.set_last_message_id("chat_1", "msg_3")
+    state.close()
+
+    reloaded = ChatState(path=path)
+    assert reloaded.get_last_message_id("chat_1") == "msg_3"
+    assert reloaded.get_last_message_id("chat_2") == "msg_2"
+    assert reloaded.get_last_message_id("missing") is None
+    reloaded.close()
+
+
+def test_chat_state_writes_are_appended_in_batches(tmp_path):
+    path = str(tmp_path / "chat_state.json")
+    state = ChatState(path=path, flush_interval=60, batch_size=3)
+
+    state.set_last_message_id("chat_1", "msg_1")
+    state.set_last_message_id("chat_2", "msg_1")
+    # Батч ещё не набрался — на диске пусто
+    assert not os.path.exists(state.log_path)
+
+    state.set_last_message_id("chat_3", "msg_1")
+    # Батч набрался — фоновый поток дописывает его, не дожидаясь flush_interval
+    wait_for(lambda: os.path.exists(state.log_path) and os.path.getsize(state.log_path) > 0)
+    with open(state.log_path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [
+            ["chat_1", "msg_1"],
+            ["chat_2", "msg_1"],
+            ["chat_3", "msg_1"],
+        ]
+    # Снапшот не переписывается на каждую запись
+    assert not os.path.exists(path)
+    state.close()
+
+
+def test_chat_state_recovers_from_log_after_crash(tmp_path):
+    path = str(tmp_path / "chat_state.json")
+    state = ChatState(path=path, flush_interval=60)
+    state.set_last_message_id("chat_1", "msg_1")
+    state.flush()
+    # Имитируем падение посреди записи: недописанная строка в конце журнала
+    with open(state.log_path, "a", encoding="utf-8") as f:
+        f.write('["chat_2", "ms')
+
+    recovered = ChatState(path=path)
+    assert recovered.get_last_message_id("chat_1") == "msg_1"
+    assert recovered.get_last_message_id("chat_2") is None
+
+    # Обрывок срезан — следующая запись не приклеивается к нему
+    recovered.set_last_message_id("chat_3", "msg_3")
+    recovered.close()
+    reloaded = ChatState(path=path)
+    assert reloaded.get_last_message_id("chat_3") == "msg_3"
+    reloaded.close()
+
+
+def test_chat_state_compacts_log_into_snapshot(tmp_path):
+    path = str(tmp_path / "chat_state.json")
+    state = ChatState(path=path, batch_size=1, compact_threshold=4)
+
+    for i in range(4):
+        state.set_last_message_id("chat_1", f"msg_{i}")
+    state.flush()
+
+    # Журнал свернулся в снапшот и обнулился
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"chat_1": "msg_3"}
+    assert os.path.getsize(state.log_path) == 0
+    state.close()
+
+    assert ChatState(path=path).get_last_message_id("chat_1") == "msg_3"
+
+
+def test_chat_state_reads_legacy_snapshot(tmp_path):
+    path = tmp_path / "chat_state.json"
+    path.write_text(json.dumps({"chat_1": "msg_1"}, indent=2), encoding="utf-8")
+
+    state = ChatState(path=str(path))
+    assert state.get_last_message_id("chat_1") == "msg_1"
+
+
+def test_chat_state_writes_on_flusher_thread_outside_lock(tmp_path, monkeypatch):
+    state = ChatState(path=str(tmp_path / "chat_state.json"), flush_interval=60, batch_size=2, compact_threshold=2)
+    writes = []
+    write_pending, save = state._write_pending, state._save
+
+    def record_pending(pending):
+        writes.append(("log", threading.current_thread().name, state._lock.locked()))
+        write_pending(pending)
+
+    def record_save(snapshot):
+        writes.append(("snapshot", threading.current_thread().name, state._lock.locked()))
+        save(snapshot)
+
+    monkeypatch.setattr(state, "_write_pending", record_pending)
+    monkeypatch.setattr(state, "_save", record_save)
+
+    state.set_last_message_id("chat_1", "msg_1")
+    state.set_last_message_id("chat_2", "msg_2")
+    wait_for(lambda: len(writes) == 2)
+    # Вызывающий поток не пишет сам, а get/set не ждут fsync и сборки снапшота
+    assert writes == [
+        ("log", "chat-state-flusher", False),
+        ("snapshot", "chat-state-flusher", False),
+    ]
+    assert state.get_last_message_id("chat_2") == "msg_2"
+    state.close()
+
+    with open(state.path, encoding="utf-8") as f:
+        assert json.load(f) == {"chat_1": "msg_1", "chat_2": "msg_2"}
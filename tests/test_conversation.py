@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+from app.clients.perplexity_client import PerplexityClient
+from app.conversation import ASSISTANT, USER, ConversationStore, Turn, TurnRing
+from app.schemas_avito import AvitoWebhook
+from app.storage.sqlite import SqliteStorage
+from app.storage.stores import SqliteConversationStore
+
+
+def test_turn_ring_keeps_only_last_turns():
+    ring = TurnRing(3)
+    for i in range(5):
+        ring.append(Turn(USER, f"msg_{i}"))
+
+    assert len(ring) == 3
+    assert [turn.text for turn in ring.last(10)] == ["msg_2", "msg_3", "msg_4"]
+    assert [turn.text for turn in ring.last(2)] == ["msg_3", "msg_4"]
+    assert ring.last(0) == []
+
+
+def test_store_evicts_lru_chats_and_reloads_them_from_disk(tmp_path):
+    store = ConversationStore(directory=str(tmp_path), max_turns=3, max_chats=2)
+    store.append("chat_1", USER, "Здравствуйте")
+    store.append("chat_1", ASSISTANT, "Добрый день")
+    store.append("chat_2", USER, "Актуально?")
+    store.append("chat_3", USER, "Торг уместен?")
+
+    assert store.stats()["evictions"] == 1
+    assert [(turn.role, turn.text) for turn in store.recent("chat_1", 5)] == [
+        (USER, "Здравствуйте"),
+        (ASSISTANT, "Добрый день"),
+    ]
+
+    # Новый процесс видит ту же историю, а файл не растёт бесконечно
+    for i in range(20):
+        store.append("chat_1", USER, f"msg_{i}")
+    reopened = ConversationStore(directory=str(tmp_path), max_turns=3)
+    assert [turn.text for turn in reopened.recent("chat_1", 3)] == ["msg_17", "msg_18", "msg_19"]
+    assert len(reopened._load_turns("chat_1")) <= 4 * 3
+
+
+def test_store_truncates_partial_line_after_crash(tmp_path):
+    store = ConversationStore(directory=str(tmp_path))
+    store.append("chat_1", USER, "Здравствуйте")
+    # Падение посреди write: недописанная строка в конце файла
+    with open(store._path("chat_1"), "a", encoding="utf-8") as f:
+        f.write('["assistant", "Добр')
+
+    reopened = ConversationStore(directory=str(tmp_path))
+    reopened.append("chat_1", USER, "Актуально?")
+
+    again = ConversationStore(directory=str(tmp_path))
+    assert [turn.text for turn in again.recent("chat_1", 5)] == ["Здравствуйте", "Актуально?"]
+
+
+def test_slow_disk_write_of_one_chat_does_not_block_others(tmp_path, monkeypatch):
+    store = ConversationStore(directory=str(tmp_path))
+    store.append("chat_2", USER, "Актуально?")
+    writing = threading.Event()
+    release = threading.Event()
+    persist = store._persist_turn
+
+    def slow_persist(chat_id, turn):
+        if chat_id == "chat_1":
+            writing.set()
+            release.wait(5)
+        persist(chat_id, turn)
+
+    monkeypatch.setattr(store, "_persist_turn", slow_persist)
+    writer = threading.Thread(target=store.append, args=("chat_1", USER, "Здравствуйте"))
+    writer.start()
+    assert writing.wait(5)
+
+    started = time.monotonic()
+    assert [turn.text for turn in store.recent("chat_2", 5)] == ["Актуально?"]
+    store.append("chat_2", ASSISTANT, "Да")
+    assert time.monotonic() - started < 1
+
+    release.set()
+    writer.join()
+    assert [turn.text for turn in store.recent("chat_1", 5)] == ["Здравствуйте"]
+
+
+def test_sqlite_store_persists_and_compacts(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "state.db"))
+    store = SqliteConversationStore(storage, max_turns=2)
+    for i in range(10):
+        store.append("chat_1", USER if i % 2 == 0 else ASSISTANT, f"msg_{i}")
+
+    reopened = SqliteConversationStore(storage, max_turns=2)
+    assert [turn.text for turn in reopened.recent("chat_1", 5)] == ["msg_8", "msg_9"]
+    count = storage.connection().execute("SELECT COUNT(*) FROM conversation_turns").fetchone()[0]
+    assert count <= 4 * 2
+    storage.close()
+
+
+def test_build_messages_alternates_roles():
+    history = [
+        Turn(ASSISTANT, "Приветственное сообщение"),
+        Turn(USER, "Здравствуйте"),
+        Turn(USER, "Телескоп ещё продаётся?"),
+        Turn(ASSISTANT, "Да, в наличии"),
+        Turn(USER, "А доставка есть?"),
+    ]
+    messages = PerplexityClient._build_messages("В Казань", "system", history)
+
+    assert messages == [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "Здравствуйте\nТелескоп ещё продаётся?"},
+        {"role": "assistant", "content": "Да, в наличии"},
+        {"role": "user", "content": "А доставка есть?\nВ Казань"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_webhook_passes_chat_history_to_llm(monkeypatch, tmp_path):
+    from app import main as main_module
+    from app.semantic_cache import SemanticCache
+
+    monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+    main_module.answer_cache.purge()
+
+    histories = []
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        histories.append([(turn.role, turn.text) for turn in history or ()])
+        return f"Ответ на «{user_message}»"
+
+    async def mock_send_text_message(chat_id, text, access_token, account_id=None):
+        pass
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
+    monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", mock_send_text_message)
+
+    def webhook(message_id: str, text: str) -> AvitoWebhook:
+        return AvitoWebhook(**{
+            "id": f"wh_{message_id}",
+            "version": 1,
+            "timestamp": "2025-01-01T12:00:00Z",
+            "payload": {
+                "type": "message",
+                "value": {
+                    "id": message_id,
+                    "chat_id": "chat_history",
+                    "user_id": "user_1",
+                    "author_id": "user_1",
+                    "created": "2025-01-01T12:00:00Z",
+                    "type": "text",
+                    "content": {"text": text},
+                },
+            },
+        })
+
+    await main_module.process_avito_webhook(webhook("m1", "Телескоп ещё продаётся?"))
+    await main_module.process_avito_webhook(webhook("m2", "А доставка есть?"))
+
+    assert histories == [
+        [],
+        [(USER, "Телескоп ещё продаётся?"), (ASSISTANT, "Ответ на «Телескоп ещё продаётся?»")],
+    ]
+    main_module.answer_cache.purge()
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.conversation import ConversationStore
+from app.debounce import ChatDebouncer, TimerWheel
+from app.schemas_avito import AvitoWebhook
+from app.token_store import AvitoTokens
+
+
+def test_timer_wheel_fires_rescheduled_and_far_deadlines():
+    wheel = TimerWheel(tick=0.1, slots=8)
+    wheel.advance(0.0)
+    wheel.schedule("a", 0.25)
+    wheel.schedule("b", 0.25)
+    wheel.schedule("b", 0.55)  # перенос срока
+    wheel.schedule("far", 2.05)  # дальше одного оборота колеса (0.8 с)
+
+    assert wheel.advance(0.2) == []
+    assert wheel.advance(0.35) == ["a"]
+    assert wheel.advance(0.65) == ["b"]
+    assert len(wheel) == 1
+    # Слот "far" уже проходили на прошлом обороте — срок ещё не наступил
+    assert wheel.advance(1.3) == []
+    assert wheel.advance(5.0) == ["far"]
+    assert len(wheel) == 0
+
+
+@pytest.mark.asyncio
+async def test_debouncer_coalesces_burst_into_one_flush():
+    flushed = []
+
+    async def on_flush(burst):
+        flushed.append((burst.chat_id, burst.text, burst.payload))
+
+    debouncer = ChatDebouncer(on_flush, quiet=0.05, max_wait=1.0, tick=0.01)
+    await debouncer.start()
+    for i, text in enumerate(["Здравствуйте", "скажите", "есть доставка?"]):
+        debouncer.add("chat_1", text, payload=i)
+        await asyncio.sleep(0.01)
+    debouncer.add("chat_2", "Актуально?")
+    await asyncio.sleep(0.2)
+
+    assert sorted(flushed) == [
+        ("chat_1", "Здравствуйте\nскажите\nесть доставка?", 2),
+        ("chat_2", "Актуально?", None),
+    ]
+    assert debouncer.stats()["bursts"] == 2
+    await debouncer.stop()
+
+
+@pytest.mark.asyncio
+async def test_debouncer_respects_max_wait_and_flushes_on_stop():
+    flushed = []
+
+    async def on_flush(burst):
+        flushed.append(burst.text)
+
+    debouncer = ChatDebouncer(on_flush, quiet=0.05, max_wait=0.1, tick=0.01)
+    await debouncer.start()
+    # Клиент пишет без пауз дольше max_wait — первая пачка уходит, не дожидаясь тишины
+    for i in range(8):
+        debouncer.add("chat_1", f"msg_{i}")
+        await asyncio.sleep(0.03)
+    assert len(flushed) >= 1
+
+    debouncer.add("chat_2", "последнее")
+    await debouncer.stop()
+    assert flushed[-1] == "последнее"
+    assert "\n".join(flushed[:-1]) == "\n".join(f"msg_{i}" for i in range(8))
+
+
+@pytest.mark.asyncio
+async def test_webhook_burst_gets_one_reply(monkeypatch, tmp_path):
+    from app import main as main_module
+    from app.semantic_cache import SemanticCache
+
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
+    main_module.avito_token_store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS",
+            refresh_token="REFRESH",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+            account_id="42",
+        )
+    )
+    monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+    debouncer = ChatDebouncer(main_module._reply_to_burst, quiet=0.05, max_wait=1.0, tick=0.01)
+    monkeypatch.setattr(main_module, "reply_debouncer", debouncer)
+    monkeypatch.setattr(main_module.app_settings, "reply_debounce_quiet_ms", 50)
+    main_module.answer_cache.purge()
+
+    calls = []
+    sent = []
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        calls.append(user_message)
+        return "Да, доставка есть"
+
+    async def mock_send_text_message(chat_id, text, access_token, account_id=None):
+        sent.append((chat_id, text))
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
+    monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", mock_send_text_message)
+
+    def webhook(message_id: str, text: str) -> AvitoWebhook:
+        return AvitoWebhook(**{
+            "id": f"wh_{message_id}",
+            "version": 1,
+            "timestamp": "2025-01-01T12:00:00Z",
+            "payload": {
+                "type": "message",
+                "value": {
+                    "id": message_id,
+                    "chat_id": "chat_burst",
+                    "user_id": "user_1",
+                    "author_id": "user_1",
+                    "created": "2025-01-01T12:00:00Z",
+                    "type": "text",
+                    "content": {"text": text},
+                },
+            },
+        })
+
+    await debouncer.start()
+    results = [
+        await main_module.process_avito_webhook(webhook(f"m{i}", text))
+        for i, text in enumerate(["Здравствуйте", "скажите", "есть доставка?"])
+    ]
+    await asyncio.sleep(0.2)
+    await debouncer.stop()
+
+    assert [result["status"] for result in results] == ["debounced"] * 3
+    assert calls == ["Здравствуйте\nскажите\nесть доставка?"]
+    assert sent == [("chat_burst", "Да, доставка есть")]
+    main_module.answer_cache.purge()
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+from app.dedup import BloomFilter, WebhookDeduplicator
+
+
+def test_dedup_remembers_added_keys(tmp_path):
+    dedup = WebhookDeduplicator(path=str(tmp_path / "dedup.json"))
+
+    assert not dedup.seen(["event:1", "message:1"])
+    dedup.add(["event:1", "message:1"])
+    assert dedup.seen(["event:1"])
+    assert dedup.seen(["event:2", "message:1"])
+    assert not dedup.seen(["event:2", "message:2"])
+    dedup.close()
+
+
+def test_dedup_survives_restart(tmp_path):
+    path = str(tmp_path / "dedup.json")
+    dedup = WebhookDeduplicator(path=path)
+    dedup.add(["event:1"])
+    dedup.close()
+
+    restored = WebhookDeduplicator(path=path)
+    assert restored.seen(["event:1"])
+    assert len(restored) == 1
+    restored.close()
+
+
+def test_dedup_save_does_not_block_lookups(tmp_path, monkeypatch):
+    path = str(tmp_path / "dedup.json")
+    dedup = WebhookDeduplicator(path=path, flush_interval=60)
+    dedup.add(["event:1"])
+
+    writing = threading.Event()
+    release = threading.Event()
+    write = dedup._write
+
+    def slow_write(recent, blooms):
+        writing.set()
+        release.wait(5)
+        write(recent, blooms)
+
+    monkeypatch.setattr(dedup, "_write", slow_write)
+    saver = threading.Thread(target=dedup.flush)
+    saver.start()
+    assert writing.wait(5)
+
+    # Пока файл сжимается и пишется, проверки и добавления не ждут
+    started = time.monotonic()
+    assert dedup.seen(["event:1"])
+    dedup.add(["event:2"])
+    assert time.monotonic() - started < 1
+
+    release.set()
+    saver.join()
+    dedup.close()
+    assert WebhookDeduplicator(path=path).seen(["event:2"])
+
+
+def test_dedup_recent_set_is_bounded_but_bloom_still_remembers(tmp_path):
+    dedup = WebhookDeduplicator(path=str(tmp_path / "dedup.json"), max_recent=10)
+    for i in range(100):
+        dedup.add([f"event:{i}"])
+
+    assert len(dedup) == 10
+    # Старые id вытеснены из точного множества, но остались в Bloom-фильтре
+    assert dedup.seen(["event:0"])
+    dedup.close()
+
+
+def test_dedup_bloom_rotates_and_forgets_after_two_generations(tmp_path):
+    dedup = WebhookDeduplicator(path=str(tmp_path / "dedup.json"), max_recent=1, bloom_capacity=10)
+    dedup.add(["event:old"])
+    for i in range(25):
+        dedup.add([f"event:{i}"])
+
+    assert dedup.stats()["bloom_generations"] == 2
+    assert not dedup.seen(["event:old"])
+    dedup.close()
+
+
+def test_dedup_expires_recent_ids_after_ttl(tmp_path, monkeypatch):
+    dedup = WebhookDeduplicator(path=str(tmp_path / "dedup.json"), ttl_seconds=60)
+    dedup.add(["event:1"])
+
+    now = time.time()
+    monkeypatch.setattr("app.dedup.time.time", lambda: now + 120)
+    dedup.add(["event:2"])
+
+    assert len(dedup) == 1
+    dedup.close()
+
+
+def test_bloom_filter_roundtrip_and_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000, 1e-6)
+    keys = [f"message:{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    restored = BloomFilter.from_dict(bloom.to_dict())
+    assert all(key in restored for key in keys)
+    assert sum(f"other:{i}" in restored for i in range(1000)) == 0
+
+
+def test_dedup_saves_through_per_process_tmp_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "dedup.json")
+    replaced = []
+    real_replace = os.replace
+
+    def record_replace(src, dst):
+        replaced.append(src)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", record_replace)
+    dedup = WebhookDeduplicator(path=path)
+    dedup.add(["event:1"])
+    dedup.close()
+
+    assert replaced == [f"{path}.{os.getpid()}.tmp"]
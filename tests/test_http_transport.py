@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.clients.http_transport import HttpTransport
+from app.settings import HttpSettings
+
+
+@pytest.mark.asyncio
+async def test_http_transport_reuses_single_client():
+    transport = HttpTransport(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    await transport.start()
+    client = transport.client
+
+    await transport.request("GET", "https://api.avito.test/a")
+    await transport.request("GET", "https://api.avito.test/b")
+
+    assert transport.client is client
+    await transport.aclose()
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_http_transport_per_host_limit():
+    """Одновременно к одному хосту уходит не больше http_host_limits[host] запросов."""
+    in_flight = {"api.avito.test": 0, "stt.test": 0}
+    peak = {"api.avito.test": 0, "stt.test": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        in_flight[host] += 1
+        peak[host] = max(peak[host], in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return httpx.Response(200)
+
+    settings = HttpSettings(http_per_host_limit=4, http_host_limits={"api.avito.test": 2})
+    transport = HttpTransport(settings=settings, transport=httpx.MockTransport(handler))
+
+    await asyncio.gather(
+        *[transport.request("GET", "https://api.avito.test/x") for _ in range(10)],
+        *[transport.request("GET", "https://stt.test/x") for _ in range(10)],
+    )
+    await transport.aclose()
+
+    assert peak["api.avito.test"] == 2
+    assert peak["stt.test"] == 4
+
+
+def test_http_transport_http2_falls_back_without_h2(monkeypatch):
+    import app.clients.http_transport as transport_module
+
+    monkeypatch.setattr(transport_module, "_http2_available", lambda: False)
+    transport = HttpTransport(settings=HttpSettings(http_http2=True))
+    _ = transport.client
+    assert transport.http2_enabled is False
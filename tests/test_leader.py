@@ -0,0 +1,130 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("fcntl")
+
+from app.leader import LeaderLease
+
+
+def make_lease(path: str, events: list, name: str) -> LeaderLease:
+    async def on_acquired():
+        events.append((name, "acquired"))
+
+    async def on_lost():
+        events.append((name, "lost"))
+
+    return LeaderLease(path=path, heartbeat_interval=0.05, on_acquired=on_acquired, on_lost=on_lost)
+
+
+async def wait_for(predicate, timeout: float = 2.0) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition was not met in time")
+
+
+@pytest.mark.asyncio
+async def test_only_one_lease_is_leader_and_follower_takes_over(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    events = []
+    first = make_lease(path, events, "first")
+    second = make_lease(path, events, "second")
+
+    await first.start()
+    await second.start()
+    try:
+        await asyncio.sleep(0.15)
+        assert first.is_leader and not second.is_leader
+        assert second.stats()["leader_pid"] == os.getpid()
+
+        await first.stop()
+        await wait_for(lambda: second.is_leader)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert events == [
+        ("first", "acquired"),
+        ("first", "lost"),
+        ("second", "acquired"),
+        ("second", "lost"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_lease_is_taken_over_when_leader_process_dies(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, os, sys, time\n"
+            f"fd = os.open({path!r}, os.O_RDWR | os.O_CREAT)\n"
+            "fcntl.flock(fd, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "time.sleep(60)\n",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    events = []
+    lease = make_lease(path, events, "worker")
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        await lease.start()
+        await asyncio.sleep(0.1)
+        assert not lease.is_leader
+
+        holder.kill()
+        holder.wait()
+        await wait_for(lambda: lease.is_leader)
+    finally:
+        holder.kill()
+        holder.wait()
+        holder.stdout.close()
+        await lease.stop()
+
+    assert events[0] == ("worker", "acquired")
+
+
+@pytest.mark.asyncio
+async def test_leader_steps_down_when_lock_file_is_replaced(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    events = []
+    lease = make_lease(path, events, "worker")
+    lease.heartbeat_interval = 60  # тики вызываем вручную
+
+    await lease.start()
+    try:
+        assert lease.is_leader
+        os.remove(path)
+        await lease._tick()
+        assert not lease.is_leader
+        assert events == [("worker", "acquired"), ("worker", "lost")]
+    finally:
+        await lease.stop()
+
+
+@pytest.mark.asyncio
+async def test_lock_is_released_only_after_on_lost_finishes(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    contender = LeaderLease(path=path)
+    taken_during_on_lost = []
+
+    async def on_lost():
+        await asyncio.sleep(0.05)  # отменяем идущую итерацию поллера
+        taken_during_on_lost.append(contender._try_acquire())
+
+    lease = LeaderLease(path=path, heartbeat_interval=0.05, on_lost=on_lost)
+    await lease.start()
+    assert lease.is_leader
+    await lease.stop()
+
+    assert taken_during_on_lost == [False]
+    assert contender._try_acquire()
+    os.close(contender._fd)
@@ -1,11 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
 from fastapi.testclient import TestClient
 
 from app.main import app
+from app.schemas_avito import AvitoWebhook
+from app.token_store import AvitoTokens
 
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_answer_cache(monkeypatch, tmp_path):
+    from app import main as main_module
+    from app.conversation import ConversationStore
+    from app.semantic_cache import SemanticCache
+
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+    monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+    main_module.answer_cache.purge()
+    yield
+    main_module.answer_cache.purge()
+
+
 def test_health_check():
     response = client.get("/")
     assert response.status_code == 200
@@ -15,20 +33,25 @@ def test_health_check():
     assert data["version"] == "0.1.0"
 
 
-def test_avito_webhook_basic(monkeypatch):
+@pytest.fixture
+def webhook_dedup(monkeypatch, tmp_path):
     from app import main as main_module
+    from app.dedup import WebhookDeduplicator
 
-    def mock_send_text_message(chat_id: str, text: str, access_token: str) -> None:
-        # Проверим, что вызывается с ожидемыми параметрами
-        assert chat_id == "chat_1"
-        assert text == "Привет, это тестовое сообщение" or isinstance(text, str)
-        assert isinstance(access_token, str)
+    dedup = WebhookDeduplicator(path=str(tmp_path / "dedup.json"))
+    monkeypatch.setattr(main_module, "webhook_dedup", dedup)
+    yield dedup
+    dedup.close()
 
-    monkeypatch.setattr(
-        main_module.avito_messenger_client,
-        "send_text_message",
-        mock_send_text_message,
-    )
+
+def test_avito_webhook_basic(monkeypatch, webhook_dedup):
+    """
+    Вебхук только ставится в очередь конвейера, ответ приходит сразу.
+    """
+    from app import main as main_module
+
+    queued = []
+    monkeypatch.setattr(main_module.webhook_pipeline, "submit", queued.append)
 
     payload = {
         "id": "wh_123",
@@ -57,27 +80,111 @@ def test_avito_webhook_basic(monkeypatch):
     assert data["status"] == "received"
     assert data["webhook_id"] == "wh_123"
     assert data["event_type"] == "message"
-    assert data["message_type"] == "text"
-    assert data["message_text"] == "Привет, это тестовое сообщение"
-    assert "assistant_reply" in data
-    assert isinstance(data["assistant_reply"], str) or data["assistant_reply"] is None
-    assert "assistant_error" in data
+    assert data["queued"] is True
+    assert len(queued) == 1
+    assert queued[0].payload.value.content.text == "Привет, это тестовое сообщение"
 
 
-def test_avito_webhook_with_mocked_perplexity_success(monkeypatch):
+def test_avito_webhook_duplicate_is_acknowledged_without_pipeline(monkeypatch, webhook_dedup):
     from app import main as main_module
 
-    def mock_generate_reply(user_message: str, system_prompt: str | None = None) -> str:
+    queued = []
+    monkeypatch.setattr(main_module.webhook_pipeline, "submit", queued.append)
+
+    payload = {
+        "id": "wh_dup",
+        "version": 1,
+        "timestamp": "2025-01-01T12:00:00Z",
+        "payload": {
+            "type": "message",
+            "value": {
+                "id": "msg_dup",
+                "chat_id": "chat_1",
+                "user_id": "user_1",
+                "author_id": "user_1",
+                "created": "2025-01-01T12:00:00Z",
+                "type": "text",
+                "content": {"text": "Привет"},
+            }
+        }
+    }
+
+    assert client.post("/webhooks/avito", json=payload).json()["status"] == "received"
+
+    # Повтор того же события
+    response = client.post("/webhooks/avito", json=payload)
+    assert response.status_code == 200
+    assert response.json()["status"] == "duplicate"
+
+    # Новое событие с тем же сообщением тоже дубликат
+    payload["id"] = "wh_dup_2"
+    assert client.post("/webhooks/avito", json=payload).json()["status"] == "duplicate"
+
+    assert len(queued) == 1
+
+
+def test_avito_webhook_queue_full_returns_503(monkeypatch, webhook_dedup):
+    from app import main as main_module
+    from app.pipeline import PipelineQueueFull
+
+    def mock_submit(webhook):
+        raise PipelineQueueFull("full")
+
+    monkeypatch.setattr(main_module.webhook_pipeline, "submit", mock_submit)
+
+    payload = {
+        "id": "wh_full",
+        "version": 1,
+        "timestamp": "2025-01-01T12:00:00Z",
+        "payload": {
+            "type": "message",
+            "value": {
+                "id": "msg_full",
+                "chat_id": "chat_1",
+                "user_id": "user_1",
+                "author_id": "user_1",
+                "created": "2025-01-01T12:00:00Z",
+                "type": "text",
+                "content": {"text": "Привет"},
+            }
+        }
+    }
+
+    response = client.post("/webhooks/avito", json=payload)
+    assert response.status_code == 503
+    # Отклонённое событие не запоминается — повторная доставка пройдёт
+    assert not webhook_dedup.seen(["event:wh_full"])
+
+
+@pytest.mark.asyncio
+async def test_avito_webhook_with_mocked_perplexity_success(monkeypatch, tmp_path):
+    from app import main as main_module
+
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
+    main_module.avito_token_store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS",
+            refresh_token="REFRESH",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+            account_id="42",
+        )
+    )
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
         return f"[MOCKED] {user_message}"
 
-    def mock_send_text_message(chat_id: str, text: str, access_token: str) -> None:
+    sent = []
+
+    async def mock_send_text_message(chat_id: str, text: str, access_token: str, account_id=None) -> None:
         assert chat_id == "chat_2"
         assert text == "[MOCKED] Тест для моков"
-        assert isinstance(access_token, str)
+        assert access_token == "ACCESS"
+        assert account_id == "42"
+        sent.append(text)
 
     monkeypatch.setattr(
         main_module.perplexity_client,
-        "generate_reply",
+        "agenerate_reply",
         mock_generate_reply,
     )
     monkeypatch.setattr(
@@ -106,28 +213,30 @@ def test_avito_webhook_with_mocked_perplexity_success(monkeypatch):
         }
     }
 
-    response = client.post("/webhooks/avito", json=payload)
-    assert response.status_code == 200
-    data = response.json()
+    data = await main_module.process_avito_webhook(AvitoWebhook(**payload))
     assert data["assistant_reply"] == "[MOCKED] Тест для моков"
+    assert data["input_tokens"] > 0
     assert data["assistant_error"] is None
+    assert data["messaging_error"] is None
+    assert sent == ["[MOCKED] Тест для моков"]
 
 
-def test_avito_webhook_with_mocked_perplexity_error(monkeypatch):
+@pytest.mark.asyncio
+async def test_avito_webhook_with_mocked_perplexity_error(monkeypatch):
     """
     Тестируем сценарий ошибки Perplexity:
-    generate_reply выбрасывает PerplexityClientError,
+    agenerate_reply выбрасывает PerplexityClientError,
     проверяем, что вебхук не падает и assistant_error заполнен.
     """
     from app import main as main_module
     from app.clients.perplexity_client import PerplexityClientError
 
-    def mock_generate_reply_raises(user_message: str, system_prompt: str | None = None) -> str:
+    async def mock_generate_reply_raises(user_message: str, system_prompt: str | None = None, history=None) -> str:
         raise PerplexityClientError("Test-induced failure")
 
     monkeypatch.setattr(
         main_module.perplexity_client,
-        "generate_reply",
+        "agenerate_reply",
         mock_generate_reply_raises,
     )
 
@@ -151,14 +260,13 @@ def test_avito_webhook_with_mocked_perplexity_error(monkeypatch):
         }
     }
 
-    response = client.post("/webhooks/avito", json=payload)
-    assert response.status_code == 200
-    data = response.json()
+    data = await main_module.process_avito_webhook(AvitoWebhook(**payload))
     assert data["assistant_reply"] is None
     assert data["assistant_error"] == "Test-induced failure"
 
 
-def test_avito_webhook_voice_with_mocked_stt_and_perplexity(monkeypatch):
+@pytest.mark.asyncio
+async def test_avito_webhook_voice_with_mocked_stt_and_perplexity(monkeypatch):
     """
     Голосовое сообщение:
     - STT успешно распознаёт текст;
@@ -166,16 +274,16 @@ def test_avito_webhook_voice_with_mocked_stt_and_perplexity(monkeypatch):
     """
     from app import main as main_module
 
-    def mock_transcribe(audio_url: str) -> str:
+    async def mock_transcribe(audio_url: str) -> str:
         assert audio_url == "https://example.com/audio.ogg"
         return "Распознанный текст голоса"
 
-    def mock_generate_reply(user_message: str, system_prompt: str | None = None) -> str:
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
         assert user_message == "Распознанный текст голоса"
         return "[MOCKED] Ответ на голос"
 
     monkeypatch.setattr(main_module.stt_client, "transcribe", mock_transcribe)
-    monkeypatch.setattr(main_module.perplexity_client, "generate_reply", mock_generate_reply)
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
 
     payload = {
         "id": "wh_voice_1",
@@ -199,9 +307,7 @@ def test_avito_webhook_voice_with_mocked_stt_and_perplexity(monkeypatch):
         }
     }
 
-    response = client.post("/webhooks/avito", json=payload)
-    assert response.status_code == 200
-    data = response.json()
+    data = await main_module.process_avito_webhook(AvitoWebhook(**payload))
     assert data["message_type"] == "voice"
     assert data["message_text"] is None
     assert data["recognized_text"] == "Распознанный текст голоса"
@@ -210,7 +316,8 @@ def test_avito_webhook_voice_with_mocked_stt_and_perplexity(monkeypatch):
     assert data["stt_error"] is None
 
 
-def test_avito_webhook_voice_stt_error(monkeypatch):
+@pytest.mark.asyncio
+async def test_avito_webhook_voice_stt_error(monkeypatch):
     """
     Голосовое сообщение:
     - STT выбрасывает ошибку;
@@ -220,14 +327,14 @@ def test_avito_webhook_voice_stt_error(monkeypatch):
     from app import main as main_module
     from app.clients.stt_client import STTClientError
 
-    def mock_transcribe_raises(audio_url: str) -> str:
+    async def mock_transcribe_raises(audio_url: str) -> str:
         raise STTClientError("STT test failure")
 
-    def mock_generate_reply(user_message: str, system_prompt: str | None = None) -> str:
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
         raise AssertionError("Perplexity should not be called when STT fails")
 
     monkeypatch.setattr(main_module.stt_client, "transcribe", mock_transcribe_raises)
-    monkeypatch.setattr(main_module.perplexity_client, "generate_reply", mock_generate_reply)
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
 
     payload = {
         "id": "wh_voice_2",
@@ -251,9 +358,7 @@ def test_avito_webhook_voice_stt_error(monkeypatch):
         }
     }
 
-    response = client.post("/webhooks/avito", json=payload)
-    assert response.status_code == 200
-    data = response.json()
+    data = await main_module.process_avito_webhook(AvitoWebhook(**payload))
     assert data["message_type"] == "voice"
     assert data["recognized_text"] is None
     assert data["assistant_reply"] is None
@@ -271,10 +376,12 @@ def test_avito_oauth_start_redirect():
     assert "response_type=code" in location
 
 
-def test_avito_oauth_callback_success(monkeypatch):
+def test_avito_oauth_callback_success(monkeypatch, tmp_path):
     from app import main as main_module
 
-    def mock_exchange_code_for_tokens(code: str) -> dict:
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
+
+    async def mock_exchange_code_for_tokens(code: str) -> dict:
         assert code == "TEST_CODE"
         return {
             "access_token": "ACCESS",
@@ -282,16 +389,44 @@ def test_avito_oauth_callback_success(monkeypatch):
             "expires_in": 3600,
         }
 
+    async def mock_get_account_info(access_token: str) -> dict:
+        assert access_token == "ACCESS"
+        return {"id": 42}
+
     monkeypatch.setattr(
         main_module.avito_auth_client,
         "exchange_code_for_tokens",
         mock_exchange_code_for_tokens,
     )
+    monkeypatch.setattr(
+        main_module.avito_messenger_client,
+        "get_account_info",
+        mock_get_account_info,
+    )
 
-    response = client.get("/avito/oauth/callback?code=TEST_CODE")
-    assert response.status_code == 200
-    data = response.json()
-    assert data["status"] == "ok"
-    assert data["tokens"]["access_token"] == "ACCESS"
-    assert data["tokens"]["refresh_token"] == "REFRESH"
+    response = client.get("/avito/oauth/callback?code=TEST_CODE", follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["location"] == "/ui/project"
 
+    tokens = main_module.avito_token_store.get_default_tokens()
+    assert tokens.access_token == "ACCESS"
+    assert tokens.refresh_token == "REFRESH"
+    assert tokens.account_id == "42"
+
+
+def test_admin_purge_answer_cache(monkeypatch):
+    from app import main as main_module
+
+    main_module.answer_cache.put("default", "prompt", "Ещё актуально?", "Да")
+    main_module.answer_cache.put("other", "prompt", "Ещё актуально?", "Нет")
+
+    response = client.delete(
+        "/admin/answer-cache",
+        params={"project_id": "default"},
+        auth=(main_module.ADMIN_USERNAME, main_module.ADMIN_PASSWORD),
+    )
+
+    assert response.status_code == 200
+    assert response.json()["removed"] == 1
+    assert main_module.answer_cache.get("default", "prompt", "Ещё актуально?") is None
+    assert main_module.answer_cache.get("other", "prompt", "Ещё актуально?") == "Нет"
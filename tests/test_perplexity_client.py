@@ -0,0 +1,187 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.clients.http_transport import HttpTransport
+from app.clients.perplexity_client import PerplexityClient, PerplexityClientError
+from app.clients.resilience import Resilience
+
+
+def make_client(handler, **kwargs) -> PerplexityClient:
+    transport = HttpTransport(transport=httpx.MockTransport(handler))
+    kwargs.setdefault("resilience", Resilience("perplexity", base_delay=0))
+    return PerplexityClient(api_key="test-key", transport=transport, **kwargs)
+
+
+def completion(content: str) -> dict:
+    return {
+        "id": "cmpl_1",
+        "model": "sonar",
+        "created": 0,
+        "object": "chat.completion",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_agenerate_reply_calls_chat_completions_via_shared_transport():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=completion("Да, актуально"))
+
+    client = make_client(handler)
+    reply = await client.agenerate_reply("Ещё актуально?", system_prompt="Ты продавец")
+
+    assert reply == "Да, актуально"
+    body = json.loads(requests[0].content)
+    assert requests[0].url.path.endswith("/chat/completions")
+    assert body["messages"] == [
+        {"role": "system", "content": "Ты продавец"},
+        {"role": "user", "content": "Ещё актуально?"},
+    ]
+    assert requests[0].headers["Authorization"] == "Bearer test-key"
+
+
+@pytest.mark.asyncio
+async def test_agenerate_reply_coalesces_identical_inflight_requests():
+    client = make_client(lambda request: httpx.Response(500))
+    calls = []
+
+    async def fake_complete(messages):
+        calls.append(messages)
+        await asyncio.sleep(0.05)
+        return f"reply to {messages[-1]['content']}"
+
+    client._complete_async = fake_complete
+
+    replies = await asyncio.gather(
+        client.agenerate_reply("Где забрать?", "prompt"),
+        client.agenerate_reply("Где забрать?", "prompt"),
+        client.agenerate_reply("Торг уместен?", "prompt"),
+    )
+
+    assert replies == ["reply to Где забрать?", "reply to Где забрать?", "reply to Торг уместен?"]
+    assert len(calls) == 2
+    # После завершения запрос больше не считается "в полёте"
+    await client.agenerate_reply("Где забрать?", "prompt")
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_agenerate_reply_limits_concurrency():
+    client = make_client(lambda request: httpx.Response(500), max_concurrency=2)
+    active = 0
+    peak = 0
+
+    async def fake_complete(messages):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return "ok"
+
+    client._complete_async = fake_complete
+
+    await asyncio.gather(*(client.agenerate_reply(f"вопрос {i}") for i in range(6)))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_agenerate_reply_timeout_raises_client_error():
+    client = make_client(lambda request: httpx.Response(500), timeout=0.05)
+
+    async def slow_complete(messages):
+        await asyncio.sleep(1)
+        return "late"
+
+    client._complete_async = slow_complete
+
+    with pytest.raises(PerplexityClientError):
+        await client.agenerate_reply("Ещё актуально?")
+
+
+@pytest.mark.asyncio
+async def test_agenerate_reply_wraps_api_errors():
+    client = make_client(lambda request: httpx.Response(400, json={"error": {"message": "bad"}}))
+
+    with pytest.raises(PerplexityClientError):
+        await client.agenerate_reply("Ещё актуально?")
+
+
+@pytest.mark.asyncio
+async def test_astream_reply_yields_deltas_from_sse_stream():
+    def sse_chunk(content: str) -> str:
+        chunk = {
+            "id": "cmpl_1",
+            "model": "sonar",
+            "created": 0,
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        body = sse_chunk("Да, ") + sse_chunk("актуально.") + "data: [DONE]\n\n"
+        return httpx.Response(200, content=body.encode("utf-8"), headers={"Content-Type": "text/event-stream"})
+
+    client = make_client(handler)
+    deltas = [delta async for delta in client.astream_reply("Ещё актуально?")]
+
+    assert deltas == ["Да, ", "актуально."]
+
+
+@pytest.mark.asyncio
+async def test_astream_reply_wraps_api_errors():
+    client = make_client(lambda request: httpx.Response(400, json={"error": {"message": "bad"}}))
+
+    with pytest.raises(PerplexityClientError):
+        async for _ in client.astream_reply("Ещё актуально?"):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_astream_reply_cancelled_while_waiting_for_slot_keeps_probe_free():
+    client = make_client(lambda request: httpx.Response(500), max_concurrency=1)
+    breaker = client.resilience.breaker
+    breaker.recovery_timeout = 0
+    breaker.failure_threshold = 1
+    breaker.record_failure()
+
+    semaphore, _ = client._loop_state()
+    await semaphore.acquire()  # слот занят другим запросом
+
+    async def consume():
+        async for _ in client.astream_reply("Ещё актуально?"):
+            pass
+
+    waiting = asyncio.create_task(consume())
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    semaphore.release()
+
+    # Проба half-open не занята отменённым вызовом
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+@pytest.mark.asyncio
+async def test_llm_requests_use_llm_timeout_not_shared_read_timeout():
+    timeouts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        timeouts.append(request.extensions["timeout"])
+        return httpx.Response(200, json=completion("Да"))
+
+    client = make_client(handler, timeout=42.0)
+    await client.agenerate_reply("Ещё актуально?")
+
+    assert timeouts[0]["read"] == 42.0
+    assert timeouts[0]["connect"] == client.transport.client.timeout.connect
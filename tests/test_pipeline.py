@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.metrics import Metrics
+from app.pipeline import PipelineNotRunning, PipelineQueueFull, WebhookPipeline
+
+
+@pytest.mark.asyncio
+async def test_pipeline_processes_jobs_concurrently():
+    """Медленные задачи не блокируют друг друга: воркеры работают параллельно."""
+    processed = []
+
+    async def handler(item: int) -> None:
+        await asyncio.sleep(0.05)
+        processed.append(item)
+
+    pipeline = WebhookPipeline(handler, workers=5, max_queue_size=10, metrics=Metrics())
+    await pipeline.start()
+    try:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(5):
+            pipeline.submit(i)
+        await pipeline.join()
+        elapsed = loop.time() - started
+    finally:
+        await pipeline.stop()
+
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    # 5 задач по 50 мс на 5 воркерах — заметно меньше, чем последовательно
+    assert elapsed < 0.2
+
+
+@pytest.mark.asyncio
+async def test_pipeline_failed_job_does_not_kill_worker():
+    metrics = Metrics()
+    processed = []
+
+    async def handler(item: int) -> None:
+        if item == 0:
+            raise RuntimeError("boom")
+        processed.append(item)
+
+    pipeline = WebhookPipeline(handler, workers=1, metrics=metrics, name="test_pipeline")
+    await pipeline.start()
+    try:
+        pipeline.submit(0)
+        pipeline.submit(1)
+        await pipeline.join()
+    finally:
+        await pipeline.stop()
+
+    assert processed == [1]
+    assert metrics.counter("test_pipeline.failed") == 1
+    assert metrics.counter("test_pipeline.processed") == 1
+    timings = metrics.snapshot()["timings"]
+    assert timings["test_pipeline.job"]["count"] == 2
+    assert "test_pipeline.queue_wait" in timings
+
+
+@pytest.mark.asyncio
+async def test_pipeline_queue_full_and_stats():
+    release = asyncio.Event()
+
+    async def handler(item: int) -> None:
+        await release.wait()
+
+    pipeline = WebhookPipeline(handler, workers=1, max_queue_size=1, metrics=Metrics())
+    await pipeline.start()
+    try:
+        pipeline.submit(1)
+        await asyncio.sleep(0)  # воркер забирает первую задачу
+        pipeline.submit(2)
+        with pytest.raises(PipelineQueueFull):
+            pipeline.submit(3)
+
+        stats = pipeline.stats()
+        assert stats["workers"] == 1
+        assert stats["busy_workers"] == 1
+        assert stats["queue_depth"] == 1
+    finally:
+        release.set()
+        await pipeline.stop()
+
+
+def test_pipeline_submit_before_start():
+    async def handler(item: int) -> None:
+        pass
+
+    pipeline = WebhookPipeline(handler, workers=1, metrics=Metrics())
+    with pytest.raises(PipelineNotRunning):
+        pipeline.submit(1)
@@ -0,0 +1,283 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.chat_state import ChatState
+from app.conversation import ConversationStore
+from app.semantic_cache import SemanticCache
+from app.projects.models import Project
+from app.token_store import AvitoTokens
+
+
+@pytest.fixture
+def poller_env(monkeypatch, tmp_path):
+    """
+    Окружение поллера: свежие токены во временном сторе, проект "всегда включён",
+    изолированный ChatState и фейковый Avito с непрочитанными чатами
+    (по умолчанию по одному сообщению клиента в каждом).
+    """
+    from app import main as main_module
+
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
+    main_module.avito_token_store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS",
+            refresh_token="REFRESH",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+            account_id="42",
+        )
+    )
+    project = Project(id="default", name="Test", business_type="goods")
+    monkeypatch.setattr(main_module.project_store, "get_project", lambda project_id: project)
+
+    chat_state = ChatState(path=str(tmp_path / "chat_state.json"))
+    monkeypatch.setattr(main_module, "chat_state", chat_state)
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+    monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+    main_module.answer_cache.purge()
+
+    env = {"chats": [], "messages": {}, "sent": [], "pages": [], "fetched": []}
+
+    def messages_for(chat_id):
+        return env["messages"].get(
+            chat_id,
+            [{"id": f"{chat_id}_m1", "direction": "in", "content": {"text": f"Вопрос из {chat_id}"}}],
+        )
+
+    async def mock_get_chats(access_token, account_id, limit=10, unread_only=None, offset=0):
+        env["pages"].append(offset)
+        return [
+            {**chat, "last_message": {"id": messages_for(chat["id"])[-1]["id"]}}
+            for chat in env["chats"][offset:offset + limit]
+        ]
+
+    async def mock_get_chat_messages(chat_id, access_token, limit=10, since_message_id=None, account_id=None):
+        env["fetched"].append((chat_id, since_message_id))
+        return messages_for(chat_id)
+
+    async def mock_send_text_message(chat_id, text, access_token, account_id=None):
+        env["sent"].append(chat_id)
+
+    monkeypatch.setattr(main_module.avito_messenger_client, "get_chats", mock_get_chats)
+    monkeypatch.setattr(main_module.avito_messenger_client, "get_chat_messages", mock_get_chat_messages)
+    monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", mock_send_text_message)
+    yield main_module, env
+    chat_state.close()
+    main_module.answer_cache.purge()
+
+
+@pytest.mark.asyncio
+async def test_poller_processes_all_unread_chats_concurrently(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": f"chat_{i}"} for i in range(12)]
+    monkeypatch.setattr(main_module.app_settings, "poller_page_size", 5)
+    monkeypatch.setattr(main_module.app_settings, "poller_concurrency", 12)
+
+    async def slow_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        await asyncio.sleep(0.1)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", slow_generate_reply)
+
+    started = time.perf_counter()
+    await main_module.avito_auto_poller()
+    elapsed = time.perf_counter() - started
+
+    # Все три страницы прочитаны, ответ ушёл в каждый чат
+    assert env["pages"] == [0, 5, 10]
+    assert sorted(env["sent"]) == sorted(c["id"] for c in env["chats"])
+    # 12 чатов по 100 мс параллельно — гораздо быстрее, чем 1.2 с последовательно
+    assert elapsed < 0.8
+    assert main_module.poller_stats["backlog"] == 12
+    assert main_module.poller_stats["replied"] == 12
+
+
+@pytest.mark.asyncio
+async def test_poller_respects_per_chat_timeout(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": "fast"}, {"id": "slow"}]
+    monkeypatch.setattr(main_module.app_settings, "poller_chat_timeout", 0.2)
+
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        if "slow" in user_message:
+            await asyncio.sleep(0.5)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    timed_out = main_module.metrics.counter("poller.chats_timed_out")
+    await main_module.avito_auto_poller()
+
+    assert env["sent"] == ["fast"]
+    assert main_module.metrics.counter("poller.chats_timed_out") == timed_out + 1
+
+
+@pytest.mark.asyncio
+async def test_poller_stops_at_tick_deadline(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": f"chat_{i}"} for i in range(4)]
+    monkeypatch.setattr(main_module.app_settings, "poller_concurrency", 1)
+    monkeypatch.setattr(main_module.app_settings, "poller_tick_deadline", 0.25)
+
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        await asyncio.sleep(0.1)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    await main_module.avito_auto_poller()
+    await asyncio.sleep(0.3)  # отменённые задачи не должны досылать ответы
+
+    assert 0 < len(env["sent"]) < 4
+    assert main_module.poller_stats["unfinished"] == 4 - len(env["sent"])
+
+
+@pytest.mark.asyncio
+async def test_poller_skips_chats_whose_cursor_did_not_move(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": "chat_1"}]
+    calls = []
+
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        calls.append(user_message)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    await main_module.avito_auto_poller()
+    assert env["sent"] == ["chat_1"]
+    assert main_module.chat_state.get_last_message_id("chat_1") == "chat_1_m1"
+
+    # Новых сообщений нет — ни запроса сообщений, ни LLM, ни повторного ответа
+    await main_module.avito_auto_poller()
+    assert env["fetched"] == [("chat_1", None)]
+    assert calls == ["Вопрос из chat_1"]
+    assert env["sent"] == ["chat_1"]
+
+
+@pytest.mark.asyncio
+async def test_poller_fetches_only_messages_after_cursor(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": "chat_1"}]
+    main_module.chat_state.set_last_message_id("chat_1", "m1")
+    # Avito вернул и старое сообщение — оно должно быть отрезано по курсору
+    env["messages"]["chat_1"] = [
+        {"id": "m1", "direction": "in", "content": {"text": "Старый вопрос"}},
+        {"id": "m2", "direction": "out", "content": {"text": "Старый ответ"}},
+        {"id": "m3", "direction": "in", "content": {"text": "Новый вопрос"}},
+    ]
+    calls = []
+
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        calls.append(user_message)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    await main_module.avito_auto_poller()
+
+    assert env["fetched"] == [("chat_1", "m1")]
+    assert calls == ["Новый вопрос"]
+    assert main_module.chat_state.get_last_message_id("chat_1") == "m3"
+
+
+@pytest.mark.asyncio
+async def test_poller_keeps_cursor_when_send_fails(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": "chat_1"}]
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    async def failing_send(chat_id, text, access_token, account_id=None):
+        raise RuntimeError("avito down")
+
+    monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", failing_send)
+
+    await main_module.avito_auto_poller()
+
+    # Курсор не сдвинулся — сообщение обработаем в следующий тик
+    assert main_module.chat_state.get_last_message_id("chat_1") is None
+
+
+@pytest.mark.asyncio
+async def test_poller_advances_cursor_after_partial_reply_on_timeout(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": "chat_1"}]
+    project = Project(id="default", name="Test", business_type="goods", stream_replies=True)
+    monkeypatch.setattr(main_module.project_store, "get_project", lambda project_id: project)
+    monkeypatch.setattr(main_module.app_settings, "poller_chat_timeout", 0.2)
+
+    async def astream_reply(user_message: str, system_prompt: str | None = None, history=None):
+        yield "Да, телескоп в наличии. "
+        yield "Доставка"
+        await asyncio.sleep(1)  # поток завис — сработает таймаут чата
+        yield " есть."
+
+    monkeypatch.setattr(main_module.perplexity_client, "astream_reply", astream_reply)
+
+    await main_module.avito_auto_poller()
+    # Первое предложение уже у клиента — курсор сдвинут, ответ записан в историю
+    assert env["sent"] == ["chat_1"]
+    assert main_module.chat_state.get_last_message_id("chat_1") == "chat_1_m1"
+    assert [turn.text for turn in main_module.conversation_store.recent("chat_1", 5)] == [
+        "Вопрос из chat_1",
+        "Да, телескоп в наличии.",
+    ]
+
+    # Следующий тик не отвечает на то же сообщение ещё раз
+    await main_module.avito_auto_poller()
+    assert env["sent"] == ["chat_1"]
+
+
+@pytest.mark.asyncio
+async def test_losing_leadership_cancels_running_tick(poller_env, monkeypatch):
+    main_module, env = poller_env
+    env["chats"] = [{"id": f"chat_{i}"} for i in range(3)]
+    monkeypatch.setattr(main_module.app_settings, "poller_concurrency", 1)
+    monkeypatch.setattr(main_module.scheduler, "pause", lambda: None)
+
+    async def generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        await asyncio.sleep(0.1)
+        return "Ответ"
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", generate_reply)
+
+    tick = asyncio.create_task(main_module.avito_auto_poller())
+    await asyncio.sleep(0.15)
+    await main_module._on_leader_lost()
+
+    assert tick.done()
+    sent = list(env["sent"])
+    await asyncio.sleep(0.3)  # отменённая итерация не досылает ответы
+    assert env["sent"] == sent
+    assert len(sent) < 3
+    assert not main_module._poller_ticks
+
+
+@pytest.mark.asyncio
+async def test_deferred_poller_is_capped_and_reset(monkeypatch):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+    from app import main as main_module
+
+    scheduler = AsyncIOScheduler()
+    monkeypatch.setattr(main_module, "scheduler", scheduler)
+    scheduler.add_job(main_module.avito_auto_poller, "interval", seconds=30, id=main_module.POLLER_JOB_ID)
+    scheduler.start(paused=True)
+    try:
+        now = datetime.now(timezone.utc)
+        # Ближайшее открытие через два дня — спим не дольше poller_max_defer_seconds
+        main_module._defer_poller_until(now + timedelta(days=2))
+        job = scheduler.get_job(main_module.POLLER_JOB_ID)
+        assert job.next_run_time <= now + timedelta(seconds=main_module.app_settings.poller_max_defer_seconds + 1)
+        assert job.next_run_time > now + timedelta(seconds=60)
+
+        # Правка проекта или новый аккаунт возвращают обычный интервал
+        main_module._reset_poller_schedule()
+        assert scheduler.get_job(main_module.POLLER_JOB_ID).next_run_time <= now + timedelta(seconds=31)
+    finally:
+        scheduler.shutdown(wait=False)
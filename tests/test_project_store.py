@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+from pydantic import ValidationError
+
+from app.projects.models import Project
+from app.projects.store import ProjectStore
+
+
+def make_project(project_id: str = "default", **kwargs) -> Project:
+    return Project(id=project_id, name="Test", business_type="goods", **kwargs)
+
+
+def test_project_store_upsert_and_get(tmp_path):
+    store = ProjectStore(path=str(tmp_path / "projects.json"))
+    store.upsert_project(make_project(tone="formal"))
+
+    loaded = store.get_project("default")
+    assert loaded is not None
+    assert loaded.tone == "formal"
+    assert store.get_project("missing") is None
+
+    # Проект сохранён на диск
+    with open(tmp_path / "projects.json", encoding="utf-8") as f:
+        assert json.load(f)["default"]["tone"] == "formal"
+
+
+def test_project_store_returns_cached_object_without_io(tmp_path, monkeypatch):
+    store = ProjectStore(path=str(tmp_path / "projects.json"), check_interval=60)
+    store.upsert_project(make_project())
+    first = store.get_project("default")
+
+    def fail_load():
+        raise AssertionError("cached read must not touch the file")
+
+    monkeypatch.setattr(store, "_load_all", fail_load)
+    monkeypatch.setattr(store, "_file_signature", fail_load)
+
+    assert store.get_project("default") is first
+
+
+def test_project_store_upsert_invalidates_cache(tmp_path):
+    store = ProjectStore(path=str(tmp_path / "projects.json"), check_interval=60)
+    store.upsert_project(make_project(tone="friendly"))
+    assert store.get_project("default").tone == "friendly"
+
+    store.upsert_project(make_project(tone="neutral"))
+    assert store.get_project("default").tone == "neutral"
+
+
+def test_project_store_picks_up_external_file_change(tmp_path):
+    path = tmp_path / "projects.json"
+    store = ProjectStore(path=str(path), check_interval=0)
+    store.upsert_project(make_project(tone="friendly"))
+    assert store.get_project("default").tone == "friendly"
+
+    # Файл переписали снаружи (другой процесс / руками)
+    data = {"default": make_project(tone="formal").model_dump(mode="json")}
+    tmp_file = tmp_path / "projects.json.new"
+    tmp_file.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp_file, path)
+
+    assert store.get_project("default").tone == "formal"
+
+
+def test_project_is_immutable():
+    project = make_project()
+    with pytest.raises(ValidationError):
+        project.name = "Changed"
@@ -104,3 +104,109 @@ def test_build_system_prompt_unknown_business_type():
     
     assert "Avito" in prompt
     assert "вежливо" in prompt or "клиентов" in prompt
+
+
+def test_build_system_prompt_static_prefix_is_stable():
+    """Префикс проекта одинаков при разном контексте объявления"""
+    from app.prompts import build_static_prefix
+
+    project = Project(id="test", name="Test", business_type="goods")
+
+    prefix = build_static_prefix(project)
+    prompt_a = build_system_prompt(project, item_context="Название: iPhone 13")
+    prompt_b = build_system_prompt(project, item_context="Название: Samsung S21")
+
+    assert prompt_a.startswith(prefix)
+    assert prompt_b.startswith(prefix)
+    assert prompt_a != prompt_b
+
+
+def test_build_system_prompt_is_cached_per_project_revision():
+    """Промпт берётся из кэша, пока проект не изменился"""
+    from app.prompts import prompt_cache
+
+    project = Project(id="cached", name="Test", business_type="goods", tone="formal")
+
+    first = build_system_prompt(project, item_context="ctx")
+    hits = prompt_cache.hits
+    assert build_system_prompt(project, item_context="ctx") is first
+    assert prompt_cache.hits == hits + 1
+
+    # Новая версия проекта с тем же id — новый промпт
+    changed = Project(id="cached", name="Test", business_type="goods", tone="friendly")
+    changed_prompt = build_system_prompt(changed, item_context="ctx")
+    assert "дружелюбно" in changed_prompt
+    assert "формальный" not in changed_prompt
+
+
+def test_token_estimator_counts_and_calibrates():
+    """Оценка токенов: кириллица дороже латиницы, калибровка двигает множитель"""
+    from app.token_estimator import TokenEstimator
+
+    estimator = TokenEstimator(calibration_weight=0.5)
+    assert estimator.count("") == 0
+    assert estimator.count("телескоп" * 10) > estimator.count("telescope" * 10)
+
+    estimated = estimator.count("Телескоп ещё продаётся?")
+    estimator.calibrate(estimated, estimated * 2)
+    assert estimator.count("Телескоп ещё продаётся?") > estimated
+
+
+def test_assemble_prompt_fits_budget_without_trimming():
+    """Запрос в бюджете уходит целиком"""
+    from app.conversation import ASSISTANT, USER, Turn
+    from app.prompts import assemble_prompt
+
+    project = Project(id="budget", name="Test", business_type="goods", extra_instructions="Доставка по РФ")
+    history = [Turn(USER, "Здравствуйте"), Turn(ASSISTANT, "Добрый день")]
+
+    prompt = assemble_prompt(project, "Актуально?", history, item_context="Название: Телескоп", budget=10_000)
+
+    assert prompt.history == tuple(history)
+    assert prompt.system_prompt == build_system_prompt(project, item_context="Название: Телескоп")
+    assert prompt.input_tokens < 10_000
+    assert (prompt.dropped_turns, prompt.description_trimmed, prompt.extras_dropped) == (0, False, False)
+
+
+def test_assemble_prompt_trims_history_then_description_then_extras():
+    """Урезание по приоритету: старая история, описание, указания владельца"""
+    from app.conversation import USER, Turn
+    from app.prompts import assemble_prompt
+
+    project = Project(
+        id="budget_trim",
+        name="Test",
+        business_type="goods",
+        extra_instructions="Всегда уточняй город доставки. " * 20,
+    )
+    history = [Turn(USER, f"Сообщение номер {i} " * 10) for i in range(6)]
+    item_context = "Название: Телескоп\nОписание: " + "Отличный телескоп для наблюдений за планетами. " * 30
+
+    full = assemble_prompt(project, "Актуально?", history, item_context=item_context, budget=100_000)
+
+    # Бюджет чуть меньше полного запроса — достаточно выбросить старые реплики
+    only_history = assemble_prompt(
+        project, "Актуально?", history, item_context=item_context, budget=full.input_tokens - 50
+    )
+    assert 0 < only_history.dropped_turns < len(history)
+    assert only_history.history == tuple(history[only_history.dropped_turns:])
+    assert not only_history.description_trimmed
+    assert only_history.input_tokens <= only_history.budget
+
+    # Без истории и с коротким описанием — влезает, указания владельца остаются
+    no_history = assemble_prompt(project, "Актуально?", [], item_context=item_context, budget=full.input_tokens)
+    without_history_budget = no_history.input_tokens - 100
+    trimmed = assemble_prompt(project, "Актуально?", history, item_context=item_context, budget=without_history_budget)
+    assert trimmed.dropped_turns == len(history)
+    assert trimmed.description_trimmed
+    assert not trimmed.extras_dropped
+    assert "Название: Телескоп" in trimmed.system_prompt
+    assert "Всегда уточняй город доставки" in trimmed.system_prompt
+    assert trimmed.input_tokens <= trimmed.budget
+
+    # Совсем маленький бюджет — уходят и указания владельца, роль и правила остаются
+    tiny = assemble_prompt(project, "Актуально?", history, item_context=item_context, budget=50)
+    assert tiny.extras_dropped
+    assert "Всегда уточняй город доставки" not in tiny.system_prompt
+    assert "Общие правила" in tiny.system_prompt
+    assert tiny.input_tokens > tiny.budget
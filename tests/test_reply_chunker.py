@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from app.projects.models import Project
+from app.reply_chunker import ReplyChunker
+from app.semantic_cache import SemanticCache
+
+
+def feed_all(chunker: ReplyChunker, deltas):
+    ready = []
+    for delta in deltas:
+        ready.extend(chunker.feed(delta))
+    return ready
+
+
+def test_chunker_emits_first_sentence_as_soon_as_it_is_complete():
+    chunker = ReplyChunker()
+
+    assert chunker.feed("Здравствуйте! ") == []
+    assert chunker.feed("Да, товар ещё ") == ["Здравствуйте!"]
+    assert chunker.feed("в наличии. Забрать можно у метро.") == []
+    assert chunker.flush() == "Да, товар ещё в наличии. Забрать можно у метро."
+
+
+def test_chunker_waits_for_whitespace_after_punctuation_and_min_length():
+    chunker = ReplyChunker(min_first_chars=10)
+
+    # "3." — ещё не конец предложения, "Да." — слишком коротко для отдельного сообщения
+    assert feed_all(chunker, ["Да. Цена 3", ".5 тыс. руб", "лей, торг уместен. ", "Пишите!"]) == [
+        "Да. Цена 3.5 тыс. рублей, торг уместен."
+    ]
+    assert chunker.flush() == "Пишите!"
+
+
+def test_chunker_sends_rest_by_paragraphs():
+    chunker = ReplyChunker()
+    ready = feed_all(chunker, ["Первое предложение. Ещё текст.\n\nВторой абзац.\n\n", "Третий абзац"])
+
+    assert ready == ["Первое предложение.", "Ещё текст.", "Второй абзац."]
+    assert chunker.flush() == "Третий абзац"
+    assert chunker.text == "Первое предложение. Ещё текст.\n\nВторой абзац.\n\nТретий абзац"
+
+
+@pytest.mark.asyncio
+async def test_streaming_reply_sends_first_sentence_before_stream_ends(monkeypatch, tmp_path):
+    from app import main as main_module
+
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path)))
+    main_module.answer_cache.purge()
+    project = Project(id="stream", name="Test", business_type="goods", stream_replies=True)
+
+    release = asyncio.Event()
+
+    async def mock_astream_reply(user_message: str, system_prompt: str | None = None, history=None):
+        yield "Да, товар в наличии. Заб"
+        await release.wait()
+        yield "рать можно сегодня."
+
+    monkeypatch.setattr(main_module.perplexity_client, "astream_reply", mock_astream_reply)
+
+    sent = []
+
+    async def send(text: str) -> None:
+        sent.append(text)
+        release.set()
+
+    generated = []
+    await main_module.send_reply_parts(
+        main_module.reply_parts(project, "Ещё актуально?", "prompt"),
+        send,
+        "test_stream",
+        generated,
+    )
+
+    assert sent == ["Да, товар в наличии.", "Забрать можно сегодня."]
+    assert main_module.metrics.snapshot()["timings"]["test_stream.time_to_first_message"]["count"] == 1
+    # Полный ответ попал в кэш — повтор уходит одним сообщением без LLM
+    assert main_module.answer_cache.get("stream", "prompt", "Ещё актуально?") == (
+        "Да, товар в наличии. Забрать можно сегодня."
+    )
+    main_module.answer_cache.purge()
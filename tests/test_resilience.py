@@ -0,0 +1,258 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.clients.avito_client import AvitoClientError, AvitoMessengerClient
+from app.clients.avito_rate_limiter import AvitoRateLimiter
+from app.clients.http_transport import HttpTransport
+from app.clients.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    Resilience,
+    ResilienceRegistry,
+    RetryBudget,
+    classify_error,
+)
+
+
+def make_resilience(**kwargs) -> Resilience:
+    breaker = CircuitBreaker(
+        "test",
+        failure_threshold=kwargs.pop("failure_threshold", 5),
+        recovery_timeout=kwargs.pop("recovery_timeout", 30.0),
+    )
+    kwargs.setdefault("base_delay", 0)
+    return Resilience("test", breaker=breaker, **kwargs)
+
+
+def failing(exc: Exception, calls: list):
+    async def fn():
+        calls.append(1)
+        raise exc
+    return fn
+
+
+def status_error(status_code: int) -> AvitoClientError:
+    return AvitoClientError(f"status {status_code}", status_code=status_code)
+
+
+def test_classify_error_walks_cause_chain():
+    request = httpx.Request("POST", "https://api.avito.test")
+    try:
+        try:
+            raise httpx.ConnectError("refused", request=request)
+        except httpx.ConnectError as exc:
+            raise AvitoClientError("Failed to call Avito API") from exc
+    except AvitoClientError as wrapped:
+        assert classify_error(wrapped) == (True, False)
+
+    assert classify_error(httpx.ReadTimeout("slow", request=request)) == (True, True)
+    assert classify_error(status_error(503)) == (True, True)
+    assert classify_error(status_error(404)) == (False, True)
+    assert classify_error(ValueError("bad json")) == (False, True)
+
+
+@pytest.mark.asyncio
+async def test_idempotent_call_is_retried_until_success():
+    resilience = make_resilience(max_attempts=3)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise status_error(502)
+        return "ok"
+
+    assert await resilience.call(flaky) == "ok"
+    assert len(calls) == 3
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+    assert resilience.breaker.consecutive_failures == 0
+
+
+@pytest.mark.asyncio
+async def test_non_idempotent_call_is_retried_only_when_not_sent():
+    request = httpx.Request("POST", "https://api.avito.test")
+    resilience = make_resilience(max_attempts=3)
+
+    calls = []
+    with pytest.raises(httpx.ReadTimeout):
+        await resilience.call(failing(httpx.ReadTimeout("slow", request=request), calls), idempotent=False)
+    assert len(calls) == 1
+
+    calls = []
+    with pytest.raises(AvitoClientError):
+        await resilience.call(failing(status_error(500), calls), idempotent=False)
+    assert len(calls) == 1
+
+    calls = []
+    with pytest.raises(httpx.ConnectError):
+        await resilience.call(failing(httpx.ConnectError("refused", request=request), calls), idempotent=False)
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried_and_do_not_open_circuit():
+    resilience = make_resilience(failure_threshold=2)
+    calls = []
+
+    for _ in range(5):
+        with pytest.raises(AvitoClientError):
+            await resilience.call(failing(status_error(400), calls))
+
+    assert len(calls) == 5
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_fails_fast_and_recovers_after_probe():
+    resilience = make_resilience(max_attempts=1, failure_threshold=3, recovery_timeout=0.05)
+    calls = []
+
+    for _ in range(3):
+        with pytest.raises(AvitoClientError):
+            await resilience.call(failing(status_error(503), calls))
+    assert resilience.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        await resilience.call(failing(status_error(503), calls))
+    assert len(calls) == 3
+
+    await asyncio.sleep(0.06)
+    # Пробный запрос неудачен — цепь снова разомкнута
+    with pytest.raises(AvitoClientError):
+        await resilience.call(failing(status_error(503), calls))
+    assert resilience.breaker.state == CircuitBreaker.OPEN
+    assert len(calls) == 4
+
+    await asyncio.sleep(0.06)
+
+    async def ok():
+        return "ok"
+
+    assert await resilience.call(ok) == "ok"
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_through_a_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    breaker.before_call()
+    breaker.before_call()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_probe_releases_the_slot():
+    resilience = make_resilience(max_attempts=1, failure_threshold=1, recovery_timeout=0)
+    resilience.breaker.record_failure()
+    assert resilience.breaker.state == CircuitBreaker.OPEN
+
+    started = asyncio.Event()
+
+    async def hanging():
+        started.set()
+        await asyncio.sleep(10)
+
+    probe = asyncio.create_task(resilience.call(hanging))
+    await started.wait()
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    # Отменённая проба не держит цепь: следующий вызов снова пробует зависимость
+    async def ok():
+        return "ok"
+
+    assert await resilience.call(ok) == "ok"
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_caps_retries():
+    resilience = make_resilience(
+        max_attempts=5,
+        failure_threshold=100,
+        budget=RetryBudget(ratio=0.0, min_retries=2, window=60),
+    )
+    calls = []
+
+    with pytest.raises(AvitoClientError):
+        await resilience.call(failing(status_error(503), calls))
+    assert len(calls) == 3  # первая попытка + 2 повтора из бюджета
+
+    calls = []
+    with pytest.raises(AvitoClientError):
+        await resilience.call(failing(status_error(503), calls))
+    assert len(calls) == 1  # бюджет исчерпан
+
+
+@pytest.mark.asyncio
+async def test_avito_client_retries_get_but_not_post_on_5xx():
+    calls = {"GET": 0, "POST": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls[request.method] += 1
+        if calls[request.method] == 1:
+            return httpx.Response(503, text="unavailable")
+        return httpx.Response(200, json={"chats": []})
+
+    client = AvitoMessengerClient(
+        base_url="https://api.avito.test",
+        transport=HttpTransport(transport=httpx.MockTransport(handler)),
+        rate_limiter=AvitoRateLimiter(),
+        resilience=make_resilience(),
+    )
+
+    assert await client.get_chats("TOKEN", account_id="42") == []
+    assert calls["GET"] == 2
+
+    with pytest.raises(AvitoClientError) as exc_info:
+        await client.send_text_message("chat-1", "Здравствуйте", "TOKEN", account_id="42")
+    assert exc_info.value.status_code == 503
+    assert calls["POST"] == 1
+
+
+@pytest.mark.asyncio
+async def test_avito_client_open_circuit_raises_domain_error():
+    client = AvitoMessengerClient(
+        base_url="https://api.avito.test",
+        transport=HttpTransport(transport=httpx.MockTransport(lambda request: httpx.Response(500))),
+        rate_limiter=AvitoRateLimiter(),
+        resilience=make_resilience(max_attempts=1, failure_threshold=1),
+    )
+
+    with pytest.raises(AvitoClientError):
+        await client.get_account_info("TOKEN")
+    with pytest.raises(AvitoClientError, match="unavailable"):
+        await client.get_account_info("TOKEN")
+
+
+def test_admin_resilience_endpoints(monkeypatch):
+    from app import main as main_module
+
+    registry = ResilienceRegistry()
+    registry.get("avito_api").breaker.record_failure()
+    registry.get("avito_api").breaker.state = CircuitBreaker.OPEN
+    monkeypatch.setattr(main_module, "resilience_registry", registry)
+    client = TestClient(main_module.app)
+    auth = (main_module.ADMIN_USERNAME, main_module.ADMIN_PASSWORD)
+
+    response = client.get("/admin/resilience", auth=auth)
+    assert response.status_code == 200
+    assert response.json()["avito_api"]["state"] == "open"
+
+    response = client.post("/admin/resilience/avito_api/reset", auth=auth)
+    assert response.status_code == 200
+    assert response.json()["state"] == "closed"
+    assert registry.get("avito_api").breaker.state == CircuitBreaker.CLOSED
+
+    assert client.post("/admin/resilience/unknown/reset", auth=auth).status_code == 404
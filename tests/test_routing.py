@@ -0,0 +1,151 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.conversation import ConversationStore
+from app.projects.models import Project
+from app.projects.store import ProjectStore
+from app.routing import AccountRouter
+from app.schemas_avito import AvitoWebhook
+from app.semantic_cache import SemanticCache
+from app.token_store import AvitoTokenStore, AvitoTokens
+
+
+def make_project(project_id: str, account_id: str | None = None, **kwargs) -> Project:
+    return Project(id=project_id, name=project_id, business_type="goods", avito_account_id=account_id, **kwargs)
+
+
+def make_tokens(access_token: str, account_id: str | None) -> AvitoTokens:
+    return AvitoTokens(
+        access_token=access_token,
+        refresh_token=f"R_{access_token}",
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        account_id=account_id,
+    )
+
+
+def make_router(tmp_path, check_interval: float = 60.0):
+    projects = ProjectStore(path=str(tmp_path / "projects.json"), check_interval=check_interval)
+    tokens = AvitoTokenStore(path=str(tmp_path / "tokens.json"))
+    return AccountRouter(projects, tokens), projects, tokens
+
+
+def test_token_store_keeps_first_account_as_default(tmp_path):
+    store = AvitoTokenStore(path=str(tmp_path / "tokens.json"))
+    store.save_tokens(make_tokens("A", "100"))
+    store.save_tokens(make_tokens("B", "200"))
+    store.save_tokens(make_tokens("A2", "100"))
+
+    assert store.get_default_tokens().access_token == "A2"
+    assert store.get_tokens("100").access_token == "A2"
+    assert store.get_tokens("200").access_token == "B"
+    assert store.get_tokens("300") is None
+    assert sorted(t.account_id for t in store.list_tokens()) == ["100", "200"]
+
+    with open(tmp_path / "tokens.json", encoding="utf-8") as f:
+        assert sorted(json.load(f)) == ["200", "default"]
+
+
+def test_router_builds_index_and_falls_back_to_default(tmp_path):
+    router, projects, tokens = make_router(tmp_path)
+    projects.upsert_project(make_project("default"))
+    projects.upsert_project(make_project("cars", "100"))
+    tokens.save_tokens(make_tokens("DEFAULT", None))
+    tokens.save_tokens(make_tokens("CARS", "100"))
+
+    route = router.route("100")
+    assert route.project.id == "cars"
+    assert route.account_id == "100"
+
+    # Непривязанный аккаунт без своих токенов — проект и токены "default"
+    route = router.route("999")
+    assert route.project.id == "default"
+    assert route.account_id is None
+    assert router.stats() == {"accounts": 1, "rebuilds": 1, "fallbacks": 1}
+
+
+def test_router_follows_upserts_without_rebuild(tmp_path):
+    router, projects, _ = make_router(tmp_path)
+    projects.upsert_project(make_project("default"))
+    assert router.route("100").project.id == "default"
+
+    projects.upsert_project(make_project("cars", "100"))
+    projects.upsert_project(make_project("cars", "100", tone="formal"))
+    assert router.route("100").project.tone == "formal"
+    assert router.stats()["rebuilds"] == 1
+
+    # Перепривязка проекта на другой аккаунт освобождает старый
+    projects.upsert_project(make_project("cars", "200"))
+    assert router.route("100").project.id == "default"
+    assert router.route("200").project.id == "cars"
+
+
+def test_router_rebuilds_after_external_file_change(tmp_path):
+    router, projects, _ = make_router(tmp_path, check_interval=0)
+    projects.upsert_project(make_project("default"))
+    assert router.project_id_for("100") is None
+
+    raw = {
+        "default": make_project("default").model_dump(mode="json"),
+        "cars": make_project("cars", "100").model_dump(mode="json"),
+    }
+    with open(tmp_path / "projects.json", "w", encoding="utf-8") as f:
+        json.dump(raw, f, indent=4)
+
+    assert router.project_id_for("100") == "cars"
+
+
+@pytest.mark.asyncio
+async def test_webhook_is_answered_from_the_account_it_was_sent_to(monkeypatch, tmp_path):
+    from app import main as main_module
+
+    router, projects, tokens = make_router(tmp_path)
+    projects.upsert_project(make_project("default"))
+    projects.upsert_project(make_project("cars", "200", extra_instructions="Продаём авто"))
+    tokens.save_tokens(make_tokens("ACCESS_100", "100"))
+    tokens.save_tokens(make_tokens("ACCESS_200", "200"))
+    monkeypatch.setattr(main_module, "account_router", router)
+    monkeypatch.setattr(main_module, "avito_token_store", tokens)
+    monkeypatch.setattr(main_module.avito_auth_client, "token_store", tokens)
+    monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+    monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+    main_module.answer_cache.purge()
+
+    prompts = []
+    sent = []
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        prompts.append(system_prompt)
+        return "Ответ"
+
+    async def mock_send_text_message(chat_id: str, text: str, access_token: str, account_id=None) -> None:
+        sent.append((access_token, account_id))
+
+    monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
+    monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", mock_send_text_message)
+
+    webhook = AvitoWebhook(**{
+        "id": "wh_routed",
+        "version": 1,
+        "timestamp": "2025-01-01T12:00:00Z",
+        "payload": {
+            "type": "message",
+            "value": {
+                "id": "msg_routed",
+                "chat_id": "chat_7",
+                "user_id": 200,
+                "author_id": "buyer_1",
+                "created": "2025-01-01T12:00:00Z",
+                "type": "text",
+                "content": {"text": "Машина ещё продаётся?"},
+            },
+        },
+    })
+
+    data = await main_module.process_avito_webhook(webhook)
+    main_module.answer_cache.purge()
+
+    assert data["assistant_reply"] == "Ответ"
+    assert sent == [("ACCESS_200", "200")]
+    assert "Продаём авто" in prompts[0]
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+from app.projects.models import Project, TimeRange, WeeklySchedule
+from app.projects.schedule import compile_schedule
+
+
+def make_project(timezone_name: str = "UTC", **days) -> Project:
+    return Project(
+        id="test",
+        name="Test",
+        business_type="services",
+        timezone=timezone_name,
+        schedule_mode="by_schedule",
+        schedule=WeeklySchedule(**days),
+    )
+
+
+def utc(day: int, hour: int, minute: int = 0) -> datetime:
+    # 2025-01-06 — понедельник
+    return datetime(2025, 1, 6 + day, hour, minute, tzinfo=timezone.utc)
+
+
+def test_schedule_always_mode_is_open():
+    project = Project(id="test", name="Test", business_type="services")
+    schedule = compile_schedule(project)
+
+    assert schedule.is_open(utc(0, 3))
+    assert schedule.next_transition(utc(0, 3)) is None
+
+
+def test_schedule_day_range_includes_end_minute():
+    project = make_project(mon=[TimeRange(start="09:00", end="18:00")])
+    schedule = compile_schedule(project)
+
+    assert not schedule.is_open(utc(0, 8, 59))
+    assert schedule.is_open(utc(0, 9, 0))
+    assert schedule.is_open(utc(0, 18, 0))
+    assert not schedule.is_open(utc(0, 18, 1))
+    assert not schedule.is_open(utc(1, 10))
+
+
+def test_schedule_overnight_range_crosses_midnight_and_week_end():
+    project = make_project(sun=[TimeRange(start="22:00", end="02:00")])
+    schedule = compile_schedule(project)
+
+    assert schedule.is_open(utc(6, 23))        # воскресенье 23:00
+    assert schedule.is_open(utc(7, 1, 30))     # понедельник 01:30 следующей недели
+    assert not schedule.is_open(utc(7, 2, 1))
+    assert not schedule.is_open(utc(6, 21, 59))
+
+
+def test_schedule_next_transition():
+    project = make_project(
+        mon=[TimeRange(start="09:00", end="18:00")],
+        wed=[TimeRange(start="10:00", end="12:00")],
+    )
+    schedule = compile_schedule(project)
+
+    # Открыто — следующий переход это закрытие после 18:00
+    assert schedule.next_transition(utc(0, 12, 30)) == utc(0, 18, 1)
+    # Закрыто — следующий переход это открытие в среду
+    assert schedule.next_transition(utc(0, 20)) == utc(2, 10)
+    # После последнего интервала недели — заворачиваемся на понедельник
+    assert schedule.next_transition(utc(4, 10)) == utc(7, 9)
+
+
+def test_schedule_uses_project_timezone():
+    project = make_project("Europe/Moscow", mon=[TimeRange(start="09:00", end="18:00")])
+    schedule = compile_schedule(project)
+
+    # 06:00 UTC = 09:00 MSK
+    assert schedule.is_open(utc(0, 6))
+    assert not schedule.is_open(utc(0, 5, 59))
+    assert schedule.next_transition(utc(0, 5, 30)) == utc(0, 6)
+
+
+def test_schedule_is_compiled_once_per_project_version():
+    project = make_project(mon=[TimeRange(start="09:00", end="18:00")])
+    assert compile_schedule(project) is compile_schedule(project)
+
+    changed = make_project(mon=[TimeRange(start="10:00", end="18:00")])
+    assert compile_schedule(changed) is not compile_schedule(project)
+    assert not compile_schedule(changed).is_open(utc(0, 9, 30))
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.semantic_cache import NgramVectorizer, SemanticCache
+
+
+def test_vectorizer_is_normalized_and_deterministic():
+    vectorizer = NgramVectorizer(dim=256)
+    first = vectorizer.transform("Ещё актуально?")
+    second = vectorizer.transform("еще   АКТУАЛЬНО")
+
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert np.allclose(first, second)
+
+
+def test_semantic_cache_matches_near_duplicate_questions(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path))
+    cache.put("p1", "prompt", "Есть доставка в Москву?", "Да, доставляем")
+    cache.put("p1", "prompt", "Торг уместен?", "Нет")
+
+    assert cache.get("p1", "prompt", "Доставка в Москву есть?") == "Да, доставляем"
+    assert cache.get("p1", "prompt", "Сколько стоит?") is None
+    # Другой проект или изменившийся промпт — промах
+    assert cache.get("p2", "prompt", "Доставка в Москву есть?") is None
+    assert cache.get("p1", "new prompt", "Доставка в Москву есть?") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_semantic_cache_evicts_least_recently_used(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path), capacity=2)
+    cache.put("p", "prompt", "Есть доставка в Москву?", "A")
+    cache.put("p", "prompt", "Какой размер у куртки?", "B")
+    assert cache.get("p", "prompt", "Есть доставка в Москву") == "A"
+
+    cache.put("p", "prompt", "Можно забрать сегодня вечером?", "C")
+
+    assert cache.get("p", "prompt", "Какой размер у куртки?") is None
+    assert cache.get("p", "prompt", "Есть доставка в Москву?") == "A"
+    assert cache.stats()["size"] == 2
+
+
+def test_semantic_cache_survives_restart(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path))
+    cache.put("p", "prompt", "Есть доставка в Москву?", "Да")
+
+    restored = SemanticCache(directory=str(tmp_path))
+    assert restored.get("p", "prompt", "Доставка в Москву есть?") == "Да"
+
+
+def test_semantic_cache_keeps_answers_per_prompt(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path))
+    cache.put("p", "prompt A", "Есть доставка в Москву?", "Да")
+    cache.put("p", "prompt B", "Торг уместен?", "Нет")
+    cache.put("p", "prompt B", "Есть доставка в Москву?", "Только самовывоз")
+
+    # Ответ под другим промптом не отдаётся, но и не стирается
+    assert cache.stats()["size"] == 3
+    assert cache.get("p", "prompt A", "Доставка в Москву есть?") == "Да"
+    assert cache.get("p", "prompt B", "Доставка в Москву есть?") == "Только самовывоз"
+    assert cache.get("p", "prompt A", "Торг уместен?") is None
+
+    restored = SemanticCache(directory=str(tmp_path))
+    assert restored.get("p", "prompt B", "Торг уместен?") == "Нет"
+    assert restored.get("p", "prompt A", "Торг уместен?") is None
+
+
+def test_semantic_cache_reads_legacy_metadata(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path))
+    cache.put("p", "prompt", "Есть доставка в Москву?", "Да")
+    meta_path = tmp_path / "p.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    # Формат до хэша на строку: один prompt_hash на индекс
+    meta = {"prompt_hash": meta["rows"][0][3], "rows": [row[:3] for row in meta["rows"]]}
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+    restored = SemanticCache(directory=str(tmp_path))
+    assert restored.get("p", "prompt", "Доставка в Москву есть?") == "Да"
+
+
+@pytest.mark.parametrize("project_id", ["p", None])
+def test_semantic_cache_purge(tmp_path, project_id):
+    cache = SemanticCache(directory=str(tmp_path))
+    cache.put("p", "prompt", "Есть доставка в Москву?", "Да")
+
+    assert cache.purge(project_id) == 1
+    assert cache.get("p", "prompt", "Есть доставка в Москву?") is None
+    assert SemanticCache(directory=str(tmp_path)).get("p", "prompt", "Есть доставка в Москву?") is None
+
+
+def test_semantic_cache_purge_of_unknown_project_creates_nothing(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path / "cache"))
+
+    assert cache.purge("missing") == 0
+    assert not (tmp_path / "cache").exists()
+    assert cache.stats()["projects"] == 0
+
+
+def test_semantic_cache_keeps_limited_number_of_open_indexes(tmp_path):
+    cache = SemanticCache(directory=str(tmp_path), max_open_indexes=2)
+    cache.put("a", "prompt", "Есть доставка в Москву?", "Да")
+    cache.put("b", "prompt", "Есть доставка в Москву?", "Нет")
+    cache.get("a", "prompt", "Есть доставка в Москву?")
+    cache.put("c", "prompt", "Есть доставка в Москву?", "Может быть")
+
+    # Вытеснен давно не использованный "b", его записи остались на диске
+    assert list(cache._indexes) == ["a", "c"]
+    assert cache.get("b", "prompt", "Есть доставка в Москву?") == "Нет"
+    assert list(cache._indexes) == ["c", "b"]
+
+    # Невыгруженный индекс очищается без открытия
+    assert cache.purge("a") == 1
+    assert not (tmp_path / "a.npy").exists()
+    assert cache.get("a", "prompt", "Есть доставка в Москву?") is None
@@ -0,0 +1,138 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.chat_state import ChatState
+from app.projects.models import Project
+from app.storage.importer import import_json_data
+from app.storage.sqlite import MIGRATIONS, SqliteStorage
+from app.storage.stores import SqliteChatState, SqliteProjectStore, SqliteTokenStore
+from app.token_store import AvitoTokenStore, AvitoTokens
+
+
+def make_project(project_id: str = "default", **kwargs) -> Project:
+    return Project(id=project_id, name="Test", business_type="goods", **kwargs)
+
+
+def make_tokens(access_token: str, account_id: str | None = "42") -> AvitoTokens:
+    return AvitoTokens(
+        access_token=access_token,
+        refresh_token=f"R_{access_token}",
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        account_id=account_id,
+    )
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+def test_storage_migrates_schema_once_in_wal_mode(db_path):
+    storage = SqliteStorage(db_path)
+    assert storage.schema_version == len(MIGRATIONS)
+    assert storage.connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    storage.close()
+
+    # Повторное открытие не применяет миграции заново
+    reopened = SqliteStorage(db_path)
+    assert reopened.schema_version == len(MIGRATIONS)
+    reopened.close()
+
+
+def test_sqlite_project_store_sees_writes_from_another_worker(db_path):
+    first = SqliteProjectStore(SqliteStorage(db_path), check_interval=0)
+    second = SqliteProjectStore(SqliteStorage(db_path), check_interval=0)
+
+    first.upsert_project(make_project(tone="formal"))
+    assert second.get_project("default").tone == "formal"
+    version = second.version
+
+    first.upsert_project(make_project(tone="neutral"))
+    assert second.get_project("default").tone == "neutral"
+    assert second.version > version
+
+    row = first.storage.connection().execute("SELECT COUNT(*) FROM projects").fetchone()
+    assert row == (1,)
+
+
+def test_sqlite_token_store_keeps_account_keys_and_refreshes_cache(db_path):
+    first = SqliteTokenStore(SqliteStorage(db_path))
+    second = SqliteTokenStore(SqliteStorage(db_path))
+
+    first.save_tokens(make_tokens("A", "100"))
+    first.save_tokens(make_tokens("B", "200"))
+    assert second.get_tokens("200").access_token == "B"
+
+    # Токены обновил другой воркер — чтение сразу видит новые
+    second.save_tokens(make_tokens("A2", "100"))
+    assert first.get_default_tokens().access_token == "A2"
+    assert first.get_tokens("100").access_token == "A2"
+
+
+def test_sqlite_chat_state_flushes_batches_and_reads_by_key(db_path):
+    storage = SqliteStorage(db_path)
+    state = SqliteChatState(storage, flush_interval=60, batch_size=2)
+
+    state.set_last_message_id("chat_1", "msg_1")
+    # Пока значение в буфере, оно видно этому процессу, но не базе
+    assert state.get_last_message_id("chat_1") == "msg_1"
+    other = SqliteChatState(SqliteStorage(db_path), flush_interval=60)
+    assert other.get_last_message_id("chat_1") is None
+
+    state.set_last_message_id("chat_2", "msg_2")
+    assert other.get_last_message_id("chat_1") == "msg_1"
+
+    state.set_last_message_id("chat_1", "msg_3")
+    state.close()
+    assert other.get_last_message_id("chat_1") == "msg_3"
+    assert len(other) == 2
+    other.close()
+
+
+def test_sqlite_chat_state_concurrent_writers(db_path):
+    storage = SqliteStorage(db_path)
+    state = SqliteChatState(storage, flush_interval=60, batch_size=10)
+
+    def writer(n: int) -> None:
+        for i in range(100):
+            state.set_last_message_id(f"chat_{n}_{i}", f"msg_{i}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state.close()
+
+    assert len(SqliteChatState(SqliteStorage(db_path))) == 400
+
+
+def test_importer_moves_json_state_into_sqlite(tmp_path, db_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    with open(data_dir / "projects.json", "w", encoding="utf-8") as f:
+        json.dump({"default": make_project(avito_account_id="42").model_dump(mode="json")}, f)
+    AvitoTokenStore(path=str(data_dir / "avito_tokens.json")).save_default_tokens(make_tokens("ACCESS"))
+    chat_state = ChatState(path=str(data_dir / "chat_state.json"))
+    chat_state.set_last_message_id("chat_1", "msg_1")
+    chat_state.close()  # значение осталось только в журнале .log
+
+    storage = SqliteStorage(db_path)
+    assert import_json_data(storage, data_dir=str(data_dir)) == {
+        "projects": 1,
+        "avito_tokens": 1,
+        "chat_state": 1,
+    }
+    # Повторный запуск без --overwrite ничего не меняет
+    assert import_json_data(storage, data_dir=str(data_dir)) == {
+        "projects": 0,
+        "avito_tokens": 0,
+        "chat_state": 0,
+    }
+
+    assert SqliteProjectStore(storage).get_project("default").avito_account_id == "42"
+    assert SqliteTokenStore(storage).get_tokens("42").access_token == "ACCESS"
+    assert SqliteChatState(storage).get_last_message_id("chat_1") == "msg_1"
@@ -1,137 +1,241 @@
-import json
-
+import httpx
 import pytest
 
+from app.clients.http_transport import HttpTransport
+from app.clients.resilience import Resilience
+from app.transcription_cache import TranscriptionCache
 from app.clients.stt_client import STTClient, STTClientError
 
 
-class DummyResponse:
-    def __init__(self, status_code: int = 200, content: bytes = b"", text: str = "", json_data=None):
-        self.status_code = status_code
-        self.content = content
-        self._text = text
-        self._json_data = json_data
-
-    @property
-    def text(self) -> str:
-        return self._text
+AUDIO_URL = "https://example.com/audio.ogg"
 
-    def json(self):
-        if self._json_data is not None:
-            return self._json_data
-        return json.loads(self._text)
 
-
-def make_client_with_env(monkeypatch):
+def make_client_with_env(monkeypatch, speechkit_handler):
     """
     Создаёт STTClient с подставленными env-переменными для SpeechKit.
+
+    Скачивание аудио всегда успешно, ответ SpeechKit задаёт speechkit_handler.
     """
     monkeypatch.setenv("YANDEX_SPEECHKIT_API_KEY", "dummy-key")
     monkeypatch.setenv("YANDEX_SPEECHKIT_FOLDER_ID", "dummy-folder")
-    return STTClient()
 
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            assert str(request.url) == AUDIO_URL
+            return httpx.Response(200, content=b"FAKEOGGDATA")
+        return speechkit_handler(request)
 
-def test_stt_transcribe_success(monkeypatch):
+    return STTClient(
+        transport=HttpTransport(transport=httpx.MockTransport(handler)),
+        resilience=Resilience("stt", base_delay=0),
+    )
+
+
+@pytest.mark.asyncio
+async def test_stt_transcribe_success(monkeypatch):
     """
     Успешный сценарий:
     - audio_url скачивается без ошибок;
     - SpeechKit возвращает 200 и JSON с полем "result".
     """
-    client = make_client_with_env(monkeypatch)
-
-    def mock_get(url: str, timeout: int = 10):
-        assert url == "https://example.com/audio.ogg"
-        return DummyResponse(status_code=200, content=b"FAKEOGGDATA")
+    def speechkit(request: httpx.Request) -> httpx.Response:
+        assert str(request.url).startswith(STTClient.STT_ENDPOINT)
+        assert request.url.params["lang"] == "ru-RU"
+        assert request.url.params["folderId"] == "dummy-folder"
+        assert request.headers["Authorization"].startswith("Api-Key ")
+        assert request.content == b"FAKEOGGDATA"
+        return httpx.Response(200, json={"result": "Привет, это распознанный текст"})
 
-    def mock_post(url: str, params=None, data=None, headers=None, timeout: int = 15):
-        assert url == STTClient.STT_ENDPOINT
-        assert params["lang"] == "ru-RU"
-        assert params["folderId"] == "dummy-folder"
-        assert headers["Authorization"].startswith("Api-Key ")
-        return DummyResponse(
-            status_code=200,
-            json_data={"result": "Привет, это распознанный текст"},
-        )
+    client = make_client_with_env(monkeypatch, speechkit)
 
-    import app.clients.stt_client as stt_module
-
-    monkeypatch.setattr(stt_module.requests, "get", mock_get)
-    monkeypatch.setattr(stt_module.requests, "post", mock_post)
-
-    text = client.transcribe("https://example.com/audio.ogg")
+    text = await client.transcribe(AUDIO_URL)
     assert text == "Привет, это распознанный текст"
 
 
-def test_stt_transcribe_non_200_from_speechkit(monkeypatch):
+@pytest.mark.asyncio
+async def test_stt_transcribe_non_200_from_speechkit(monkeypatch):
     """
     SpeechKit вернул не 200 — ожидаем STTClientError.
     """
-    client = make_client_with_env(monkeypatch)
-
-    def mock_get(url: str, timeout: int = 10):
-        return DummyResponse(status_code=200, content=b"FAKEOGGDATA")
-
-    def mock_post(url: str, params=None, data=None, headers=None, timeout: int = 15):
-        return DummyResponse(status_code=500, text="Internal error")
-
-    import app.clients.stt_client as stt_module
-
-    monkeypatch.setattr(stt_module.requests, "get", mock_get)
-    monkeypatch.setattr(stt_module.requests, "post", mock_post)
+    client = make_client_with_env(
+        monkeypatch, lambda request: httpx.Response(500, text="Internal error")
+    )
 
     with pytest.raises(STTClientError) as exc_info:
-        client.transcribe("https://example.com/audio.ogg")
+        await client.transcribe(AUDIO_URL)
 
     assert "status 500" in str(exc_info.value) or "status 5" in str(exc_info.value)
 
 
-def test_stt_transcribe_speechkit_error_code(monkeypatch):
+@pytest.mark.asyncio
+async def test_stt_transcribe_speechkit_error_code(monkeypatch):
     """
     SpeechKit вернул error_code в JSON — ожидаем STTClientError.
     """
-    client = make_client_with_env(monkeypatch)
-
-    def mock_get(url: str, timeout: int = 10):
-        return DummyResponse(status_code=200, content=b"FAKEOGGDATA")
-
-    def mock_post(url: str, params=None, data=None, headers=None, timeout: int = 15):
-        return DummyResponse(
-            status_code=200,
-            json_data={
+    client = make_client_with_env(
+        monkeypatch,
+        lambda request: httpx.Response(
+            200,
+            json={
                 "error_code": "BAD_AUDIO",
                 "error_message": "Audio format not supported",
             },
-        )
-
-    import app.clients.stt_client as stt_module
-
-    monkeypatch.setattr(stt_module.requests, "get", mock_get)
-    monkeypatch.setattr(stt_module.requests, "post", mock_post)
+        ),
+    )
 
     with pytest.raises(STTClientError) as exc_info:
-        client.transcribe("https://example.com/audio.ogg")
+        await client.transcribe(AUDIO_URL)
 
     assert "BAD_AUDIO" in str(exc_info.value)
 
 
-def test_stt_transcribe_empty_result(monkeypatch):
+@pytest.mark.asyncio
+async def test_stt_transcribe_empty_result(monkeypatch):
     """
     SpeechKit вернул пустой result — ожидаем STTClientError.
     """
-    client = make_client_with_env(monkeypatch)
+    client = make_client_with_env(
+        monkeypatch, lambda request: httpx.Response(200, json={"result": ""})
+    )
 
-    def mock_get(url: str, timeout: int = 10):
-        return DummyResponse(status_code=200, content=b"FAKEOGGDATA")
+    with pytest.raises(STTClientError) as exc_info:
+        await client.transcribe(AUDIO_URL)
 
-    def mock_post(url: str, params=None, data=None, headers=None, timeout: int = 15):
-        return DummyResponse(status_code=200, json_data={"result": ""})
+    assert "empty result" in str(exc_info.value).lower()
 
-    import app.clients.stt_client as stt_module
 
-    monkeypatch.setattr(stt_module.requests, "get", mock_get)
-    monkeypatch.setattr(stt_module.requests, "post", mock_post)
+class AudioStream(httpx.AsyncByteStream):
+    """Тело ответа Avito, которое отмечает, читали ли его."""
 
-    with pytest.raises(STTClientError) as exc_info:
-        client.transcribe("https://example.com/audio.ogg")
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
 
-    assert "empty result" in str(exc_info.value).lower()
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.read += len(chunk)
+            yield chunk
+
+
+def make_relay_client(monkeypatch, download, speechkit_handler, **kwargs):
+    monkeypatch.setenv("YANDEX_SPEECHKIT_API_KEY", "dummy-key")
+    monkeypatch.setenv("YANDEX_SPEECHKIT_FOLDER_ID", "dummy-folder")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            return download()
+        return speechkit_handler(request)
+
+    return STTClient(
+        transport=HttpTransport(transport=httpx.MockTransport(handler)),
+        resilience=Resilience("stt", base_delay=0),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_stt_relays_audio_in_chunks(monkeypatch):
+    """Аудио уходит в SpeechKit кусками по chunk_size, с Content-Length."""
+    audio = b"x" * 10_000
+    uploads = []
+
+    def speechkit(request: httpx.Request) -> httpx.Response:
+        uploads.append(request)
+        return httpx.Response(200, json={"result": "текст"})
+
+    client = make_relay_client(
+        monkeypatch,
+        lambda: httpx.Response(200, headers={"Content-Length": str(len(audio))}, stream=AudioStream([audio])),
+        speechkit,
+        chunk_size=4096,
+    )
+    chunk_sizes = []
+    relay_chunks = client._audio_chunks
+
+    async def spy(spool):
+        async for chunk in relay_chunks(spool):
+            chunk_sizes.append(len(chunk))
+            yield chunk
+
+    client._audio_chunks = spy
+
+    assert await client.transcribe(AUDIO_URL) == "текст"
+    assert uploads[0].content == audio
+    assert uploads[0].headers["Content-Length"] == str(len(audio))
+    assert chunk_sizes == [4096, 4096, 1808]
+
+
+@pytest.mark.asyncio
+async def test_stt_rejects_oversized_audio_by_content_length(monkeypatch):
+    """Content-Length больше лимита — тело не читается, SpeechKit не вызывается."""
+    body = AudioStream([b"x" * 2048])
+    uploads = []
+
+    client = make_relay_client(
+        monkeypatch,
+        lambda: httpx.Response(200, headers={"Content-Length": "2048"}, stream=body),
+        lambda request: uploads.append(request) or httpx.Response(200, json={"result": "текст"}),
+        max_audio_bytes=1024,
+    )
+
+    with pytest.raises(STTClientError, match="too large"):
+        await client.transcribe(AUDIO_URL)
+
+    assert body.read == 0
+    assert uploads == []
+
+
+@pytest.mark.asyncio
+async def test_stt_aborts_download_when_stream_exceeds_limit(monkeypatch):
+    """Без Content-Length лимит проверяется по мере чтения, лишнее не дочитывается и не отправляется."""
+    body = AudioStream([b"x" * 512] * 10)
+    calls = []
+    uploads = []
+
+    def download() -> httpx.Response:
+        calls.append(1)
+        return httpx.Response(200, stream=body)
+
+    client = make_relay_client(
+        monkeypatch,
+        download,
+        lambda request: uploads.append(request) or httpx.Response(200, json={"result": "текст"}),
+        max_audio_bytes=1024,
+        chunk_size=512,
+    )
+
+    with pytest.raises(STTClientError, match="too large"):
+        await client.transcribe(AUDIO_URL)
+
+    assert body.read == 512 * 3
+    assert uploads == []
+    # Превышение лимита — не сбой сервиса, повторов нет
+    assert calls == [1]
+
+
+@pytest.mark.asyncio
+async def test_stt_cache_skips_download_and_speechkit(monkeypatch):
+    """Повтор по тому же URL не скачивает файл, тот же файл по другому URL не идёт в SpeechKit."""
+    downloads = []
+    uploads = []
+
+    def download() -> httpx.Response:
+        downloads.append(1)
+        return httpx.Response(200, content=b"FAKEOGGDATA")
+
+    def speechkit(request: httpx.Request) -> httpx.Response:
+        uploads.append(request)
+        return httpx.Response(200, json={"result": "Привет"})
+
+    cache = TranscriptionCache(path=None)
+    client = make_relay_client(monkeypatch, download, speechkit, cache=cache)
+
+    assert await client.transcribe(AUDIO_URL) == "Привет"
+    assert await client.transcribe(AUDIO_URL) == "Привет"
+    assert (len(downloads), len(uploads)) == (1, 1)
+
+    assert await client.transcribe("https://example.com/audio.ogg?signature=new") == "Привет"
+    assert (len(downloads), len(uploads)) == (2, 1)
+
+    stats = cache.stats()
+    assert (stats["url_hits"], stats["content_hits"], stats["misses"]) == (1, 1, 1)
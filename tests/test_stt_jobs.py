@@ -0,0 +1,254 @@
+import asyncio
+import base64
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.clients.http_transport import HttpTransport
+from app.clients.resilience import Resilience
+from app.clients.stt_client import STTClient, STTOperationError
+from app.conversation import ConversationStore
+from app.pipeline import WebhookPipeline
+from app.schemas_avito import AvitoWebhook
+from app.semantic_cache import SemanticCache
+from app.stt_jobs import RecognitionJobScheduler
+from app.token_store import AvitoTokens
+from app.transcription_cache import TranscriptionCache
+
+
+AUDIO = b"LONGOGGDATA" * 100
+
+
+class StubSpeechKit:
+    """
+    Локальный HTTP-сервер с API асинхронного распознавания SpeechKit:
+    аудиофайл, создание операции, опрос операции и выдача результата.
+    Операция становится готовой после ready_after опросов.
+    """
+
+    def __init__(self, ready_after: int = 3, error: dict | None = None) -> None:
+        self.ready_after = ready_after
+        self.error = error
+        self.submitted = []
+        self.polls = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/audio.ogg":
+                    self._reply(200, AUDIO, "audio/ogg")
+                elif url.path == "/operations/op-1":
+                    self._reply(200, json.dumps(stub._operation()).encode())
+                elif url.path == "/stt/v3/getRecognition":
+                    assert parse_qs(url.query)["operationId"] == ["op-1"]
+                    lines = [
+                        {"result": {"final": {"alternatives": [{"text": "добрый день"}]}}},
+                        {"result": {"finalRefinement": {"normalizedText": {"alternatives": [{"text": "Добрый день."}]}}}},
+                        {"result": {"finalRefinement": {"normalizedText": {"alternatives": [{"text": "Машина ещё продаётся?"}]}}}},
+                    ]
+                    self._reply(200, "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode())
+                else:
+                    self._reply(404, b"{}")
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                assert self.path == "/stt/v3/recognizeFileAsync"
+                assert self.headers["Authorization"] == "Api-Key dummy-key"
+                stub.submitted.append(body)
+                self._reply(200, json.dumps({"id": "op-1", "done": False}).encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _operation(self) -> dict:
+        with self._lock:
+            self.polls += 1
+            if self.polls < self.ready_after:
+                return {"id": "op-1", "done": False}
+        if self.error is not None:
+            return {"id": "op-1", "done": True, "error": self.error}
+        return {"id": "op-1", "done": True, "response": {}}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_client(monkeypatch, stub: StubSpeechKit) -> STTClient:
+    monkeypatch.setenv("YANDEX_SPEECHKIT_API_KEY", "dummy-key")
+    monkeypatch.setenv("YANDEX_SPEECHKIT_FOLDER_ID", "dummy-folder")
+    return STTClient(
+        transport=HttpTransport(),
+        resilience=Resilience("stt", base_delay=0),
+        async_base_url=stub.base_url,
+        operation_base_url=stub.base_url,
+    )
+
+
+@pytest.mark.asyncio
+async def test_scheduler_polls_operation_with_backoff_until_ready(monkeypatch):
+    done = asyncio.Event()
+    results = []
+
+    async def on_done(job, text):
+        results.append((job.payload, job.polls, text))
+        done.set()
+
+    with StubSpeechKit(ready_after=3) as stub:
+        client = make_client(monkeypatch, stub)
+        scheduler = RecognitionJobScheduler(client, on_done, initial_delay=0.01, max_delay=0.05, backoff=2)
+        await scheduler.start()
+        try:
+            job = await scheduler.submit(f"{stub.base_url}/audio.ogg", "webhook-1")
+            assert scheduler.stats()["pending"] == 1
+            await asyncio.wait_for(done.wait(), timeout=5)
+        finally:
+            await scheduler.stop()
+            await client.transport.aclose()
+
+    assert base64.b64decode(stub.submitted[0]["content"]) == AUDIO
+    model = stub.submitted[0]["recognitionModel"]
+    assert model["textNormalization"]["textNormalization"] == "TEXT_NORMALIZATION_ENABLED"
+    assert results == [("webhook-1", 3, "Добрый день. Машина ещё продаётся?")]
+    assert job.delay == pytest.approx(0.04)
+    assert scheduler.stats() == {"pending": 0, "polling": 0, "submitted": 1, "completed": 1, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_reports_failed_operation(monkeypatch):
+    failed = asyncio.Event()
+    errors = []
+
+    async def on_done(job, text):
+        raise AssertionError("operation must fail")
+
+    async def on_error(job, exc):
+        errors.append(exc)
+        failed.set()
+
+    with StubSpeechKit(ready_after=1, error={"code": 3, "message": "bad audio"}) as stub:
+        client = make_client(monkeypatch, stub)
+        scheduler = RecognitionJobScheduler(client, on_done, on_error=on_error, initial_delay=0.01)
+        await scheduler.start()
+        try:
+            await scheduler.submit(f"{stub.base_url}/audio.ogg", "webhook-1")
+            await asyncio.wait_for(failed.wait(), timeout=5)
+        finally:
+            await scheduler.stop()
+            await client.transport.aclose()
+
+    assert isinstance(errors[0], STTOperationError)
+    assert "bad audio" in str(errors[0])
+    assert scheduler.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("evicted", [False, True])
+async def test_long_voice_webhook_is_resumed_after_async_recognition(monkeypatch, tmp_path, evicted):
+    """
+    Длинное голосовое: воркер только ставит задачу и освобождается,
+    а после распознавания вебхук возвращается в конвейер и получает ответ —
+    даже если запись кэша распознаваний к тому времени вытеснена.
+    """
+    from app import main as main_module
+
+    monkeypatch.setattr(main_module.avito_token_store, "path", str(tmp_path / "tokens.json"))
+    main_module.avito_token_store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS",
+            refresh_token="REFRESH",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+            account_id="42",
+        )
+    )
+
+    processed = []
+    sent = []
+
+    async def process(webhook):
+        processed.append(await main_module.process_avito_webhook(webhook))
+
+    async def mock_generate_reply(user_message: str, system_prompt: str | None = None, history=None) -> str:
+        return f"Ответ на: {user_message}"
+
+    async def mock_send_text_message(chat_id: str, text: str, access_token: str, account_id=None) -> None:
+        sent.append(text)
+
+    with StubSpeechKit(ready_after=2) as stub:
+        client = make_client(monkeypatch, stub)
+        pipeline = WebhookPipeline(process, workers=1, name="test_pipeline")
+        scheduler = RecognitionJobScheduler(
+            client, main_module._resume_after_transcription, initial_delay=0.01, max_delay=0.02
+        )
+        monkeypatch.setattr(main_module, "transcription_cache", TranscriptionCache(path=None))
+        if evicted:
+            monkeypatch.setattr(main_module.transcription_cache, "get_by_url", lambda url: None)
+        monkeypatch.setattr(main_module, "semantic_cache", SemanticCache(directory=str(tmp_path / "semantic")))
+        monkeypatch.setattr(main_module, "conversation_store", ConversationStore(directory=None))
+        monkeypatch.setattr(main_module, "webhook_pipeline", pipeline)
+        monkeypatch.setattr(main_module, "stt_jobs", scheduler)
+        monkeypatch.setattr(main_module.perplexity_client, "agenerate_reply", mock_generate_reply)
+        monkeypatch.setattr(main_module.avito_messenger_client, "send_text_message", mock_send_text_message)
+
+        webhook = AvitoWebhook(**{
+            "id": "wh_long_voice",
+            "version": 1,
+            "timestamp": "2025-01-01T13:00:00Z",
+            "payload": {
+                "type": "message",
+                "value": {
+                    "id": "msg_long_voice",
+                    "chat_id": "chat_1",
+                    "user_id": "user_1",
+                    "author_id": "user_1",
+                    "created": "2025-01-01T13:00:00Z",
+                    "type": "voice",
+                    "content": {"audio_url": f"{stub.base_url}/audio.ogg", "duration_ms": 95000},
+                },
+            },
+        })
+
+        await pipeline.start()
+        await scheduler.start()
+        try:
+            pipeline.submit(webhook)
+            for _ in range(500):
+                if len(processed) == 2:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await scheduler.stop()
+            await pipeline.stop(drain_timeout=1)
+            await client.transport.aclose()
+
+    assert processed[0]["status"] == "stt_pending"
+    assert processed[1]["recognized_text"] == "Добрый день. Машина ещё продаётся?"
+    assert processed[1]["assistant_reply"] == "Ответ на: Добрый день. Машина ещё продаётся?"
+    assert sent == ["Ответ на: Добрый день. Машина ещё продаётся?"]
+    assert len(stub.submitted) == 1
@@ -24,3 +24,40 @@ def test_avito_token_store_save_and_load(tmp_path):
     assert loaded.refresh_token == "REFRESH"
     # по времени просто проверим тип
     assert isinstance(loaded.expires_at, datetime)
+
+
+def test_avito_token_store_serves_reads_from_memory(tmp_path, monkeypatch):
+    store = AvitoTokenStore(path=str(tmp_path / "tokens.json"))
+    store.save_default_tokens(
+        AvitoTokens(
+            access_token="ACCESS",
+            refresh_token="REFRESH",
+            expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+    )
+
+    def fail_load():
+        raise AssertionError("cached read must not touch the file")
+
+    monkeypatch.setattr(store, "_load_all", fail_load)
+
+    loaded = store.get_default_tokens()
+    assert loaded.access_token == "ACCESS"
+
+    # Изменение полученного объекта не портит кэш
+    loaded.account_id = "changed"
+    assert store.get_default_tokens().account_id is None
+
+
+def test_avito_token_store_sees_tokens_rotated_by_another_process(tmp_path):
+    path = str(tmp_path / "tokens.json")
+    worker = AvitoTokenStore(path=path)
+    leader = AvitoTokenStore(path=path)
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    leader.save_default_tokens(AvitoTokens("ACCESS_0", "REFRESH_0", expires_at, account_id="42"))
+    assert worker.get_tokens("42").refresh_token == "REFRESH_0"
+
+    # Ведущий воркер обновил токены — остальные не должны refresh-ить старым refresh_token
+    leader.save_tokens(AvitoTokens("ACCESS_1", "REFRESH_1", expires_at + timedelta(hours=1), account_id="42"))
+    assert worker.get_tokens("42").refresh_token == "REFRESH_1"
+    assert worker.get_default_tokens().access_token == "ACCESS_1"
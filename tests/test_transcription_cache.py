@@ -0,0 +1,86 @@
+import hashlib
+import json
+
+from app.transcription_cache import TranscriptionCache
+
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_lookup_by_url_and_by_content_hash():
+    cache = TranscriptionCache(path=None)
+    cache.put("https://avito.test/a.ogg", sha(b"audio"), "Привет")
+
+    assert cache.get_by_url("https://avito.test/a.ogg") == "Привет"
+    assert cache.get_by_url("https://avito.test/b.ogg") is None
+    # Тот же файл по новой ссылке находится по хэшу, и ссылка запоминается
+    assert cache.get_by_hash(sha(b"audio"), url="https://avito.test/b.ogg") == "Привет"
+    assert cache.get_by_url("https://avito.test/b.ogg") == "Привет"
+    assert cache.get_by_hash(sha(b"other")) is None
+
+    stats = cache.stats()
+    assert stats["url_hits"] == 2
+    assert stats["content_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.75
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.transcription_cache.time.time", lambda: now[0])
+    cache = TranscriptionCache(path=None, ttl_seconds=60)
+    cache.put("https://avito.test/a.ogg", sha(b"audio"), "Привет")
+
+    now[0] += 59
+    assert cache.get_by_url("https://avito.test/a.ogg") == "Привет"
+    now[0] += 2
+    assert cache.get_by_url("https://avito.test/a.ogg") is None
+    assert cache.get_by_hash(sha(b"audio")) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TranscriptionCache(path=None, max_entries=2)
+    cache.put("u1", sha(b"1"), "один")
+    cache.put("u2", sha(b"2"), "два")
+    assert cache.get_by_url("u1") == "один"
+    cache.put("u3", sha(b"3"), "три")
+
+    assert cache.get_by_url("u2") is None
+    assert cache.get_by_url("u1") == "один"
+    assert cache.get_by_url("u3") == "три"
+
+
+def test_cache_survives_restart(tmp_path):
+    path = tmp_path / "transcriptions.json"
+    cache = TranscriptionCache(path=str(path))
+    cache.put("https://avito.test/a.ogg", sha(b"audio"), "Привет")
+    # put() только помечает кэш изменённым — файл пишет фоновый поток или close()
+    cache.close()
+
+    assert json.loads(path.read_text(encoding="utf-8"))["entries"][0][0] == sha(b"audio")
+
+    restored = TranscriptionCache(path=str(path))
+    assert restored.get_by_url("https://avito.test/a.ogg") == "Привет"
+    assert restored.purge() == 1
+    assert TranscriptionCache(path=str(path)).get_by_hash(sha(b"audio")) is None
+
+
+def test_put_does_not_write_the_file(tmp_path, monkeypatch):
+    path = tmp_path / "transcriptions.json"
+    cache = TranscriptionCache(path=str(path), flush_interval=60)
+    writes = []
+    write = cache._write
+    monkeypatch.setattr(cache, "_write", lambda data: (writes.append(data), write(data)))
+
+    for i in range(3):
+        cache.put(f"u{i}", sha(str(i).encode()), f"текст {i}")
+    assert writes == []
+    assert not path.exists()
+
+    cache.flush()
+    cache.flush()  # без изменений повторно не пишет
+    assert len(writes) == 1
+    assert len(TranscriptionCache(path=str(path))) == 3
+    cache.close()